@@ -1,13 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-import httpx
 
-from app.database import get_db
+from app.database import get_async_db
 from app.core.config import settings
 from app.models.user import User
-from app.services.auth_service import create_access_token, get_current_user
+from app.services.http_client import get_graph_client
+from app.services.auth_cache import UserPrincipal
+from app.services.auth_service import (
+    create_access_token,
+    get_current_principal,
+    get_current_user,
+    revoke_access_token,
+    security
+)
 from app.schemas.auth import TokenResponse, UserResponse
 
 router = APIRouter()
@@ -30,7 +39,7 @@ async def facebook_login():
 
 
 @router.get("/callback")
-async def facebook_callback(code: str, db: Session = Depends(get_db)):
+async def facebook_callback(code: str, db: AsyncSession = Depends(get_async_db)):
     """
     Handle Facebook OAuth callback.
     Exchanges authorization code for access token and creates/updates user.
@@ -39,43 +48,44 @@ async def facebook_callback(code: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Authorization code not provided")
     
     # Exchange code for access token
-    async with httpx.AsyncClient() as client:
-        token_response = await client.get(
-            "https://graph.facebook.com/v18.0/oauth/access_token",
-            params={
-                "client_id": settings.FACEBOOK_APP_ID,
-                "client_secret": settings.FACEBOOK_APP_SECRET,
-                "redirect_uri": settings.FACEBOOK_REDIRECT_URI,
-                "code": code,
-            }
-        )
-        
-        if token_response.status_code != 200:
-            raise HTTPException(
-                status_code=400, 
-                detail="Failed to exchange code for access token"
-            )
-        
-        token_data = token_response.json()
-        access_token = token_data.get("access_token")
-        expires_in = token_data.get("expires_in", 5184000)  # Default 60 days
-        
-        # Get user info from Facebook
-        user_response = await client.get(
-            "https://graph.facebook.com/v18.0/me",
-            params={
-                "fields": "id,name,email",
-                "access_token": access_token
-            }
+    client = get_graph_client()
+    token_response = await client.get(
+        f"{settings.GRAPH_BASE_URL}/oauth/access_token",
+        params={
+            "client_id": settings.FACEBOOK_APP_ID,
+            "client_secret": settings.FACEBOOK_APP_SECRET,
+            "redirect_uri": settings.FACEBOOK_REDIRECT_URI,
+            "code": code,
+        }
+    )
+    
+    if token_response.status_code != 200:
+        raise HTTPException(
+            status_code=400, 
+            detail="Failed to exchange code for access token"
         )
-        
-        if user_response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to get user info")
-        
-        user_data = user_response.json()
-        
+    
+    token_data = token_response.json()
+    access_token = token_data.get("access_token")
+    expires_in = token_data.get("expires_in", 5184000)  # Default 60 days
+    
+    # Get user info from Facebook
+    user_response = await client.get(
+        f"{settings.GRAPH_BASE_URL}/me",
+        params={
+            "fields": "id,name,email",
+            "access_token": access_token
+        }
+    )
+    
+    if user_response.status_code != 200:
+        raise HTTPException(status_code=400, detail="Failed to get user info")
+    
+    user_data = user_response.json()
+    
     # Create or update user in database
-    user = db.query(User).filter(User.facebook_id == user_data["id"]).first()
+    result = await db.execute(select(User).where(User.facebook_id == user_data["id"]))
+    user = result.scalars().first()
     
     if user:
         user.access_token = access_token
@@ -93,8 +103,8 @@ async def facebook_callback(code: str, db: Session = Depends(get_db)):
         )
         db.add(user)
     
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     # Create JWT token for our app
     jwt_token = create_access_token(data={"sub": str(user.id)})
@@ -111,8 +121,11 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 
 
 @router.post("/logout")
-async def logout(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Logout user (invalidate tokens)"""
-    # In a production app, you would invalidate the JWT token here
-    # For now, we'll just return success
+async def logout(
+    current_user: UserPrincipal = Depends(get_current_principal),
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Logout user (revoke the access token until it expires)"""
+    await revoke_access_token(db, credentials.credentials)
     return {"message": "Logged out successfully"}
@@ -1,12 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
-from app.database import get_db
-from app.models.user import User
+from app.database import get_async_db
 from app.models.instagram_account import InstagramAccount
 from app.models.automation_rule import AutomationRule, RuleStatus
-from app.services.auth_service import get_current_user
+from app.services.auth_cache import UserPrincipal
+from app.services.auth_service import get_current_principal
+from app.services.rule_cache import bump_rules_version
+from app.services.timer_engine import reschedule_rule
+from app.services.trigger_store import trigger_store
 from app.schemas.automation import (
     AutomationRuleCreate,
     AutomationRuleUpdate,
@@ -19,15 +23,18 @@ router = APIRouter()
 async def create_automation_rule(
     rule_data: AutomationRuleCreate,
     account_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new automation rule"""
     # Verify account belongs to user
-    instagram_account = db.query(InstagramAccount).filter(
-        InstagramAccount.id == account_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(InstagramAccount).where(
+            InstagramAccount.id == account_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    instagram_account = result.scalars().first()
     
     if not instagram_account:
         raise HTTPException(status_code=404, detail="Instagram account not found")
@@ -49,8 +56,11 @@ async def create_automation_rule(
     )
     
     db.add(rule)
-    db.commit()
-    db.refresh(rule)
+    await db.flush()
+    await reschedule_rule(db, rule)
+    await bump_rules_version(db, account_id)
+    await db.commit()
+    await db.refresh(rule)
     
     return rule
 
@@ -58,22 +68,28 @@ async def create_automation_rule(
 @router.get("/rules", response_model=List[AutomationRuleResponse])
 async def get_automation_rules(
     account_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all automation rules for an account"""
     # Verify account belongs to user
-    instagram_account = db.query(InstagramAccount).filter(
-        InstagramAccount.id == account_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(InstagramAccount).where(
+            InstagramAccount.id == account_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    instagram_account = result.scalars().first()
     
     if not instagram_account:
         raise HTTPException(status_code=404, detail="Instagram account not found")
     
-    rules = db.query(AutomationRule).filter(
-        AutomationRule.instagram_account_id == account_id
-    ).order_by(AutomationRule.priority.desc(), AutomationRule.created_at.desc()).all()
+    result = await db.execute(
+        select(AutomationRule).where(
+            AutomationRule.instagram_account_id == account_id
+        ).order_by(AutomationRule.priority.desc(), AutomationRule.created_at.desc())
+    )
+    rules = result.scalars().all()
     
     return rules
 
@@ -81,14 +97,17 @@ async def get_automation_rules(
 @router.get("/rules/{rule_id}", response_model=AutomationRuleResponse)
 async def get_automation_rule(
     rule_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get a specific automation rule"""
-    rule = db.query(AutomationRule).join(InstagramAccount).filter(
-        AutomationRule.id == rule_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(AutomationRule).join(InstagramAccount).where(
+            AutomationRule.id == rule_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    rule = result.scalars().first()
     
     if not rule:
         raise HTTPException(status_code=404, detail="Automation rule not found")
@@ -100,25 +119,33 @@ async def get_automation_rule(
 async def update_automation_rule(
     rule_id: int,
     rule_data: AutomationRuleUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update an automation rule"""
-    rule = db.query(AutomationRule).join(InstagramAccount).filter(
-        AutomationRule.id == rule_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(AutomationRule).join(InstagramAccount).where(
+            AutomationRule.id == rule_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    rule = result.scalars().first()
     
     if not rule:
         raise HTTPException(status_code=404, detail="Automation rule not found")
     
     # Update fields
+    schedule_before = (rule.trigger_type, rule.trigger_schedule, rule.status)
     update_data = rule_data.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         setattr(rule, field, value)
     
-    db.commit()
-    db.refresh(rule)
+    # Re-arming restarts the schedule from now, so only do it when the schedule itself changed
+    if (rule.trigger_type, rule.trigger_schedule, rule.status) != schedule_before:
+        await reschedule_rule(db, rule)
+    await bump_rules_version(db, rule.instagram_account_id)
+    await db.commit()
+    await db.refresh(rule)
     
     return rule
 
@@ -126,20 +153,26 @@ async def update_automation_rule(
 @router.delete("/rules/{rule_id}")
 async def delete_automation_rule(
     rule_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Delete an automation rule"""
-    rule = db.query(AutomationRule).join(InstagramAccount).filter(
-        AutomationRule.id == rule_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(AutomationRule).join(InstagramAccount).where(
+            AutomationRule.id == rule_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    rule = result.scalars().first()
     
     if not rule:
         raise HTTPException(status_code=404, detail="Automation rule not found")
     
-    db.delete(rule)
-    db.commit()
+    await reschedule_rule(db, rule, deleted=True)
+    await trigger_store.delete_rule(db, rule.id)
+    await db.delete(rule)
+    await bump_rules_version(db, rule.instagram_account_id)
+    await db.commit()
     
     return {"success": True, "message": "Automation rule deleted"}
 
@@ -147,14 +180,17 @@ async def delete_automation_rule(
 @router.post("/rules/{rule_id}/toggle")
 async def toggle_automation_rule(
     rule_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Toggle automation rule status (active/inactive)"""
-    rule = db.query(AutomationRule).join(InstagramAccount).filter(
-        AutomationRule.id == rule_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(AutomationRule).join(InstagramAccount).where(
+            AutomationRule.id == rule_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    rule = result.scalars().first()
     
     if not rule:
         raise HTTPException(status_code=404, detail="Automation rule not found")
@@ -165,7 +201,9 @@ async def toggle_automation_rule(
     else:
         rule.status = RuleStatus.ACTIVE
     
-    db.commit()
-    db.refresh(rule)
+    await reschedule_rule(db, rule)
+    await bump_rules_version(db, rule.instagram_account_id)
+    await db.commit()
+    await db.refresh(rule)
     
     return {"success": True, "status": rule.status}
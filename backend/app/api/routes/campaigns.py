@@ -0,0 +1,162 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+
+from app.database import get_async_db
+from app.models.instagram_account import InstagramAccount
+from app.models.campaign import Campaign, CampaignStatus
+from app.services.auth_cache import UserPrincipal
+from app.services.auth_service import get_current_principal
+from app.services.campaign_runner import campaign_runner
+from app.schemas.campaign import CampaignCreate, CampaignProgress, CampaignResponse
+
+router = APIRouter()
+
+
+def _campaign_response(campaign: Campaign) -> CampaignResponse:
+    response = CampaignResponse.model_validate(campaign)
+    response.progress = CampaignProgress(**campaign_runner.progress(campaign))
+    return response
+
+
+async def _get_user_campaign(db: AsyncSession, campaign_id: int, user_id: int) -> Campaign:
+    result = await db.execute(
+        select(Campaign).join(InstagramAccount).where(
+            Campaign.id == campaign_id,
+            InstagramAccount.user_id == user_id
+        )
+    )
+    campaign = result.scalars().first()
+    
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    
+    return campaign
+
+
+@router.post("", response_model=CampaignResponse)
+async def create_campaign(
+    campaign_data: CampaignCreate,
+    account_id: int,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Create a broadcast campaign (as a draft; start it separately)"""
+    # Verify account belongs to user
+    result = await db.execute(
+        select(InstagramAccount).where(
+            InstagramAccount.id == account_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    instagram_account = result.scalars().first()
+    
+    if not instagram_account:
+        raise HTTPException(status_code=404, detail="Instagram account not found")
+    
+    campaign = Campaign(
+        instagram_account_id=account_id,
+        name=campaign_data.name,
+        message_text=campaign_data.message_text,
+        conversation_filter=campaign_data.conversation_filter.model_dump(),
+        status=CampaignStatus.DRAFT,
+        sent_count=0,
+        failed_count=0,
+        last_conversation_id=0
+    )
+    
+    db.add(campaign)
+    await db.commit()
+    await db.refresh(campaign)
+    
+    return _campaign_response(campaign)
+
+
+@router.get("", response_model=List[CampaignResponse])
+async def get_campaigns(
+    account_id: int,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get all campaigns for an account"""
+    result = await db.execute(
+        select(Campaign).join(InstagramAccount).where(
+            Campaign.instagram_account_id == account_id,
+            InstagramAccount.user_id == current_user.id
+        ).order_by(Campaign.created_at.desc())
+    )
+    campaigns = result.scalars().all()
+    
+    return [_campaign_response(campaign) for campaign in campaigns]
+
+
+@router.get("/{campaign_id}", response_model=CampaignResponse)
+async def get_campaign(
+    campaign_id: int,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a campaign with its progress, throughput and ETA"""
+    campaign = await _get_user_campaign(db, campaign_id, current_user.id)
+    return _campaign_response(campaign)
+
+
+@router.post("/{campaign_id}/start", response_model=CampaignResponse)
+async def start_campaign(
+    campaign_id: int,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Start a draft campaign or resume a paused one"""
+    campaign = await _get_user_campaign(db, campaign_id, current_user.id)
+    
+    if campaign.status not in (CampaignStatus.DRAFT, CampaignStatus.PAUSED):
+        raise HTTPException(status_code=409, detail=f"Campaign is {campaign.status.value}")
+    
+    # A worker still holding the lease (e.g. finishing its chunk after a pause) simply carries on;
+    # otherwise the next poll claims the campaign
+    campaign.status = CampaignStatus.RUNNING
+    await db.commit()
+    await db.refresh(campaign)
+    campaign_runner.wake()
+    
+    return _campaign_response(campaign)
+
+
+@router.post("/{campaign_id}/pause", response_model=CampaignResponse)
+async def pause_campaign(
+    campaign_id: int,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Pause a running campaign after the chunk in flight"""
+    campaign = await _get_user_campaign(db, campaign_id, current_user.id)
+    
+    if campaign.status != CampaignStatus.RUNNING:
+        raise HTTPException(status_code=409, detail=f"Campaign is {campaign.status.value}")
+    
+    campaign.status = CampaignStatus.PAUSED
+    await db.commit()
+    await db.refresh(campaign)
+    
+    return _campaign_response(campaign)
+
+
+@router.post("/{campaign_id}/cancel", response_model=CampaignResponse)
+async def cancel_campaign(
+    campaign_id: int,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Cancel a campaign; recipients not reached yet are skipped"""
+    campaign = await _get_user_campaign(db, campaign_id, current_user.id)
+    
+    if campaign.status in (CampaignStatus.COMPLETED, CampaignStatus.CANCELLED):
+        raise HTTPException(status_code=409, detail=f"Campaign is {campaign.status.value}")
+    
+    campaign.status = CampaignStatus.CANCELLED
+    await db.commit()
+    await db.refresh(campaign)
+    
+    return _campaign_response(campaign)
@@ -1,14 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime, timedelta
 
-from app.database import get_db
+from app.core.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, keyset_before, keyset_order
+from app.database import get_async_db
 from app.models.user import User
 from app.models.instagram_account import InstagramAccount
 from app.models.message import Conversation, Message
-from app.services.auth_service import get_current_user
+from app.services.auth_cache import UserPrincipal
+from app.services.auth_service import get_current_principal, get_current_user
 from app.services.instagram_service import InstagramService
+from app.services.account_cache import account_cache
+from app.services.send_scheduler import send_scheduler
 from app.schemas.instagram import (
     InstagramAccountResponse,
     ConnectInstagramAccountRequest,
@@ -22,7 +27,7 @@ router = APIRouter()
 @router.get("/accounts", response_model=List[dict])
 async def get_available_instagram_accounts(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all Instagram Business accounts available for the user"""
     try:
@@ -35,14 +40,20 @@ async def get_available_instagram_accounts(
 @router.post("/connect", response_model=InstagramAccountResponse)
 async def connect_instagram_account(
     account_data: ConnectInstagramAccountRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Connect an Instagram Business account to the user"""
     # Check if account already exists
-    existing = db.query(InstagramAccount).filter(
-        InstagramAccount.instagram_business_account_id == account_data.instagram_business_account_id
-    ).first()
+    result = await db.execute(
+        select(InstagramAccount).where(
+            InstagramAccount.instagram_business_account_id == account_data.instagram_business_account_id
+        )
+    )
+    existing = result.scalars().first()
+    token_expires_at = None
+    if account_data.expires_in:
+        token_expires_at = datetime.utcnow() + timedelta(seconds=account_data.expires_in)
     
     if existing:
         # Update existing account
@@ -50,10 +61,12 @@ async def connect_instagram_account(
         existing.profile_picture_url = account_data.profile_picture_url
         existing.page_id = account_data.page_id
         existing.page_access_token = account_data.page_access_token
+        existing.token_expires_at = token_expires_at
         existing.is_active = True
         existing.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(existing)
+        await db.commit()
+        account_cache.invalidate(existing.instagram_business_account_id)
+        await db.refresh(existing)
         return existing
     
     # Create new account
@@ -63,95 +76,163 @@ async def connect_instagram_account(
         username=account_data.username,
         profile_picture_url=account_data.profile_picture_url,
         page_id=account_data.page_id,
-        page_access_token=account_data.page_access_token
+        page_access_token=account_data.page_access_token,
+        token_expires_at=token_expires_at
     )
     
     db.add(instagram_account)
-    db.commit()
-    db.refresh(instagram_account)
+    await db.commit()
+    account_cache.invalidate(instagram_account.instagram_business_account_id)
+    await db.refresh(instagram_account)
     
     return instagram_account
 
 
 @router.get("/connected-accounts", response_model=List[InstagramAccountResponse])
 async def get_connected_accounts(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all connected Instagram accounts for the current user"""
-    accounts = db.query(InstagramAccount).filter(
-        InstagramAccount.user_id == current_user.id,
-        InstagramAccount.is_active == True
-    ).all()
+    result = await db.execute(
+        select(InstagramAccount).where(
+            InstagramAccount.user_id == current_user.id,
+            InstagramAccount.is_active == True
+        )
+    )
+    accounts = result.scalars().all()
     
     return accounts
 
 
-@router.get("/accounts/{account_id}/conversations", response_model=List[dict])
+@router.get("/accounts/{account_id}/conversations", response_model=List[ConversationResponse])
 async def get_account_conversations(
     account_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    refresh: bool = False,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get all conversations for an Instagram account"""
-    instagram_account = db.query(InstagramAccount).filter(
-        InstagramAccount.id == account_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    """
+    Get an account's conversations, most recent first, from the local store.
+    Pass the X-Next-Cursor header of a page as cursor to get the next one;
+    refresh=true syncs the inbox from the Graph API first.
+    """
+    result = await db.execute(
+        select(InstagramAccount).where(
+            InstagramAccount.id == account_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    instagram_account = result.scalars().first()
     
     if not instagram_account:
         raise HTTPException(status_code=404, detail="Instagram account not found")
     
-    try:
-        conversations = await InstagramService.get_conversations(instagram_account, db)
-        return conversations
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    if refresh:
+        try:
+            await InstagramService.get_conversations(instagram_account, db)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    query = select(Conversation).where(Conversation.instagram_account_id == account_id)
+    if cursor:
+        try:
+            last_message_time, conversation_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(
+            keyset_before(Conversation.last_message_time, Conversation.id, last_message_time, conversation_id)
+        )
+
+    result = await db.execute(
+        query.order_by(*keyset_order(Conversation.last_message_time, Conversation.id)).limit(limit + 1)
+    )
+    conversations = result.scalars().all()
+
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        last = conversations[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.last_message_time, last.id)
+    return conversations
 
 
-@router.get("/conversations/{conversation_id}/messages", response_model=List[dict])
+@router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
 async def get_conversation_messages(
     conversation_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    refresh: bool = False,
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Get all messages from a conversation"""
-    conversation = db.query(Conversation).join(InstagramAccount).filter(
-        Conversation.id == conversation_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    """
+    Get a conversation's messages, newest first, from the local store.
+    Pass the X-Next-Cursor header of a page as cursor to get older messages;
+    refresh=true pulls the thread from the Graph API first.
+    """
+    result = await db.execute(
+        select(Conversation, InstagramAccount).join(InstagramAccount).where(
+            Conversation.id == conversation_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    row = result.first()
     
-    if not conversation:
+    if not row:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    try:
-        messages = await InstagramService.get_messages(
-            conversation,
-            conversation.instagram_account
-        )
-        return messages
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    conversation, instagram_account = row
+    if refresh:
+        try:
+            await InstagramService.sync_messages(conversation, instagram_account, db)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    if cursor:
+        try:
+            sent_at, message_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(keyset_before(Message.sent_at, Message.id, sent_at, message_id))
+
+    result = await db.execute(
+        query.order_by(*keyset_order(Message.sent_at, Message.id)).limit(limit + 1)
+    )
+    messages = result.scalars().all()
+
+    if len(messages) > limit:
+        messages = messages[:limit]
+        last = messages[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.sent_at, last.id)
+    return messages
 
 
 @router.post("/send-message")
 async def send_message(
     message_data: SendMessageRequest,
     account_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Send a message to a user"""
-    instagram_account = db.query(InstagramAccount).filter(
-        InstagramAccount.id == account_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(InstagramAccount).where(
+            InstagramAccount.id == account_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    instagram_account = result.scalars().first()
     
     if not instagram_account:
         raise HTTPException(status_code=404, detail="Instagram account not found")
     
     try:
-        result = await InstagramService.send_message(
+        result = await send_scheduler.send(
             instagram_account,
             message_data.recipient_id,
             message_data.message_text
@@ -159,9 +240,7 @@ async def send_message(
         
         # Save message to database if conversation_id provided
         if message_data.conversation_id:
-            conversation = db.query(Conversation).filter(
-                Conversation.id == message_data.conversation_id
-            ).first()
+            conversation = await db.get(Conversation, message_data.conversation_id)
             
             if conversation:
                 message = Message(
@@ -174,7 +253,7 @@ async def send_message(
                     sent_at=datetime.utcnow()
                 )
                 db.add(message)
-                db.commit()
+                await db.commit()
         
         return {"success": True, "result": result}
     except Exception as e:
@@ -184,19 +263,23 @@ async def send_message(
 @router.delete("/accounts/{account_id}")
 async def disconnect_account(
     account_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Disconnect an Instagram account"""
-    instagram_account = db.query(InstagramAccount).filter(
-        InstagramAccount.id == account_id,
-        InstagramAccount.user_id == current_user.id
-    ).first()
+    result = await db.execute(
+        select(InstagramAccount).where(
+            InstagramAccount.id == account_id,
+            InstagramAccount.user_id == current_user.id
+        )
+    )
+    instagram_account = result.scalars().first()
     
     if not instagram_account:
         raise HTTPException(status_code=404, detail="Instagram account not found")
     
     instagram_account.is_active = False
-    db.commit()
+    await db.commit()
+    account_cache.invalidate(instagram_account.instagram_business_account_id)
     
     return {"success": True, "message": "Account disconnected"}
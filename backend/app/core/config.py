@@ -24,7 +24,100 @@ class Settings(BaseSettings):
     # API
     API_HOST: str = Field(default="0.0.0.0")
     API_PORT: int = Field(default=8000)
-    
+    API_WORKERS: int = Field(default=1)  # uvicorn worker processes; more than 1 needs WEBHOOK_PROCESSING_MODE=sharded
+    OPS_TOKEN: str = Field(default="")  # Bearer token for /metrics and /stats; empty turns both off
+
+    # Webhook processing
+    WEBHOOK_VERIFY_SIGNATURE: bool = Field(default=True)  # Check X-Hub-Signature-256 with FACEBOOK_APP_SECRET
+    WEBHOOK_PROCESSING_MODE: str = Field(default="inline")  # inline (reply after processing), queue (reply at once), sharded (publish to the event log)
+    WEBHOOK_QUEUE_MAXSIZE: int = Field(default=10000)  # Pending events across all conversation lanes
+    WEBHOOK_WORKERS: int = Field(default=8)  # Batches processed at the same time, one DB session each
+    WEBHOOK_BATCH_MAX_EVENTS: int = Field(default=500)  # Events from ready lanes processed and committed together
+    WEBHOOK_LANE_MAXSIZE: int = Field(default=1000)  # Pending events per conversation
+    WEBHOOK_ENQUEUE_TIMEOUT_SECONDS: float = Field(default=5.0)  # Wait for room before answering 503
+    WEBHOOK_SHUTDOWN_TIMEOUT_SECONDS: float = Field(default=30.0)
+    WEBHOOK_LOG_BACKEND: str = Field(default="redis")  # Sharded mode event log: redis (Streams on REDIS_URL) or memory (one process)
+    WEBHOOK_PARTITIONS: int = Field(default=64)  # Fixed once events are published; accounts are hashed onto partitions
+    WEBHOOK_STREAM_PREFIX: str = Field(default="webhooks")
+    WEBHOOK_STREAM_MAXLEN: int = Field(default=100000)  # Approximate entries kept per partition
+    WEBHOOK_SHARD_CONSUME: bool = Field(default=True)  # False: this process only publishes (intake-only nodes)
+    WEBHOOK_SHARD_READ_COUNT: int = Field(default=100)  # Entries read per partition per round
+    WEBHOOK_SHARD_HEARTBEAT_SECONDS: float = Field(default=5.0)
+    WEBHOOK_SHARD_MEMBER_TTL_SECONDS: float = Field(default=15.0)  # Consumers missing heartbeats this long lose their partitions
+    WEBHOOK_SHARD_MAX_ATTEMPTS: int = Field(default=5)  # Reads of a failing entry before it goes to the dead-letter stream
+    WEBHOOK_SHARD_RETRY_SECONDS: float = Field(default=1.0)  # Wait before re-reading a failed entry, doubled per attempt
+    WEBHOOK_DEDUP_MAX_ENTRIES: int = Field(default=100000)  # Exact LRU of recent message ids
+    WEBHOOK_DEDUP_WINDOW_SECONDS: float = Field(default=86400.0)
+
+    # Graph API HTTP client
+    GRAPH_BASE_URL: str = Field(default="https://graph.facebook.com/v18.0")  # Versioned root of every Graph API call
+    GRAPH_HTTP2: bool = Field(default=False)
+    GRAPH_MAX_CONNECTIONS: int = Field(default=100)
+    GRAPH_MAX_KEEPALIVE_CONNECTIONS: int = Field(default=20)
+    GRAPH_KEEPALIVE_EXPIRY_SECONDS: float = Field(default=30.0)
+    GRAPH_TIMEOUT_SECONDS: float = Field(default=10.0)
+    GRAPH_CONNECT_TIMEOUT_SECONDS: float = Field(default=5.0)
+    GRAPH_POOL_TIMEOUT_SECONDS: float = Field(default=5.0)
+    GRAPH_FANOUT_CONCURRENCY: int = Field(default=10)  # Parallel lookups per request, e.g. page details
+    GRAPH_BATCH_ENABLED: bool = Field(default=False)  # Coalesce concurrent calls per token into batch requests
+    GRAPH_BATCH_MAX_SIZE: int = Field(default=50)  # Graph API limit
+    GRAPH_BATCH_LINGER_SECONDS: float = Field(default=0.01)
+
+    # Outbound send scheduling (per page)
+    SEND_RATE_PER_SECOND: float = Field(default=20.0)
+    SEND_BURST: float = Field(default=20.0)
+    SEND_CONCURRENCY: int = Field(default=20)  # Sends in flight per page; the rate decides how many start
+    SEND_MIN_RATE_PER_SECOND: float = Field(default=1.0)
+    SEND_MAX_RETRIES: int = Field(default=3)
+    SEND_BACKOFF_SECONDS: float = Field(default=1.0)
+    SEND_MAX_BACKOFF_SECONDS: float = Field(default=60.0)
+    SEND_QUEUE_MAXSIZE: int = Field(default=10000)
+    SEND_LANE_IDLE_SECONDS: float = Field(default=60.0)
+
+    # Timers (delayed replies and scheduled rules)
+    TIMER_TICK_SECONDS: float = Field(default=1.0)
+    TIMER_LOAD_INTERVAL_SECONDS: float = Field(default=30.0)
+    TIMER_LOAD_HORIZON_SECONDS: float = Field(default=120.0)  # Must exceed the load interval
+    TIMER_BATCH_SIZE: int = Field(default=500)
+    TIMER_CLAIM_TIMEOUT_SECONDS: float = Field(default=300.0)
+    SCHEDULED_RULE_WINDOW_HOURS: int = Field(default=24)  # Instagram's standard messaging window
+
+    # Broadcast campaigns
+    CAMPAIGN_CONCURRENCY: int = Field(default=20)  # Sends in flight per campaign
+    CAMPAIGN_CHUNK_SIZE: int = Field(default=100)  # Recipients per checkpoint
+    CAMPAIGN_POLL_INTERVAL_SECONDS: float = Field(default=10.0)
+    CAMPAIGN_HEARTBEAT_SECONDS: float = Field(default=20.0)  # Lease renewal, independent of chunk progress
+    CAMPAIGN_STALE_SECONDS: float = Field(default=120.0)  # Resume campaigns whose worker stopped heartbeating
+
+    # Token refresh
+    TOKEN_REFRESH_INTERVAL_SECONDS: float = Field(default=3600.0)
+    TOKEN_REFRESH_LEAD_SECONDS: float = Field(default=604800.0)  # Refresh tokens expiring within this window (7 days)
+    TOKEN_REFRESH_BATCH_SIZE: int = Field(default=100)
+    TOKEN_REFRESH_CONCURRENCY: int = Field(default=5)  # Token exchanges in flight
+    TOKEN_REFRESH_RETRY_SECONDS: float = Field(default=3600.0)  # Wait before retrying a failed refresh
+    TOKEN_REFRESH_LEASE_SECONDS: float = Field(default=10800.0)  # One process refreshes; keep above the interval
+
+    # Caches
+    RULE_CACHE_MAX_ACCOUNTS: int = Field(default=10000)
+    ACCOUNT_CACHE_MAX_ENTRIES: int = Field(default=50000)
+    ACCOUNT_CACHE_TTL_SECONDS: float = Field(default=300.0)
+    ACCOUNT_CACHE_NEGATIVE_TTL_SECONDS: float = Field(default=60.0)
+    AUTH_CACHE_MAX_ENTRIES: int = Field(default=10000)
+    AUTH_CACHE_TTL_SECONDS: float = Field(default=60.0)
+    RULE_TRIGGER_CACHE_MAX_ENTRIES: int = Field(default=200000)
+    RULE_TRIGGER_FLUSH_INTERVAL_SECONDS: float = Field(default=5.0)
+
+    # Profiling (sampled requests are written as collapsed stacks for flamegraph tools)
+    PROFILING_ENABLED: bool = Field(default=False)
+    PROFILING_SAMPLE_RATE: float = Field(default=0.0)  # Fraction of requests profiled at random
+    PROFILING_HEADER: str = Field(default="X-Profile")  # Requests sending this header with PROFILING_SECRET are profiled
+    PROFILING_SECRET: str = Field(default="")  # Empty: the header never selects a request
+    PROFILING_ROUTES: str = Field(default="")  # Comma-separated path prefixes; empty means all
+    PROFILING_LATENCY_THRESHOLD_MS: float = Field(default=0.0)  # >0: profile all, keep only slower requests
+    PROFILING_INTERVAL_MS: float = Field(default=5.0)
+    PROFILING_OUTPUT_DIR: str = Field(default="profiles")
+    PROFILING_MAX_FILES: int = Field(default=200)  # Oldest profiles are deleted beyond this
+
     class Config:
         env_file = ".env"
         case_sensitive = True
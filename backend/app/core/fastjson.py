@@ -0,0 +1,27 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; the stdlib decoder gives the same result
+    orjson = None
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    Parse JSON with orjson when installed, else the stdlib decoder.
+    Both raise a ValueError subclass for malformed input.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value: Any) -> str:
+    """
+    Serialize to compact JSON text with orjson when installed, else the
+    stdlib encoder, so what one writes the other reads back unchanged.
+    """
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
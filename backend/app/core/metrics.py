@@ -0,0 +1,242 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Content type of the Prometheus text exposition format served by /metrics (charset is added by the response)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds; spans sub-millisecond cache hits to multi-second Graph API calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base for metric families; children are created once per label combination and cached"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def _render_child(self, values, child) -> List[str]:
+        return [f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # One slot per bucket plus +Inf; made cumulative only when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self) -> _Timer:
+        """Context manager observing the duration of its block"""
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+    def _render_child(self, values, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        counts = list(child.counts)
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class GaugeFunction:
+    """Gauge read at scrape time from a callback returning {label values: value}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            samples = self.callback()
+        except Exception as e:
+            print(f"Error collecting {self.name}: {e}")
+            return lines
+        for values, value in samples.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """
+    Process-wide set of metrics rendered in the Prometheus text format.
+
+    Recording is a dict lookup and an integer increment under the GIL, with
+    no locking or I/O, so instrumenting the webhook path costs microseconds.
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+webhook_stage_seconds = registry.register(Histogram(
+    "webhook_stage_seconds",
+    "Time spent per stage of webhook processing, per payload (graph_send per reply)",
+    ["stage"]
+))
+webhook_events = registry.register(Counter(
+    "webhook_events",
+    "Messaging events received in webhook payloads"
+))
+graph_requests = registry.register(Counter(
+    "graph_requests",
+    "Graph API HTTP requests by endpoint and response status",
+    ["method", "endpoint", "status"]
+))
+graph_request_seconds = registry.register(Histogram(
+    "graph_request_seconds",
+    "Graph API HTTP request latency by endpoint",
+    ["method", "endpoint"]
+))
+db_pool_wait_seconds = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the async database pool"
+))
+
+
+def graph_endpoint(path: str) -> str:
+    """
+    Collapse a Graph API path into a low-cardinality endpoint label, e.g.
+    /v18.0/17841400000000000/conversations -> /{id}/conversations.
+    """
+    segments = [segment for segment in path.split("/") if segment]
+    if segments and segments[0].startswith("v") and segments[0][1:].replace(".", "").isdigit():
+        segments = segments[1:]
+    if not segments:
+        # The version root; batches sent there are labelled per request by the batcher
+        return "/"
+    return "/" + "/".join(
+        "{id}" if segment.isdigit() or segment.startswith(("t_", "aWdf")) or len(segment) > 40 else segment
+        for segment in segments
+    )
+
+
+def register_gauge(name: str, documentation: str, labelnames: Sequence[str],
+                   callback: Callable[[], Dict[Tuple[str, ...], float]]) -> GaugeFunction:
+    """Expose a value computed at scrape time, e.g. pool occupancy"""
+    return registry.register(GaugeFunction(name, documentation, labelnames, callback))
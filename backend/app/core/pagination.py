@@ -0,0 +1,49 @@
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import func, literal_column, tuple_
+
+# Response header carrying the cursor of the next page; absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Stands in for a missing timestamp, so such rows sort after every dated row
+_NO_POSITION = literal_column("'1970-01-01 00:00:00'")
+
+
+def encode_cursor(position: Optional[datetime], row_id: int) -> str:
+    """Opaque keyset cursor for the (timestamp, id) of the last row of a page"""
+    raw = f"{position.isoformat() if position else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """Inverse of encode_cursor. Raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        position, row_id = raw.rsplit("|", 1)
+        return (datetime.fromisoformat(position) if position else None), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def keyset_position(position_column):
+    """
+    The position a keyset page sorts on: the timestamp, with NULL replaced
+    by the epoch. Keyset indexes are declared on this same expression so
+    pages are read with one range scan of the index, walked backwards.
+    """
+    return func.coalesce(position_column, _NO_POSITION)
+
+
+def keyset_order(position_column, id_column):
+    """Newest first by (position, id), rows without a position last"""
+    return keyset_position(position_column).desc(), id_column.desc()
+
+
+def keyset_before(position_column, id_column, position: Optional[datetime], row_id: int):
+    """Rows after the cursor row in keyset_order, as one row-value comparison"""
+    return tuple_(keyset_position(position_column), id_column) < tuple_(
+        position if position is not None else _NO_POSITION,
+        row_id
+    )
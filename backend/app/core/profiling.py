@@ -0,0 +1,270 @@
+import asyncio
+import hmac
+import os
+import random
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) + os.sep
+_STDLIB_DIR = sysconfig.get_paths()["stdlib"] + os.sep
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    # Keep paths short and stable across machines: relative to site-packages, the stdlib or the app
+    marker = filename.rfind("site-packages" + os.sep)
+    if marker != -1:
+        filename = filename[marker + len("site-packages") + 1:]
+    elif filename.startswith(_STDLIB_DIR):
+        filename = filename[len(_STDLIB_DIR):]
+    elif filename.startswith(_BASE_DIR):
+        filename = filename[len(_BASE_DIR):]
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _awaitable_frame(awaitable):
+    return (
+        getattr(awaitable, "cr_frame", None)
+        or getattr(awaitable, "gi_frame", None)
+        or getattr(awaitable, "ag_frame", None)
+    )
+
+
+def _awaited(awaitable):
+    return (
+        getattr(awaitable, "cr_await", None)
+        or getattr(awaitable, "gi_yieldfrom", None)
+        or getattr(awaitable, "ag_await", None)
+    )
+
+
+class _Profile:
+    """Stack samples of one request's coroutine"""
+
+    def __init__(self, coroutine, label: str):
+        self.coroutine = coroutine
+        self.label = label
+        self.thread_id = threading.get_ident()
+        self.stacks: Counter = Counter()
+
+    def sample(self, frames: Dict[int, object]):
+        coroutine = self.coroutine
+        stack: List[str] = []
+        if coroutine.cr_running:
+            # Running on the event loop thread right now: take the thread's stack down to our coroutine
+            frame = frames.get(self.thread_id)
+            while frame is not None and frame is not coroutine.cr_frame:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if frame is None:
+                return
+            stack.reverse()
+        else:
+            # Suspended: follow the await chain to where it waits (a DB driver, httpx, a lock...)
+            awaitable = coroutine.cr_await
+            while awaitable is not None:
+                frame = _awaitable_frame(awaitable)
+                if frame is None:
+                    stack.append(f"[waiting on {type(awaitable).__name__}]")
+                    break
+                stack.append(_frame_label(frame))
+                awaitable = _awaited(awaitable)
+        self.stacks[tuple(stack)] += 1
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed stack format, read by flamegraph.pl and speedscope"""
+        root = self.label.replace(";", ":").replace(" ", "_")
+        return "".join(
+            f"{';'.join((root,) + stack)} {count}\n"
+            for stack, count in self.stacks.most_common()
+        )
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for selected requests.
+
+    A daemon thread wakes every PROFILING_INTERVAL_MS while at least one
+    request is being profiled and records, for each of them, either the
+    event loop thread's stack (when the request is running) or the chain
+    of awaits it is suspended in (when it waits on I/O). Time spent in
+    SQLAlchemy, httpx and our own Python code shows up side by side.
+    Nothing runs while no request is profiled.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._active: Dict[int, _Profile] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.profiled_count = 0
+        self.sample_count = 0
+
+    def begin(self, coroutine, label: str) -> _Profile:
+        profile = _Profile(coroutine, label)
+        with self._lock:
+            self._active[id(profile)] = profile
+        self.profiled_count += 1
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+            self._thread.start()
+        self._wakeup.set()
+        return profile
+
+    def end(self, profile: _Profile):
+        with self._lock:
+            self._active.pop(id(profile), None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._active
+            if idle:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for profile in self._active.values():
+                    try:
+                        profile.sample(frames)
+                    except Exception:
+                        # The loop thread moved on while we walked its frames; drop this sample
+                        continue
+                    self.sample_count += 1
+
+    def stats(self) -> Dict:
+        return {
+            "active": len(self._active),
+            "profiled": self.profiled_count,
+            "samples": self.sample_count,
+        }
+
+
+class ProfileWriter:
+    """Writes profiles as .folded files into a directory, keeping the newest max_files"""
+
+    def __init__(self, directory: str, max_files: int):
+        self.directory = directory
+        self.max_files = max_files
+        self.written_count = 0
+
+    def write(self, profile: _Profile, duration: float) -> Optional[str]:
+        if not profile.stacks:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", profile.label).strip("-")[:80]
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{duration * 1000:.0f}ms-{slug}-{uuid.uuid4().hex[:6]}.folded"
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as handle:
+            handle.write(profile.collapsed())
+        self.written_count += 1
+        self._rotate()
+        return path
+
+    def _rotate(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".folded")]
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling a selection of requests.
+
+    A request is profiled when it sends PROFILING_HEADER set to
+    PROFILING_SECRET (unauthenticated callers, like the public webhook,
+    cannot force profiles and disk writes), when it falls in
+    the PROFILING_SAMPLE_RATE random sample, or, with
+    PROFILING_LATENCY_THRESHOLD_MS set, always, keeping the profile only
+    if the request turned out slower than the threshold. PROFILING_ROUTES
+    limits all of this to some path prefixes. Requests that are not
+    selected pay for one random() call and a header scan.
+
+    Pure ASGI rather than BaseHTTPMiddleware so the endpoint runs in the
+    request's own coroutine, which is what the sampler follows. Work the
+    request hands off to other tasks (e.g. the webhook queue) is not
+    included.
+    """
+
+    def __init__(self, app, profiler: Optional[SamplingProfiler] = None, writer: Optional[ProfileWriter] = None):
+        self.app = app
+        self.profiler = profiler or request_profiler
+        self.writer = writer or profile_writer
+        self.routes: Tuple[str, ...] = tuple(
+            route.strip() for route in settings.PROFILING_ROUTES.split(",") if route.strip()
+        )
+        self.header = (
+            settings.PROFILING_HEADER.lower().encode()
+            if settings.PROFILING_HEADER and settings.PROFILING_SECRET else None
+        )
+        self.secret = settings.PROFILING_SECRET.encode()
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.latency_threshold = settings.PROFILING_LATENCY_THRESHOLD_MS / 1000
+
+    def _selection(self, scope) -> Optional[str]:
+        if self.routes and not scope["path"].startswith(self.routes):
+            return None
+        if self.header is not None:
+            for name, value in scope["headers"]:
+                if name == self.header and hmac.compare_digest(value, self.secret):
+                    return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        if self.latency_threshold:
+            return "latency"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        selection = self._selection(scope) if scope["type"] == "http" else None
+        if selection is None:
+            await self.app(scope, receive, send)
+            return
+
+        coroutine = self.app(scope, receive, send)
+        if not asyncio.iscoroutine(coroutine):
+            await coroutine
+            return
+
+        profile = self.profiler.begin(coroutine, f"{scope['method']} {scope['path']}")
+        started = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            duration = time.perf_counter() - started
+            self.profiler.end(profile)
+            if selection != "latency" or duration >= self.latency_threshold:
+                try:
+                    await asyncio.to_thread(self.writer.write, profile, duration)
+                except Exception as e:
+                    print(f"Error writing request profile: {e}")
+
+
+request_profiler = SamplingProfiler(interval=settings.PROFILING_INTERVAL_MS / 1000)
+profile_writer = ProfileWriter(settings.PROFILING_OUTPUT_DIR, settings.PROFILING_MAX_FILES)
+
+
+def profiling_stats() -> Dict:
+    return {
+        "enabled": settings.PROFILING_ENABLED,
+        **request_profiler.stats(),
+        "written": profile_writer.written_count,
+    }
@@ -1,7 +1,13 @@
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.core.config import settings
+from app.core.metrics import db_pool_wait_seconds, register_gauge
 
 # Create database engine
 engine = create_engine(
@@ -14,9 +20,96 @@ engine = create_engine(
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def get_async_database_url(database_url: str) -> str:
+    """Map DATABASE_URL onto the asyncio driver for the same database"""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver configured for {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Async queue pool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_wait_seconds.observe(time.perf_counter() - started)
+
+# Async engine and session factory used by the request handlers, so DB
+# waits yield to the event loop instead of blocking it
+async_database_url = get_async_database_url(settings.DATABASE_URL)
+async_engine = create_async_engine(
+    async_database_url,
+    pool_pre_ping=True,
+    # aiosqlite runs without a connection pool, so sizing only applies to servers
+    **({} if async_database_url.startswith("sqlite") else {
+        "poolclass": TimedQueuePool,
+        "pool_size": 10,
+        "max_overflow": 20
+    })
+)
+
+def _pool_usage():
+    pool = async_engine.pool
+    if not isinstance(pool, AsyncAdaptedQueuePool):
+        return {}
+    return {
+        ("checked_out",): pool.checkedout(),
+        ("idle",): pool.checkedin(),
+        ("overflow",): max(pool.overflow(), 0),
+    }
+
+register_gauge("db_pool_connections", "Connections of the async database pool by state", ["state"], _pool_usage)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Base class for models
 Base = declarative_base()
 
+def insert_ignore(db, model, index_elements):
+    """
+    INSERT ... ON CONFLICT DO NOTHING for the session's dialect.
+    Rows that collide on index_elements are skipped instead of failing the batch.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"insert_ignore is not supported for {dialect}")
+    return insert(model).on_conflict_do_nothing(index_elements=index_elements)
+
+def upsert(db, model, index_elements, update_columns):
+    """
+    INSERT ... ON CONFLICT DO UPDATE for the session's dialect.
+    Rows that collide on index_elements overwrite update_columns with the new values.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"upsert is not supported for {dialect}")
+    statement = insert(model)
+    return statement.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: statement.excluded[column] for column in update_columns}
+    )
+
 # Dependency to get database session
 def get_db():
     db = SessionLocal()
@@ -24,3 +117,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency to get an async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
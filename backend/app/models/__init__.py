@@ -2,11 +2,21 @@ from .user import User
 from .instagram_account import InstagramAccount
 from .message import Message, Conversation
 from .automation_rule import AutomationRule
+from .scheduled_reply import ScheduledReply
+from .rule_trigger import RuleTrigger
+from .campaign import Campaign
+from .revoked_token import RevokedToken
+from .service_lease import ServiceLease
 
 __all__ = [
     "User",
     "InstagramAccount",
     "Message",
     "Conversation",
-    "AutomationRule"
+    "AutomationRule",
+    "ScheduledReply",
+    "RuleTrigger",
+    "Campaign",
+    "RevokedToken",
+    "ServiceLease"
 ]
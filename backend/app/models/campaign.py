@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Enum
+from sqlalchemy.sql import func
+import enum
+from app.database import Base
+
+class CampaignStatus(str, enum.Enum):
+    DRAFT = "draft"
+    RUNNING = "running"
+    PAUSED = "paused"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+class Campaign(Base):
+    __tablename__ = "campaigns"
+
+    id = Column(Integer, primary_key=True, index=True)
+    instagram_account_id = Column(Integer, ForeignKey("instagram_accounts.id", ondelete="CASCADE"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+    message_text = Column(Text, nullable=False)
+    conversation_filter = Column(JSON)  # Which conversations receive the broadcast
+    status = Column(Enum(CampaignStatus), nullable=False, default=CampaignStatus.DRAFT)
+
+    # Progress; recipients are walked in conversation id order
+    total_recipients = Column(Integer, nullable=True)  # Counted when the campaign first starts
+    sent_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    last_conversation_id = Column(Integer, default=0)  # Checkpoint: every conversation up to here is done
+    last_error = Column(Text, nullable=True)
+
+    # Lease of the worker running the campaign, renewed by its heartbeat; a stale heartbeat lets another worker resume it
+    lease_owner = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
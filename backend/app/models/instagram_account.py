@@ -13,8 +13,9 @@ class InstagramAccount(Base):
     profile_picture_url = Column(String)
     page_id = Column(String)  # Facebook Page ID
     page_access_token = Column(String)  # Page access token for API calls
-    token_expires_at = Column(DateTime)
+    token_expires_at = Column(DateTime, index=True)  # Scanned by the token refresher
     is_active = Column(Boolean, default=True)
+    rules_version = Column(Integer, default=0, server_default="0", nullable=False)  # Bumped on every rule change
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from app.core.pagination import keyset_position
 from app.database import Base
 
 class Conversation(Base):
@@ -14,6 +15,8 @@ class Conversation(Base):
     participant_profile_pic = Column(String)
     last_message_time = Column(DateTime)
     unread_count = Column(Integer, default=0)
+    inbound_count = Column(Integer, default=0, server_default="0", nullable=False)  # Messages received from the participant
+    first_inbound_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -42,3 +45,18 @@ class Message(Base):
 
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
+
+
+# Keyset pagination of an account's inbox and of a conversation's history (see app.core.pagination)
+Index(
+    "ix_conversations_account_recent",
+    Conversation.instagram_account_id,
+    keyset_position(Conversation.last_message_time),
+    Conversation.id
+)
+Index(
+    "ix_messages_conversation_recent",
+    Message.conversation_id,
+    keyset_position(Message.sent_at),
+    Message.id
+)
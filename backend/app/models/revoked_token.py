@@ -0,0 +1,10 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from app.database import Base
+
+class RevokedToken(Base):
+    """An access token logged out before its exp; kept until then"""
+    __tablename__ = "revoked_tokens"
+
+    jti = Column(String, primary_key=True)  # The token's jti claim
+    user_id = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint
+from app.database import Base
+
+class RuleTrigger(Base):
+    """How often, and when last, a rule fired for one participant"""
+    __tablename__ = "rule_triggers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # No foreign key: rows are written behind by the trigger store and may
+    # briefly outlive their rule; the delete route removes them
+    automation_rule_id = Column(Integer, nullable=False)
+    participant_id = Column(String, nullable=False)
+    trigger_count = Column(Integer, nullable=False, default=0)
+    last_triggered_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("automation_rule_id", "participant_id", name="uq_rule_triggers_rule_participant"),
+    )
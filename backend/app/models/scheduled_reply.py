@@ -0,0 +1,39 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
+from sqlalchemy.sql import func
+import enum
+from app.database import Base
+
+class TimerKind(str, enum.Enum):
+    REPLY = "reply"  # Send message_text to recipient_id
+    RULE_SCHEDULE = "rule_schedule"  # Next occurrence of a SCHEDULED rule
+
+class TimerStatus(str, enum.Enum):
+    PENDING = "pending"
+    FIRING = "firing"
+    SENT = "sent"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class ScheduledReply(Base):
+    __tablename__ = "scheduled_replies"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False, default=TimerKind.REPLY.value)
+    instagram_account_id = Column(Integer, ForeignKey("instagram_accounts.id", ondelete="CASCADE"), nullable=False)
+    automation_rule_id = Column(Integer, ForeignKey("automation_rules.id", ondelete="CASCADE"), nullable=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=True)
+    recipient_id = Column(String, nullable=True)
+    message_text = Column(Text, nullable=True)
+    due_at = Column(DateTime, nullable=False)
+    status = Column(String, nullable=False, default=TimerStatus.PENDING.value)
+    attempts = Column(Integer, default=0)
+    claimed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    # When the rule's trigger cap/cooldown was counted for this reply; undone if it is not sent
+    trigger_acquired_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # The loader scans pending timers by due time
+        Index("ix_scheduled_replies_status_due_at", "status", "due_at"),
+    )
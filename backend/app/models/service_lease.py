@@ -0,0 +1,10 @@
+from sqlalchemy import Column, String, DateTime
+from app.database import Base
+
+class ServiceLease(Base):
+    """Which process runs a background service that must run only once per deployment"""
+    __tablename__ = "service_leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=True)  # hostname:pid:nonce of the holder
+    expires_at = Column(DateTime, nullable=False)
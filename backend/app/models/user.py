@@ -11,7 +11,7 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     name = Column(String)
     access_token = Column(String)  # Facebook access token
-    token_expires_at = Column(DateTime)
+    token_expires_at = Column(DateTime, index=True)  # Scanned by the token refresher
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -0,0 +1,87 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
+
+from app.database import Base
+
+# Columns added after the initial schema. create_all() only creates missing
+# tables, so existing databases get these through upgrade_schema().
+# Each entry: (table, column, column DDL, optional backfill statement)
+ADDED_COLUMNS = [
+    (
+        "instagram_accounts",
+        "rules_version",
+        "INTEGER NOT NULL DEFAULT 0",
+        None,
+    ),
+    (
+        "conversations",
+        "first_inbound_at",
+        "TIMESTAMP",
+        None,
+    ),
+    (
+        "conversations",
+        "inbound_count",
+        "INTEGER NOT NULL DEFAULT 0",
+        # One-time backfill from the stored message history
+        "UPDATE conversations SET "
+        "inbound_count = (SELECT COUNT(*) FROM messages "
+        "WHERE messages.conversation_id = conversations.id AND messages.is_from_me = false), "
+        "first_inbound_at = (SELECT MIN(messages.sent_at) FROM messages "
+        "WHERE messages.conversation_id = conversations.id AND messages.is_from_me = false)",
+    ),
+    (
+        "campaigns",
+        "lease_owner",
+        "VARCHAR",
+        None,
+    ),
+    (
+        "scheduled_replies",
+        "trigger_acquired_at",
+        "TIMESTAMP",
+        None,
+    ),
+]
+
+# Indexes added to existing tables after the initial schema: (table, index name)
+ADDED_INDEXES = [
+    ("conversations", "ix_conversations_account_recent"),
+    ("messages", "ix_messages_conversation_recent"),
+    ("instagram_accounts", "ix_instagram_accounts_token_expires_at"),
+    ("users", "ix_users_token_expires_at"),
+]
+
+# Indexes replaced by one of ADDED_INDEXES
+DROPPED_INDEXES = [
+    "ix_conversations_account_last_message",
+    "ix_messages_conversation_sent_at",
+]
+
+
+def upgrade_schema(engine: Engine):
+    """Add columns and indexes missing from tables created by an older version of the app"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as connection:
+        for table, column, ddl, backfill in ADDED_COLUMNS:
+            if table not in existing_tables:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table)}
+            if column in columns:
+                continue
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            if backfill:
+                connection.execute(text(backfill))
+
+        for table, index_name in ADDED_INDEXES:
+            if table not in existing_tables:
+                continue
+            index = next(i for i in Base.metadata.tables[table].indexes if i.name == index_name)
+            # IF NOT EXISTS rather than reflection: SQLite does not reflect expression indexes
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+        for index_name in DROPPED_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
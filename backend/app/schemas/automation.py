@@ -1,7 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from datetime import datetime
 from typing import Optional, List, Dict
 from app.models.automation_rule import TriggerType, RuleStatus
+from app.services.timer_engine import validate_schedule
 
 class AutomationRuleCreate(BaseModel):
     name: str
@@ -15,6 +16,8 @@ class AutomationRuleCreate(BaseModel):
     max_triggers_per_user: Optional[int]
     cooldown_minutes: Optional[int]
 
+    _check_schedule = field_validator("trigger_schedule")(validate_schedule)
+
 class AutomationRuleUpdate(BaseModel):
     name: Optional[str]
     description: Optional[str]
@@ -28,6 +31,8 @@ class AutomationRuleUpdate(BaseModel):
     max_triggers_per_user: Optional[int]
     cooldown_minutes: Optional[int]
 
+    _check_schedule = field_validator("trigger_schedule")(validate_schedule)
+
 class AutomationRuleResponse(BaseModel):
     id: int
     instagram_account_id: int
@@ -0,0 +1,41 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+from app.models.campaign import CampaignStatus
+
+class CampaignFilter(BaseModel):
+    active_within_hours: Optional[int] = 24  # Instagram's standard messaging window
+    min_inbound_count: Optional[int] = None
+    unread_only: bool = False
+
+class CampaignCreate(BaseModel):
+    name: str
+    message_text: str
+    conversation_filter: CampaignFilter = CampaignFilter()
+
+class CampaignProgress(BaseModel):
+    processed: int
+    remaining: Optional[int]
+    percent: Optional[float]
+    throughput_per_second: float
+    eta_seconds: Optional[float]
+
+class CampaignResponse(BaseModel):
+    id: int
+    instagram_account_id: int
+    name: str
+    message_text: str
+    conversation_filter: Optional[CampaignFilter]
+    status: CampaignStatus
+    total_recipients: Optional[int]
+    sent_count: int
+    failed_count: int
+    last_error: Optional[str]
+    started_at: Optional[datetime]
+    completed_at: Optional[datetime]
+    created_at: datetime
+    updated_at: Optional[datetime]
+    progress: Optional[CampaignProgress] = None
+    
+    class Config:
+        from_attributes = True
@@ -20,6 +20,8 @@ class ConnectInstagramAccountRequest(BaseModel):
     profile_picture_url: Optional[str]
     page_id: str
     page_access_token: str
+    # Lifetime of page_access_token in seconds, if known; unknown tokens are refreshed right away
+    expires_in: Optional[int] = None
 
 class ConversationResponse(BaseModel):
     id: int
@@ -40,7 +42,7 @@ class MessageResponse(BaseModel):
     recipient_id: str
     message_text: Optional[str]
     message_type: str
-    attachments: Optional[Dict]
+    attachments: Optional[List[Dict]]
     is_from_me: bool
     is_automated: bool
     sent_at: Optional[datetime]
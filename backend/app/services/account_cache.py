@@ -0,0 +1,132 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.instagram_account import InstagramAccount
+
+
+@dataclass(frozen=True)
+class AccountRecord:
+    """Read-only subset of an InstagramAccount needed to process webhook events"""
+    id: int
+    instagram_business_account_id: str
+    page_access_token: str
+    is_active: bool
+
+
+class AccountCache:
+    """
+    Bounded LRU/TTL cache mapping Instagram business account id to an AccountRecord.
+
+    Misses are cached too, so events for unknown accounts are dropped
+    without touching the database until the entry expires. Routes that
+    connect or disconnect an account invalidate its entry and token
+    refreshes update it in place; the TTL bounds how long other workers
+    can serve a stale record. Rule versions are not cached here, see
+    RuleCache.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, negative_ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Optional[AccountRecord]]]" = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get_many(
+        self,
+        db: AsyncSession,
+        business_account_ids: Iterable[str]
+    ) -> Dict[str, AccountRecord]:
+        """
+        Resolve business account ids to active accounts. Unknown and
+        inactive accounts are left out of the result.
+        """
+        now = time.monotonic()
+        found: Dict[str, AccountRecord] = {}
+        to_load = []
+        for business_account_id in set(business_account_ids):
+            entry = self._entries.get(business_account_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(business_account_id)
+                if entry[1] is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                    found[business_account_id] = entry[1]
+                continue
+            to_load.append(business_account_id)
+
+        if to_load:
+            self.misses += len(to_load)
+            result = await db.execute(
+                select(
+                    InstagramAccount.id,
+                    InstagramAccount.instagram_business_account_id,
+                    InstagramAccount.page_access_token,
+                    InstagramAccount.is_active
+                ).where(InstagramAccount.instagram_business_account_id.in_(to_load))
+            )
+            loaded = {
+                row.instagram_business_account_id: AccountRecord(
+                    id=row.id,
+                    instagram_business_account_id=row.instagram_business_account_id,
+                    page_access_token=row.page_access_token,
+                    is_active=bool(row.is_active)
+                )
+                for row in result
+            }
+            for business_account_id in to_load:
+                record = loaded.get(business_account_id)
+                if record is not None and not record.is_active:
+                    record = None
+                self._store(business_account_id, record, now)
+                if record is not None:
+                    found[business_account_id] = record
+
+        return found
+
+    def _store(self, business_account_id: str, record: Optional[AccountRecord], now: float):
+        ttl = self.ttl_seconds if record is not None else self.negative_ttl_seconds
+        self._entries[business_account_id] = (now + ttl, record)
+        self._entries.move_to_end(business_account_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def update_token(self, business_account_id: str, page_access_token: str):
+        """Swap a refreshed page token into the cached record, so the next lookup needs no query"""
+        entry = self._entries.get(business_account_id)
+        if entry is not None and entry[1] is not None:
+            self._entries[business_account_id] = (entry[0], replace(entry[1], page_access_token=page_access_token))
+
+    def invalidate(self, business_account_id: str):
+        """Drop the cached record (or cached miss) for an account"""
+        if self._entries.pop(business_account_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+account_cache = AccountCache(
+    max_entries=settings.ACCOUNT_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ACCOUNT_CACHE_TTL_SECONDS,
+    negative_ttl_seconds=settings.ACCOUNT_CACHE_NEGATIVE_TTL_SECONDS
+)
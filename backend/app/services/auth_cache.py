@@ -0,0 +1,77 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    """The authenticated user as far as most routes need it"""
+    id: int
+    is_active: bool
+
+
+class AuthCache:
+    """
+    Bounded LRU/TTL cache mapping a verified access token to its UserPrincipal.
+
+    A hit skips both the JWT verification and the users lookup. Entries
+    live for AUTH_CACHE_TTL_SECONDS but never past the token's exp claim,
+    so an expired token is always re-verified (and rejected). Logout
+    drops the token's entry here and denylists it in the database, which
+    other processes check when their own entry expires; a user
+    deactivated in the database is likewise refused within the TTL.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, UserPrincipal]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[UserPrincipal]:
+        entry = self._entries.get(token)
+        if entry is not None:
+            if entry[0] > time.time():
+                self.hits += 1
+                self._entries.move_to_end(token)
+                return entry[1]
+            del self._entries[token]
+        self.misses += 1
+        return None
+
+    def put(self, token: str, principal: UserPrincipal, token_expires_at: Optional[float]):
+        """Cache a principal for a token verified just now; token_expires_at is its exp claim"""
+        expires_at = time.time() + self.ttl_seconds
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        self._entries[token] = (expires_at, principal)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, token: str):
+        """Drop a token's entry (logout)"""
+        if self._entries.pop(token, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+auth_cache = AuthCache(
+    max_entries=settings.AUTH_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS
+)
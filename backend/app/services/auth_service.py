@@ -1,13 +1,17 @@
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.database import get_db
+from app.database import get_async_db, insert_ignore
+from app.models.revoked_token import RevokedToken
 from app.models.user import User
+from app.services.auth_cache import UserPrincipal, auth_cache
 
 security = HTTPBearer()
 
@@ -19,48 +23,107 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    # jti identifies the token in the revocation denylist
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
 
-def decode_access_token(token: str):
-    """Decode and verify JWT token"""
+def decode_access_token_claims(token: str) -> dict:
+    """Decode and verify JWT token, returning its claims"""
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials"
-            )
-        return user_id
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
+    if payload.get("sub") is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials"
+        )
+    return payload
 
 
-async def get_current_user(
+def decode_access_token(token: str):
+    """Decode and verify JWT token"""
+    return decode_access_token_claims(token)["sub"]
+
+
+async def get_current_principal(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get current authenticated user from JWT token"""
+    db: AsyncSession = Depends(get_async_db)
+) -> UserPrincipal:
+    """
+    Get the id and status of the authenticated user.
+    Served from the auth cache for recently verified tokens, so most
+    requests neither verify the JWT nor query users. Verification also
+    checks the revoked_tokens denylist in the same query, so a token
+    logged out in another process is refused once its cache entry there
+    expires (AUTH_CACHE_TTL_SECONDS at most).
+    """
     token = credentials.credentials
-    user_id = decode_access_token(token)
-    
-    user = db.query(User).filter(User.id == int(user_id)).first()
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
+    principal = auth_cache.get(token)
+    if principal is None:
+        payload = decode_access_token_claims(token)
+        revoked = exists().where(RevokedToken.jti == payload.get("jti"))
+        result = await db.execute(
+            select(User.id, User.is_active, revoked.label("revoked")).where(User.id == int(payload["sub"]))
         )
-    
-    if not user.is_active:
+        row = result.first()
+        if not row:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found"
+            )
+        if row.revoked:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked"
+            )
+        principal = UserPrincipal(id=row.id, is_active=bool(row.is_active))
+        auth_cache.put(token, principal, payload.get("exp"))
+
+    if not principal.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Inactive user"
         )
+
+    return principal
+
+
+async def revoke_access_token(db: AsyncSession, token: str):
+    """
+    Deny a token until its exp: record its jti and drop it from the local
+    auth cache. Denylist rows of tokens that have expired anyway are
+    pruned on the way.
+    """
+    payload = decode_access_token_claims(token)
+    auth_cache.invalidate(token)
+    now = datetime.utcnow()
+    await db.execute(delete(RevokedToken).where(RevokedToken.expires_at < now))
+    # Tokens issued before jti was added cannot be listed; they expire within ACCESS_TOKEN_EXPIRE_MINUTES
+    if payload.get("jti") and payload.get("exp"):
+        await db.execute(insert_ignore(db, RevokedToken, ["jti"]), [{
+            "jti": payload["jti"],
+            "user_id": int(payload["sub"]),
+            "expires_at": datetime.utcfromtimestamp(payload["exp"]),
+        }])
+    await db.commit()
+
+
+async def get_current_user(
+    principal: UserPrincipal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """Get current authenticated user from JWT token, for routes that need the full row"""
+    user = await db.get(User, principal.id)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found"
+        )
     
     return user
@@ -0,0 +1,398 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+from app.models.campaign import Campaign, CampaignStatus
+from app.models.instagram_account import InstagramAccount
+from app.models.message import Conversation
+from app.services.reply_batch import ReplyBatch
+from app.services.send_scheduler import send_scheduler
+
+
+def recipient_filter(campaign: Campaign) -> list:
+    """WHERE clauses selecting the conversations a campaign messages"""
+    conversation_filter = campaign.conversation_filter or {}
+    clauses = [
+        Conversation.instagram_account_id == campaign.instagram_account_id,
+        Conversation.participant_id.isnot(None),
+    ]
+    if conversation_filter.get("active_within_hours"):
+        # Measured from the campaign start, so a resumed campaign keeps the same audience
+        reference = campaign.started_at or datetime.utcnow()
+        clauses.append(
+            Conversation.last_message_time >= reference - timedelta(hours=conversation_filter["active_within_hours"])
+        )
+    if conversation_filter.get("min_inbound_count"):
+        clauses.append(Conversation.inbound_count >= conversation_filter["min_inbound_count"])
+    if conversation_filter.get("unread_only"):
+        clauses.append(Conversation.unread_count > 0)
+    return clauses
+
+
+class _RateWindow:
+    """Recipients processed over the last minute, for throughput and ETA"""
+
+    def __init__(self, seconds: float = 60.0):
+        self.seconds = seconds
+        self._samples: deque = deque()
+
+    def add(self, count: int):
+        self._samples.append((time.monotonic(), count))
+
+    def rate(self) -> Optional[float]:
+        now = time.monotonic()
+        while self._samples and self._samples[0][0] < now - self.seconds:
+            self._samples.popleft()
+        if len(self._samples) < 2:
+            return None
+        elapsed = now - self._samples[0][0]
+        processed = sum(count for _, count in list(self._samples)[1:])
+        return processed / elapsed if elapsed > 0 else None
+
+
+class CampaignRunner:
+    """
+    Runs broadcast campaigns in the background.
+
+    Recipients are streamed from the conversations table in id order
+    (through a server-side cursor on PostgreSQL) and sent in chunks
+    through the send scheduler (so per-page rate limits apply), with at
+    most CAMPAIGN_CONCURRENCY sends in flight. After each chunk the sent
+    messages, counters and the last conversation id are committed as a
+    checkpoint.
+
+    A worker runs a campaign under a lease: lease_owner holds its id and
+    a heartbeat task renews heartbeat_at every CAMPAIGN_HEARTBEAT_SECONDS,
+    however long a chunk takes. Only a campaign without an owner, or
+    whose heartbeat is older than CAMPAIGN_STALE_SECONDS (its worker
+    crashed), can be claimed, and it resumes after its checkpoint; at
+    most the chunk in flight is sent again. Checkpoints and heartbeats
+    only apply while the lease is still ours, and a worker that finds it
+    lost stops sending.
+    """
+
+    def __init__(self):
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._poll_task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._running: Dict[int, asyncio.Task] = {}
+        self._rates: Dict[int, _RateWindow] = {}
+        self._wake = asyncio.Event()
+        self.sent_count = 0
+        self.failed_count = 0
+        self.lost_lease_count = 0
+
+    async def start(self):
+        if self._poll_task is None:
+            self._poll_task = asyncio.create_task(self._poll_loop(), name="campaign-poller")
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop(), name="campaign-heartbeat")
+
+    async def stop(self):
+        """Stop polling and running campaigns; they stay RUNNING and resume on the next start"""
+        campaign_ids = list(self._running)
+        tasks = list(self._running.values())
+        for task in (self._poll_task, self._heartbeat_task):
+            if task is not None:
+                tasks.append(task)
+        self._poll_task = self._heartbeat_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._running.clear()
+
+        if campaign_ids:
+            # Release the leases so the next worker to start resumes them without waiting
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Campaign)
+                    .where(Campaign.id.in_(campaign_ids), Campaign.lease_owner == self.owner_id)
+                    .values(lease_owner=None, heartbeat_at=None)
+                )
+                await db.commit()
+
+    def wake(self):
+        """Look for campaigns to run now instead of at the next poll"""
+        self._wake.set()
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                for campaign_id in await self._claim():
+                    self._running[campaign_id] = asyncio.create_task(
+                        self._run(campaign_id), name=f"campaign-{campaign_id}"
+                    )
+            except Exception as e:
+                print(f"Error polling campaigns: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=settings.CAMPAIGN_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _claim(self) -> List[int]:
+        """Take the lease of RUNNING campaigns that no worker holds or heartbeats"""
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=settings.CAMPAIGN_STALE_SECONDS)
+        async with AsyncSessionLocal() as db:
+            query = update(Campaign).where(
+                Campaign.status == CampaignStatus.RUNNING,
+                or_(
+                    Campaign.lease_owner.is_(None),
+                    Campaign.heartbeat_at.is_(None),
+                    Campaign.heartbeat_at < stale
+                )
+            )
+            if self._running:
+                query = query.where(Campaign.id.notin_(list(self._running)))
+            result = await db.execute(
+                query.values(lease_owner=self.owner_id, heartbeat_at=now)
+                .returning(Campaign.id)
+                .execution_options(synchronize_session=False)
+            )
+            claimed = [row.id for row in result]
+            await db.commit()
+        return claimed
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(settings.CAMPAIGN_HEARTBEAT_SECONDS)
+            try:
+                await self._heartbeat()
+            except Exception as e:
+                print(f"Error renewing campaign leases: {e}")
+
+    async def _heartbeat(self):
+        """Renew the leases of the campaigns running here and stop those another worker took over"""
+        campaign_ids = list(self._running)
+        if not campaign_ids:
+            return
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Campaign)
+                .where(Campaign.id.in_(campaign_ids), Campaign.lease_owner == self.owner_id)
+                .values(heartbeat_at=datetime.utcnow())
+                .returning(Campaign.id)
+                .execution_options(synchronize_session=False)
+            )
+            renewed = {row.id for row in result}
+            await db.commit()
+        for campaign_id in campaign_ids:
+            task = self._running.get(campaign_id)
+            if campaign_id not in renewed and task is not None:
+                print(f"Lost the lease of campaign {campaign_id}; stopping it here")
+                self.lost_lease_count += 1
+                task.cancel()
+
+    async def _run(self, campaign_id: int):
+        try:
+            async with AsyncSessionLocal() as db:
+                await self._execute(db, campaign_id)
+        except Exception as e:
+            print(f"Error running campaign {campaign_id}: {e}")
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Campaign)
+                    .where(
+                        Campaign.id == campaign_id,
+                        Campaign.status == CampaignStatus.RUNNING,
+                        Campaign.lease_owner == self.owner_id
+                    )
+                    .values(status=CampaignStatus.FAILED, last_error=str(e), lease_owner=None, heartbeat_at=None)
+                )
+                await db.commit()
+        finally:
+            self._running.pop(campaign_id, None)
+            self._rates.pop(campaign_id, None)
+
+    async def _execute(self, db: AsyncSession, campaign_id: int):
+        campaign = await db.get(Campaign, campaign_id)
+        account = await db.get(InstagramAccount, campaign.instagram_account_id)
+        if account is None or not account.is_active:
+            raise Exception("Instagram account is disconnected")
+
+        if campaign.total_recipients is None:
+            campaign.started_at = datetime.utcnow()
+            result = await db.execute(select(func.count(Conversation.id)).where(*recipient_filter(campaign)))
+            campaign.total_recipients = result.scalar()
+            await db.commit()
+
+        rate = self._rates[campaign_id] = _RateWindow()
+        rate.add(0)
+        async for chunk in self._recipient_chunks(campaign):
+            sent, failed, replies = await self._send_chunk(account, campaign.message_text, chunk)
+            rate.add(len(chunk))
+            status = await self._checkpoint(db, campaign_id, chunk[-1].id, sent, failed, replies)
+            if status is None:
+                print(f"Lost the lease of campaign {campaign_id}; stopping it here")
+                self.lost_lease_count += 1
+                return
+            if status != CampaignStatus.RUNNING:
+                # Paused or cancelled through the API; a later start is claimed afresh
+                await self._release(db, campaign_id)
+                return
+
+        await db.execute(
+            update(Campaign)
+            .where(
+                Campaign.id == campaign_id,
+                Campaign.status == CampaignStatus.RUNNING,
+                Campaign.lease_owner == self.owner_id
+            )
+            .values(
+                status=CampaignStatus.COMPLETED,
+                completed_at=datetime.utcnow(),
+                lease_owner=None,
+                heartbeat_at=None
+            )
+        )
+        await db.commit()
+
+    async def _release(self, db: AsyncSession, campaign_id: int):
+        await db.execute(
+            update(Campaign)
+            .where(Campaign.id == campaign_id, Campaign.lease_owner == self.owner_id)
+            .values(lease_owner=None, heartbeat_at=None)
+        )
+        await db.commit()
+
+    async def _recipient_chunks(self, campaign: Campaign):
+        """Yield the campaign's remaining recipients in id order, CAMPAIGN_CHUNK_SIZE at a time"""
+        query = (
+            select(Conversation.id, Conversation.participant_id)
+            .where(*recipient_filter(campaign))
+            .order_by(Conversation.id)
+        )
+        last_id = campaign.last_conversation_id or 0
+        async with AsyncSessionLocal() as reader:
+            if reader.get_bind().dialect.name == "postgresql":
+                # A separate session holds the server-side cursor open across checkpoint commits
+                stream = await reader.stream(
+                    query.where(Conversation.id > last_id)
+                    .execution_options(yield_per=settings.CAMPAIGN_CHUNK_SIZE)
+                )
+                async for chunk in stream.partitions():
+                    yield chunk
+                return
+
+            # SQLite cannot commit while another connection holds a read cursor open, so page by id instead
+            while True:
+                result = await reader.execute(
+                    query.where(Conversation.id > last_id).limit(settings.CAMPAIGN_CHUNK_SIZE)
+                )
+                chunk = result.all()
+                await reader.rollback()
+                if not chunk:
+                    return
+                yield chunk
+                last_id = chunk[-1].id
+
+    async def _send_chunk(
+        self,
+        account: InstagramAccount,
+        message_text: str,
+        chunk
+    ) -> Tuple[int, int, ReplyBatch]:
+        semaphore = asyncio.Semaphore(settings.CAMPAIGN_CONCURRENCY)
+        replies = ReplyBatch()
+
+        async def send(conversation_id: int, participant_id: str) -> bool:
+            async with semaphore:
+                try:
+                    result = await send_scheduler.send(account, participant_id, message_text)
+                except Exception as e:
+                    print(f"Error sending campaign message: {e}")
+                    return False
+            replies.add_message(
+                conversation_id=conversation_id,
+                result=result,
+                sender_id=account.instagram_business_account_id,
+                recipient_id=participant_id,
+                message_text=message_text,
+                rule_id=None
+            )
+            return True
+
+        outcomes = await asyncio.gather(*(send(row.id, row.participant_id) for row in chunk))
+        sent = sum(outcomes)
+        self.sent_count += sent
+        self.failed_count += len(outcomes) - sent
+        return sent, len(outcomes) - sent, replies
+
+    async def _checkpoint(
+        self,
+        db: AsyncSession,
+        campaign_id: int,
+        last_conversation_id: int,
+        sent: int,
+        failed: int,
+        replies: ReplyBatch
+    ) -> Optional[CampaignStatus]:
+        """
+        Commit a chunk's messages and progress; returns the campaign's
+        current status, or None if another worker holds the lease now.
+        The messages are stored either way, since they were sent.
+        """
+        await replies.write(db)
+        result = await db.execute(
+            update(Campaign)
+            .where(Campaign.id == campaign_id, Campaign.lease_owner == self.owner_id)
+            .values(
+                sent_count=Campaign.sent_count + sent,
+                failed_count=Campaign.failed_count + failed,
+                last_conversation_id=last_conversation_id,
+                heartbeat_at=datetime.utcnow()
+            )
+            .returning(Campaign.status)
+            .execution_options(synchronize_session=False)
+        )
+        status = result.scalar()
+        await db.commit()
+        return status
+
+    def progress(self, campaign: Campaign) -> Dict:
+        """Processed count, throughput and ETA of a campaign"""
+        processed = (campaign.sent_count or 0) + (campaign.failed_count or 0)
+        total = campaign.total_recipients
+        remaining = max(total - processed, 0) if total is not None else None
+
+        window = self._rates.get(campaign.id)
+        throughput = window.rate() if window is not None else None
+        if throughput is None and campaign.started_at and processed:
+            # Not running here (or just started); fall back to the average since the start
+            end = campaign.completed_at or datetime.utcnow()
+            elapsed = (end - campaign.started_at).total_seconds()
+            throughput = processed / elapsed if elapsed > 0 else None
+        throughput = throughput or 0.0
+
+        eta = None
+        if campaign.status == CampaignStatus.RUNNING and remaining is not None and throughput > 0:
+            eta = round(remaining / throughput, 1)
+        return {
+            "processed": processed,
+            "remaining": remaining,
+            "percent": round(processed / total * 100, 2) if total else None,
+            "throughput_per_second": round(throughput, 2),
+            "eta_seconds": eta,
+        }
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._poll_task is not None,
+            "active_campaigns": len(self._running),
+            "lost_leases": self.lost_lease_count,
+            "sent": self.sent_count,
+            "failed": self.failed_count,
+        }
+
+
+campaign_runner = CampaignRunner()
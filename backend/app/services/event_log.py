@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core import fastjson
+from app.core.config import settings
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Only needed for WEBHOOK_LOG_BACKEND=redis
+    redis_asyncio = None
+
+# A partition's position before its first entry
+START = "0"
+
+# (partition, [(entry id, events), ...]) as returned by EventLog.read
+ReadBatch = List[Tuple[int, List[Tuple[str, List[Dict]]]]]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def partition_for(business_account_id: Optional[str], partitions: int) -> int:
+    """Partition of an Instagram account's events; stable across processes and restarts"""
+    return _hash(business_account_id or "") % partitions
+
+
+class HashRing:
+    """
+    Consistent hash ring of worker ids with virtual nodes. When a worker
+    joins or leaves, only the keys next to its points change owner.
+    """
+
+    def __init__(self, members: Iterable[str], vnodes: int = 64):
+        self._ring = sorted((_hash(f"{member}#{i}"), member) for member in set(members) for i in range(vnodes))
+        self._points = [point for point, _ in self._ring]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._ring:
+            return None
+        index = bisect_right(self._points, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class EventLog(ABC):
+    """
+    Partitioned, append-only log of webhook events with committed read
+    positions per partition, a registry of live consumers and a claim on
+    each partition naming the consumer allowed to read and commit it.
+    """
+
+    @abstractmethod
+    async def publish(self, batches: Dict[int, List[Dict]]):
+        """Append each partition's events as one entry"""
+
+    @abstractmethod
+    async def read(self, positions: Dict[int, str], count: int, block_ms: int) -> ReadBatch:
+        """Entries after the given positions, waiting up to block_ms for new ones"""
+
+    @abstractmethod
+    async def committed(self, partitions: Iterable[int]) -> Dict[int, str]:
+        """Committed read positions of those partitions that have one"""
+
+    @abstractmethod
+    async def commit(self, worker_id: str, positions: Dict[int, str]) -> List[int]:
+        """Store read positions of partitions the worker still claims; returns those partitions"""
+
+    @abstractmethod
+    async def claim(self, worker_id: str, partitions: Iterable[int], members: Iterable[str]) -> List[int]:
+        """
+        Claim partitions that are unclaimed, already ours, or claimed by a
+        consumer no longer among members; returns the partitions now held.
+        """
+
+    @abstractmethod
+    async def release(self, worker_id: str, partitions: Iterable[int]):
+        """Give up the worker's claims on partitions"""
+
+    @abstractmethod
+    async def heartbeat(self, worker_id: str, ttl: float):
+        """Register a consumer, or keep it registered, for ttl seconds"""
+
+    @abstractmethod
+    async def leave(self, worker_id: str):
+        """Unregister a consumer at once instead of waiting for its registration to expire"""
+
+    @abstractmethod
+    async def dead_letter(self, partition: int, entry_id: str, events: List[Dict], error: str):
+        """Keep an entry that kept failing, for inspection and manual replay"""
+
+    @abstractmethod
+    async def members(self) -> List[str]:
+        """Ids of consumers whose registration has not expired"""
+
+    async def close(self):
+        pass
+
+
+class MemoryEventLog(EventLog):
+    """
+    In-process stand-in for RedisEventLog, for tests and single-process
+    development. Consumers in the same process can share one instance.
+    """
+
+    def __init__(self, maxlen: int):
+        self.maxlen = maxlen
+        self._entries: Dict[int, List[Tuple[int, List[Dict]]]] = defaultdict(list)
+        self._sequence = 0
+        self._offsets: Dict[int, str] = {}
+        self._owners: Dict[int, str] = {}
+        self._members: Dict[str, float] = {}
+        self.dead_letters: List[Dict] = []
+        # Readers blocked until the next publish
+        self._waiters: Set[asyncio.Future] = set()
+
+    async def publish(self, batches: Dict[int, List[Dict]]):
+        for partition, events in batches.items():
+            self._sequence += 1
+            entries = self._entries[partition]
+            entries.append((self._sequence, events))
+            if len(entries) > self.maxlen:
+                del entries[:len(entries) - self.maxlen]
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    def _after(self, positions: Dict[int, str], count: int) -> ReadBatch:
+        batches = []
+        for partition, position in positions.items():
+            after = int(position.split("-")[0])
+            entries = [
+                (f"{sequence}-0", events)
+                for sequence, events in self._entries.get(partition, [])
+                if sequence > after
+            ][:count]
+            if entries:
+                batches.append((partition, entries))
+        return batches
+
+    async def read(self, positions: Dict[int, str], count: int, block_ms: int) -> ReadBatch:
+        batches = self._after(positions, count)
+        if batches or not block_ms:
+            return batches
+        # asyncio.wait rather than wait_for: a cancelled reader must not hang on a lock or inner task
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.add(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=block_ms / 1000)
+        finally:
+            self._waiters.discard(waiter)
+            waiter.cancel()
+        return self._after(positions, count)
+
+    async def committed(self, partitions: Iterable[int]) -> Dict[int, str]:
+        return {partition: self._offsets[partition] for partition in partitions if partition in self._offsets}
+
+    async def commit(self, worker_id: str, positions: Dict[int, str]) -> List[int]:
+        held = [partition for partition in positions if self._owners.get(partition) == worker_id]
+        self._offsets.update({partition: positions[partition] for partition in held})
+        return held
+
+    async def claim(self, worker_id: str, partitions: Iterable[int], members: Iterable[str]) -> List[int]:
+        members = set(members)
+        granted = []
+        for partition in partitions:
+            holder = self._owners.get(partition)
+            if holder is None or holder == worker_id or holder not in members:
+                self._owners[partition] = worker_id
+                granted.append(partition)
+        return granted
+
+    async def release(self, worker_id: str, partitions: Iterable[int]):
+        for partition in partitions:
+            if self._owners.get(partition) == worker_id:
+                del self._owners[partition]
+
+    async def heartbeat(self, worker_id: str, ttl: float):
+        self._members[worker_id] = time.time() + ttl
+
+    async def leave(self, worker_id: str):
+        self._members.pop(worker_id, None)
+
+    async def dead_letter(self, partition: int, entry_id: str, events: List[Dict], error: str):
+        self.dead_letters.append({"partition": partition, "entry_id": entry_id, "events": events, "error": error})
+        if len(self.dead_letters) > self.maxlen:
+            del self.dead_letters[:len(self.dead_letters) - self.maxlen]
+
+    async def members(self) -> List[str]:
+        now = time.time()
+        return sorted(worker_id for worker_id, expires_at in self._members.items() if expires_at > now)
+
+
+class RedisEventLog(EventLog):
+    """
+    Event log on Redis Streams: one stream per partition, trimmed to about
+    maxlen entries, a hash of committed positions, a hash of partition
+    claims, a sorted set of consumers scored by registration expiry and a
+    dead-letter stream of entries that kept failing.
+    Claims and commits check the current claim holder inside a
+    WATCH/MULTI transaction, so a consumer that lost a partition can
+    neither take it back nor move its position.
+    """
+
+    def __init__(self, url: str, prefix: str, maxlen: int):
+        if redis_asyncio is None:
+            raise RuntimeError("WEBHOOK_LOG_BACKEND=redis needs the redis package")
+        self.prefix = prefix
+        self.maxlen = maxlen
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+
+    def _stream(self, partition: int) -> str:
+        return f"{self.prefix}:partition:{partition}"
+
+    async def publish(self, batches: Dict[int, List[Dict]]):
+        async with self._redis.pipeline(transaction=False) as pipeline:
+            for partition, events in batches.items():
+                pipeline.xadd(
+                    self._stream(partition),
+                    {"events": fastjson.dumps(events)},
+                    maxlen=self.maxlen,
+                    approximate=True
+                )
+            await pipeline.execute()
+
+    async def read(self, positions: Dict[int, str], count: int, block_ms: int) -> ReadBatch:
+        streams = {self._stream(partition): position for partition, position in positions.items()}
+        partitions = {self._stream(partition): partition for partition in positions}
+        response = await self._redis.xread(streams, count=count, block=block_ms or None)
+        return [
+            (partitions[stream], [(entry_id, fastjson.loads(fields["events"])) for entry_id, fields in entries])
+            for stream, entries in response or []
+        ]
+
+    async def committed(self, partitions: Iterable[int]) -> Dict[int, str]:
+        partitions = list(partitions)
+        if not partitions:
+            return {}
+        values = await self._redis.hmget(f"{self.prefix}:offsets", [str(partition) for partition in partitions])
+        return {partition: value for partition, value in zip(partitions, values) if value is not None}
+
+    async def _update_held(self, partitions: List[int], allowed, write) -> List[int]:
+        """
+        Read the claim holders of partitions, keep those allowed(holder)
+        accepts and queue write(pipeline, kept) in one transaction;
+        retried if a claim changed in between.
+        """
+        owners_key = f"{self.prefix}:owners"
+        while True:
+            async with self._redis.pipeline(transaction=True) as pipeline:
+                try:
+                    await pipeline.watch(owners_key)
+                    holders = await pipeline.hmget(owners_key, [str(partition) for partition in partitions])
+                    kept = [partition for partition, holder in zip(partitions, holders) if allowed(holder)]
+                    if not kept:
+                        return []
+                    pipeline.multi()
+                    write(pipeline, kept)
+                    await pipeline.execute()
+                    return kept
+                except redis_asyncio.WatchError:
+                    continue
+
+    async def commit(self, worker_id: str, positions: Dict[int, str]) -> List[int]:
+        if not positions:
+            return []
+        return await self._update_held(
+            list(positions),
+            lambda holder: holder == worker_id,
+            lambda pipeline, held: pipeline.hset(
+                f"{self.prefix}:offsets",
+                mapping={str(partition): positions[partition] for partition in held}
+            )
+        )
+
+    async def claim(self, worker_id: str, partitions: Iterable[int], members: Iterable[str]) -> List[int]:
+        partitions = list(partitions)
+        if not partitions:
+            return []
+        members = set(members)
+        return await self._update_held(
+            partitions,
+            lambda holder: holder is None or holder == worker_id or holder not in members,
+            lambda pipeline, granted: pipeline.hset(
+                f"{self.prefix}:owners",
+                mapping={str(partition): worker_id for partition in granted}
+            )
+        )
+
+    async def release(self, worker_id: str, partitions: Iterable[int]):
+        partitions = list(partitions)
+        if not partitions:
+            return
+        await self._update_held(
+            partitions,
+            lambda holder: holder == worker_id,
+            lambda pipeline, held: pipeline.hdel(f"{self.prefix}:owners", *[str(partition) for partition in held])
+        )
+
+    async def heartbeat(self, worker_id: str, ttl: float):
+        await self._redis.zadd(f"{self.prefix}:members", {worker_id: time.time() + ttl})
+
+    async def leave(self, worker_id: str):
+        await self._redis.zrem(f"{self.prefix}:members", worker_id)
+
+    async def dead_letter(self, partition: int, entry_id: str, events: List[Dict], error: str):
+        await self._redis.xadd(
+            f"{self.prefix}:dead-letter",
+            {"partition": str(partition), "entry_id": entry_id, "events": fastjson.dumps(events), "error": error},
+            maxlen=self.maxlen,
+            approximate=True
+        )
+
+    async def members(self) -> List[str]:
+        key = f"{self.prefix}:members"
+        now = time.time()
+        await self._redis.zremrangebyscore(key, "-inf", now)
+        return sorted(await self._redis.zrangebyscore(key, now, "+inf"))
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+_event_log: Optional[EventLog] = None
+
+
+def get_event_log() -> EventLog:
+    """The process-wide event log for WEBHOOK_LOG_BACKEND, created on first use"""
+    global _event_log
+    if _event_log is None:
+        if settings.WEBHOOK_LOG_BACKEND == "memory":
+            _event_log = MemoryEventLog(maxlen=settings.WEBHOOK_STREAM_MAXLEN)
+        else:
+            _event_log = RedisEventLog(
+                url=settings.REDIS_URL,
+                prefix=settings.WEBHOOK_STREAM_PREFIX,
+                maxlen=settings.WEBHOOK_STREAM_MAXLEN
+            )
+    return _event_log
+
+
+async def close_event_log():
+    global _event_log
+    if _event_log is not None:
+        await _event_log.close()
+        _event_log = None
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode
+
+import httpx
+
+from app.core.config import settings
+from app.core.metrics import graph_endpoint, graph_request_seconds, graph_requests
+from app.services.http_client import get_graph_client
+
+
+class BatchResponse:
+    """
+    The result of one request inside a Graph API batch. Offers the parts
+    of httpx.Response that InstagramService reads, so callers handle
+    batched and direct responses the same way.
+    """
+
+    def __init__(self, status_code: int, headers: httpx.Headers, text: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    def json(self) -> Any:
+        return json.loads(self.text) if self.text else {}
+
+    @classmethod
+    def from_batch_entry(cls, entry: Optional[Dict]) -> "BatchResponse":
+        if entry is None:
+            # Graph returns null for requests it did not get to before timing out
+            return cls(504, httpx.Headers(), json.dumps({"error": {"message": "Batch request timed out"}}))
+        headers = httpx.Headers([(h["name"], h["value"]) for h in entry.get("headers") or []])
+        return cls(entry.get("code", 500), headers, entry.get("body") or "")
+
+
+@dataclass
+class _BatchItem:
+    method: str
+    relative_url: str
+    body: Optional[str]
+    future: asyncio.Future
+
+
+class GraphBatcher:
+    """
+    Coalesces concurrent Graph API requests made with the same access
+    token into batch calls (POST with a "batch" parameter).
+
+    A token's pending requests are sent when the batch is full or when
+    GRAPH_BATCH_LINGER_SECONDS have passed since the first one arrived,
+    whichever comes first. Each caller gets back its own entry of the
+    batch result. Metrics record every request of a batch under its own
+    endpoint and status, with the batch's latency, rather than the
+    batch call itself.
+    """
+
+    def __init__(self, base_url: str, max_size: int, linger: float):
+        self.base_url = base_url
+        self.max_size = max_size
+        self.linger = linger
+        self._pending: Dict[str, List[_BatchItem]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._inflight: set = set()
+        self.batch_count = 0
+        self.request_count = 0
+        self.failed_batch_count = 0
+
+    async def request(
+        self,
+        access_token: str,
+        method: str,
+        path: str,
+        params: Optional[Dict] = None,
+        data: Optional[Dict] = None
+    ):
+        """Queue one Graph API request and wait for its part of the batch result"""
+        relative_url = path.lstrip("/")
+        if params:
+            relative_url = f"{relative_url}?{urlencode(params)}"
+        body = None
+        if data:
+            # Batch bodies are form encoded; nested objects are sent as JSON strings
+            body = urlencode({
+                key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                for key, value in data.items()
+            })
+
+        loop = asyncio.get_running_loop()
+        item = _BatchItem(method=method, relative_url=relative_url, body=body, future=loop.create_future())
+        items = self._pending.setdefault(access_token, [])
+        items.append(item)
+
+        if len(items) >= self.max_size:
+            self._flush(access_token)
+        elif access_token not in self._timers:
+            self._timers[access_token] = loop.call_later(self.linger, self._flush, access_token)
+        return await item.future
+
+    def _flush(self, access_token: str):
+        timer = self._timers.pop(access_token, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(access_token, None)
+        if not items:
+            return
+        task = asyncio.get_running_loop().create_task(self._send(access_token, items))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, access_token: str, items: List[_BatchItem]):
+        self.batch_count += 1
+        self.request_count += len(items)
+        batch = []
+        for item in items:
+            entry = {"method": item.method, "relative_url": item.relative_url}
+            if item.body is not None:
+                entry["body"] = item.body
+            batch.append(entry)
+
+        started_at = time.perf_counter()
+        try:
+            response = await get_graph_client().post(
+                f"{self.base_url}/",
+                data={"access_token": access_token, "batch": json.dumps(batch), "include_headers": "true"},
+                extensions={"graph_batch": True}
+            )
+        except Exception as e:
+            self.failed_batch_count += 1
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+
+        if response.status_code != 200:
+            # The whole batch was rejected (bad token, throttled app...); every caller sees that response
+            self.failed_batch_count += 1
+            self._record(items, [response.status_code] * len(items), started_at)
+            for item in items:
+                if not item.future.done():
+                    item.future.set_result(response)
+            return
+
+        entries = response.json()
+        results = [
+            BatchResponse.from_batch_entry(entries[index] if index < len(entries) else None)
+            for index in range(len(items))
+        ]
+        self._record(items, [result.status_code for result in results], started_at)
+        for item, result in zip(items, results):
+            if not item.future.done():
+                item.future.set_result(result)
+
+    @staticmethod
+    def _record(items: List[_BatchItem], status_codes: List[int], started_at: float):
+        elapsed = time.perf_counter() - started_at
+        for item, status_code in zip(items, status_codes):
+            endpoint = graph_endpoint(item.relative_url.split("?", 1)[0])
+            graph_requests.labels(item.method, endpoint, str(status_code)).inc()
+            graph_request_seconds.labels(item.method, endpoint).observe(elapsed)
+
+    async def close(self):
+        """Send everything still pending and wait for in-flight batches"""
+        for access_token in list(self._pending):
+            self._flush(access_token)
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": settings.GRAPH_BATCH_ENABLED,
+            "batches": self.batch_count,
+            "requests": self.request_count,
+            "failed_batches": self.failed_batch_count,
+            "avg_batch_size": round(self.request_count / self.batch_count, 2) if self.batch_count else 0.0,
+            "pending": sum(len(items) for items in self._pending.values()),
+        }
+
+
+graph_batcher = GraphBatcher(
+    base_url=settings.GRAPH_BASE_URL,
+    max_size=settings.GRAPH_BATCH_MAX_SIZE,
+    linger=settings.GRAPH_BATCH_LINGER_SECONDS
+)
@@ -0,0 +1,117 @@
+import time
+import httpx
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.core.metrics import graph_endpoint, graph_request_seconds, graph_requests
+
+_client: Optional[httpx.AsyncClient] = None
+_request_count = 0
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def _count_request(request: httpx.Request):
+    global _request_count
+    _request_count += 1
+    request.extensions["started_at"] = time.perf_counter()
+
+
+async def _record_response(response: httpx.Response):
+    request = response.request
+    if request.extensions.get("graph_batch"):
+        # The batcher records each request of the batch under its own endpoint
+        return
+    endpoint = graph_endpoint(request.url.path)
+    graph_requests.labels(request.method, endpoint, str(response.status_code)).inc()
+    started_at = request.extensions.get("started_at")
+    if started_at is not None:
+        graph_request_seconds.labels(request.method, endpoint).observe(time.perf_counter() - started_at)
+
+
+def create_graph_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    """Build an AsyncClient configured for Graph API traffic"""
+    http2 = settings.GRAPH_HTTP2
+    if http2 and not _http2_available():
+        print("GRAPH_HTTP2 is enabled but the h2 package is not installed, using HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        transport=transport,
+        limits=httpx.Limits(
+            max_connections=settings.GRAPH_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.GRAPH_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(
+            settings.GRAPH_TIMEOUT_SECONDS,
+            connect=settings.GRAPH_CONNECT_TIMEOUT_SECONDS,
+            pool=settings.GRAPH_POOL_TIMEOUT_SECONDS,
+        ),
+        event_hooks={"request": [_count_request], "response": [_record_response]},
+    )
+
+
+async def init_graph_client(transport: Optional[httpx.AsyncBaseTransport] = None):
+    """Create the process-wide Graph API client (called from the app lifespan)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_graph_client(transport)
+
+
+async def close_graph_client():
+    """Close the process-wide Graph API client and its pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_graph_client() -> httpx.AsyncClient:
+    """
+    Return the shared Graph API client.
+    Created lazily so scripts that skip the app lifespan still work.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_graph_client()
+    return _client
+
+
+def pool_stats() -> Dict:
+    """Connection pool statistics for the shared client"""
+    stats = {
+        "initialized": _client is not None and not _client.is_closed,
+        "requests": _request_count,
+        "max_connections": settings.GRAPH_MAX_CONNECTIONS,
+        "max_keepalive_connections": settings.GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+        "connections": 0,
+        "active": 0,
+        "idle": 0,
+        "http2": 0,
+    }
+    if not stats["initialized"]:
+        return stats
+
+    # httpcore does not expose a public stats API; read the pool defensively
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    stats["connections"] = len(connections)
+    for connection in connections:
+        try:
+            if connection.is_idle():
+                stats["idle"] += 1
+            else:
+                stats["active"] += 1
+            if "HTTP/2" in connection.info():
+                stats["http2"] += 1
+        except Exception:
+            continue
+    return stats
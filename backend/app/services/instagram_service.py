@@ -1,149 +1,316 @@
+import asyncio
+from typing import List, Dict, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+
 import httpx
-from typing import List, Dict, Optional
-from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, case, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.config import settings
+from app.database import insert_ignore
 from app.models.instagram_account import InstagramAccount
 from app.models.message import Conversation, Message
 from app.models.user import User
+from app.services.http_client import get_graph_client
+from app.services.graph_batch import graph_batcher
+from app.services.account_cache import account_cache
+
+
+def _graph_time(value: Optional[str]) -> Optional[datetime]:
+    """Parse a Graph API timestamp (e.g. 2024-01-31T12:00:00+0000) into naive UTC"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00").replace("+0000", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class GraphAPIError(Exception):
+    """Error response from the Graph API"""
+
+    # Graph error codes for application, user, page and messaging throttling
+    RATE_LIMIT_CODES = {4, 17, 32, 613, 80002, 80006}
+
+    def __init__(self, message: str, status_code: int, error_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+    @property
+    def is_rate_limit(self) -> bool:
+        return self.status_code == 429 or self.error_code in self.RATE_LIMIT_CODES
+
+    @classmethod
+    def from_response(cls, message: str, response) -> "GraphAPIError":
+        error_code = None
+        try:
+            error_code = response.json().get("error", {}).get("code")
+        except ValueError:
+            pass
+
+        retry_after = None
+        header = response.headers.get("Retry-After")
+        if header:
+            try:
+                retry_after = float(header)
+            except ValueError:
+                pass
+
+        return cls(message, response.status_code, error_code, retry_after)
 
 
 class InstagramService:
     """Service for interacting with Instagram Graph API"""
     
-    BASE_URL = "https://graph.facebook.com/v18.0"
+    BASE_URL = settings.GRAPH_BASE_URL
+
+    @staticmethod
+    async def _request(
+        method: str,
+        path: str,
+        access_token: str,
+        params: Optional[Dict] = None,
+        json: Optional[Dict] = None
+    ):
+        """Call a Graph API path, through the batcher when GRAPH_BATCH_ENABLED is set"""
+        if settings.GRAPH_BATCH_ENABLED:
+            return await graph_batcher.request(access_token, method, path, params=params, data=json)
+        return await get_graph_client().request(
+            method,
+            f"{InstagramService.BASE_URL}/{path}",
+            params={"access_token": access_token, **(params or {})},
+            json=json
+        )
     
     @staticmethod
     async def get_instagram_accounts(user: User) -> List[Dict]:
-        """Fetch user's Instagram Business accounts connected to Facebook Pages"""
-        async with httpx.AsyncClient() as client:
-            # Get user's Facebook pages
-            response = await client.get(
-                f"{InstagramService.BASE_URL}/me/accounts",
-                params={
-                    "access_token": user.access_token,
-                    "fields": "id,name,access_token,instagram_business_account"
-                }
-            )
-            
+        """
+        Fetch user's Instagram Business accounts connected to Facebook Pages.
+        Follows the paging cursors of /me/accounts and looks up account
+        details concurrently (up to GRAPH_FANOUT_CONCURRENCY at a time).
+        Accounts whose details could not be fetched are still returned,
+        with the failure in "error".
+        """
+        client = get_graph_client()
+        # Get user's Facebook pages, one Graph page at a time
+        pages = []
+        url = f"{InstagramService.BASE_URL}/me/accounts"
+        params = {
+            "access_token": user.access_token,
+            "fields": "id,name,access_token,instagram_business_account",
+            "limit": 100
+        }
+        while url:
+            response = await client.get(url, params=params)
+
             if response.status_code != 200:
                 raise Exception("Failed to fetch Facebook pages")
-            
+
             pages_data = response.json()
-            instagram_accounts = []
-            
-            for page in pages_data.get("data", []):
-                if "instagram_business_account" in page:
-                    ig_account_id = page["instagram_business_account"]["id"]
-                    
-                    # Get Instagram account details
-                    ig_response = await client.get(
-                        f"{InstagramService.BASE_URL}/{ig_account_id}",
-                        params={
-                            "access_token": page["access_token"],
-                            "fields": "id,username,profile_picture_url"
-                        }
+            pages.extend(pages_data.get("data", []))
+            # The next link already carries the token, fields and cursor
+            url = pages_data.get("paging", {}).get("next")
+            params = None
+
+        semaphore = asyncio.Semaphore(settings.GRAPH_FANOUT_CONCURRENCY)
+
+        async def fetch_details(page: Dict) -> Dict:
+            ig_account_id = page["instagram_business_account"]["id"]
+            account = {
+                "instagram_business_account_id": ig_account_id,
+                "username": None,
+                "profile_picture_url": None,
+                "page_id": page["id"],
+                "page_name": page.get("name"),
+                "page_access_token": page["access_token"]
+            }
+            try:
+                # Get Instagram account details
+                async with semaphore:
+                    ig_response = await InstagramService._request(
+                        "GET",
+                        ig_account_id,
+                        page["access_token"],
+                        params={"fields": "id,username,profile_picture_url"}
                     )
-                    
-                    if ig_response.status_code == 200:
-                        ig_data = ig_response.json()
-                        instagram_accounts.append({
-                            "instagram_business_account_id": ig_data["id"],
-                            "username": ig_data.get("username"),
-                            "profile_picture_url": ig_data.get("profile_picture_url"),
-                            "page_id": page["id"],
-                            "page_name": page["name"],
-                            "page_access_token": page["access_token"]
-                        })
-            
-            return instagram_accounts
-    
+            except httpx.HTTPError as e:
+                account["error"] = f"Failed to fetch account details: {e}"
+                return account
+
+            if ig_response.status_code != 200:
+                account["error"] = f"Failed to fetch account details (HTTP {ig_response.status_code})"
+                return account
+
+            ig_data = ig_response.json()
+            account["username"] = ig_data.get("username")
+            account["profile_picture_url"] = ig_data.get("profile_picture_url")
+            return account
+
+        return list(await asyncio.gather(*(
+            fetch_details(page) for page in pages if "instagram_business_account" in page
+        )))
+
     @staticmethod
-    async def get_conversations(instagram_account: InstagramAccount, db: Session) -> List[Dict]:
-        """Fetch all conversations for an Instagram account"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{InstagramService.BASE_URL}/{instagram_account.instagram_business_account_id}/conversations",
-                params={
-                    "access_token": instagram_account.page_access_token,
-                    "fields": "id,updated_time,participants"
-                }
+    async def get_conversations(instagram_account: InstagramAccount, db: AsyncSession) -> List[Dict]:
+        """
+        Fetch all conversations for an Instagram account and sync them into
+        the conversations table with a constant number of statements.
+        """
+        response = await InstagramService._request(
+            "GET",
+            f"{instagram_account.instagram_business_account_id}/conversations",
+            instagram_account.page_access_token,
+            params={"fields": "id,updated_time,participants"}
+        )
+        
+        if response.status_code != 200:
+            raise Exception("Failed to fetch conversations")
+        
+        own_id = instagram_account.instagram_business_account_id
+        threads = {}
+        for conv_data in response.json().get("data", []):
+            participants = conv_data.get("participants", {}).get("data", [])
+            other_participant = next((p for p in participants if p["id"] != own_id), None)
+            threads[conv_data["id"]] = (other_participant, _graph_time(conv_data.get("updated_time")))
+
+        if not threads:
+            return []
+
+        # Resolve all threads with one query
+        result = await db.execute(
+            select(Conversation.thread_id, Conversation.id).where(Conversation.thread_id.in_(threads))
+        )
+        existing = dict(result.all())
+
+        # Create new conversations in bulk; threads without another participant are skipped
+        new_rows = [
+            {
+                "instagram_account_id": instagram_account.id,
+                "thread_id": thread_id,
+                "participant_id": other_participant.get("id"),
+                "participant_username": other_participant.get("username"),
+                "last_message_time": updated_time,
+            }
+            for thread_id, (other_participant, updated_time) in threads.items()
+            if thread_id not in existing and other_participant
+        ]
+        if new_rows:
+            result = await db.execute(
+                insert_ignore(db, Conversation, ["thread_id"]).returning(Conversation.thread_id),
+                new_rows
             )
-            
-            if response.status_code != 200:
-                raise Exception("Failed to fetch conversations")
-            
-            conversations_data = response.json()
-            result = []
-            
-            for conv_data in conversations_data.get("data", []):
-                # Get or create conversation in database
-                conversation = db.query(Conversation).filter(
-                    Conversation.thread_id == conv_data["id"]
-                ).first()
-                
-                participants = conv_data.get("participants", {}).get("data", [])
-                other_participant = None
-                for p in participants:
-                    if p["id"] != instagram_account.instagram_business_account_id:
-                        other_participant = p
-                        break
-                
-                if not conversation and other_participant:
-                    conversation = Conversation(
-                        instagram_account_id=instagram_account.id,
-                        thread_id=conv_data["id"],
-                        participant_id=other_participant.get("id"),
-                        participant_username=other_participant.get("username"),
-                        last_message_time=datetime.fromisoformat(
-                            conv_data["updated_time"].replace("Z", "+00:00")
-                        )
-                    )
-                    db.add(conversation)
-                    db.commit()
-                    db.refresh(conversation)
-                
-                if conversation:
-                    result.append({
-                        "id": conversation.id,
-                        "thread_id": conversation.thread_id,
-                        "participant_id": conversation.participant_id,
-                        "participant_username": conversation.participant_username,
-                        "last_message_time": conversation.last_message_time,
-                        "unread_count": conversation.unread_count
-                    })
-            
-            return result
-    
+            created = {thread_id for thread_id, in result}
+
+            # Threads another request created in the meantime are updated below
+            lost = [row["thread_id"] for row in new_rows if row["thread_id"] not in created]
+            if lost:
+                result = await db.execute(
+                    select(Conversation.thread_id, Conversation.id).where(Conversation.thread_id.in_(lost))
+                )
+                existing.update(result.all())
+
+        # Refresh existing conversations with one statement; last_message_time only moves forward
+        updates = [
+            {
+                "conversation_id": conversation_id,
+                "updated_time": threads[thread_id][1],
+                "username": threads[thread_id][0].get("username") if threads[thread_id][0] else None,
+            }
+            for thread_id, conversation_id in existing.items()
+        ]
+        if updates:
+            table = Conversation.__table__
+            await db.execute(
+                update(table)
+                .where(table.c.id == bindparam("conversation_id"))
+                .values(
+                    last_message_time=case(
+                        (
+                            or_(
+                                table.c.last_message_time.is_(None),
+                                table.c.last_message_time < bindparam("updated_time")
+                            ),
+                            bindparam("updated_time")
+                        ),
+                        else_=table.c.last_message_time
+                    ),
+                    participant_username=func.coalesce(bindparam("username"), table.c.participant_username)
+                ),
+                updates
+            )
+        await db.commit()
+
+        # Return the synced conversations in Graph API order
+        result = await db.execute(
+            select(Conversation).where(Conversation.thread_id.in_(threads))
+        )
+        conversations = {conversation.thread_id: conversation for conversation in result.scalars()}
+        return [
+            {
+                "id": conversation.id,
+                "thread_id": conversation.thread_id,
+                "participant_id": conversation.participant_id,
+                "participant_username": conversation.participant_username,
+                "last_message_time": conversation.last_message_time,
+                "unread_count": conversation.unread_count
+            }
+            for conversation in (conversations.get(thread_id) for thread_id in threads)
+            if conversation
+        ]
+
     @staticmethod
     async def get_messages(conversation: Conversation, instagram_account: InstagramAccount) -> List[Dict]:
         """Fetch messages from a conversation"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{InstagramService.BASE_URL}/{conversation.thread_id}/messages",
-                params={
-                    "access_token": instagram_account.page_access_token,
-                    "fields": "id,from,to,message,created_time,attachments"
-                }
-            )
-            
-            if response.status_code != 200:
-                raise Exception("Failed to fetch messages")
-            
-            messages_data = response.json()
-            result = []
-            
-            for msg_data in messages_data.get("data", []):
-                result.append({
-                    "id": msg_data.get("id"),
-                    "sender_id": msg_data.get("from", {}).get("id"),
-                    "message_text": msg_data.get("message"),
-                    "created_time": msg_data.get("created_time"),
-                    "attachments": msg_data.get("attachments", {}).get("data", [])
-                })
-            
-            return result
-    
+        response = await InstagramService._request(
+            "GET",
+            f"{conversation.thread_id}/messages",
+            instagram_account.page_access_token,
+            params={"fields": "id,from,to,message,created_time,attachments"}
+        )
+        
+        if response.status_code != 200:
+            raise Exception("Failed to fetch messages")
+        
+        messages_data = response.json()
+        result = []
+        
+        for msg_data in messages_data.get("data", []):
+            result.append({
+                "id": msg_data.get("id"),
+                "sender_id": msg_data.get("from", {}).get("id"),
+                "message_text": msg_data.get("message"),
+                "created_time": msg_data.get("created_time"),
+                "attachments": msg_data.get("attachments", {}).get("data", [])
+            })
+
+        return result
+
+    @staticmethod
+    async def sync_messages(conversation: Conversation, instagram_account: InstagramAccount, db: AsyncSession):
+        """Fetch a conversation's messages from the Graph API and store the ones not seen yet"""
+        messages = await InstagramService.get_messages(conversation, instagram_account)
+        own_id = instagram_account.instagram_business_account_id
+        rows = [
+            {
+                "conversation_id": conversation.id,
+                "message_id": msg["id"],
+                "sender_id": msg["sender_id"],
+                "recipient_id": conversation.participant_id if msg["sender_id"] == own_id else own_id,
+                "message_text": msg["message_text"],
+                "attachments": msg["attachments"] or None,
+                "is_from_me": msg["sender_id"] == own_id,
+                "sent_at": _graph_time(msg["created_time"]),
+            }
+            for msg in messages
+            if msg["id"]
+        ]
+        if rows:
+            await db.execute(insert_ignore(db, Message, ["message_id"]), rows)
+            await db.commit()
+
     @staticmethod
     async def send_message(
         instagram_account: InstagramAccount,
@@ -151,38 +318,49 @@ class InstagramService:
         message_text: str
     ) -> Dict:
         """Send a message to a user"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{InstagramService.BASE_URL}/me/messages",
-                params={"access_token": instagram_account.page_access_token},
-                json={
-                    "recipient": {"id": recipient_id},
-                    "message": {"text": message_text}
-                }
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to send message: {response.text}")
-            
-            return response.json()
+        response = await InstagramService._request(
+            "POST",
+            "me/messages",
+            instagram_account.page_access_token,
+            json={
+                "recipient": {"id": recipient_id},
+                "message": {"text": message_text}
+            }
+        )
+        
+        if response.status_code != 200:
+            raise GraphAPIError.from_response(f"Failed to send message: {response.text}", response)
+        
+        return response.json()
     
     @staticmethod
-    async def refresh_token(instagram_account: InstagramAccount, db: Session):
+    async def exchange_token(access_token: str) -> Tuple[str, datetime]:
+        """
+        Exchange a token for a fresh long-lived one with the app credentials.
+        Returns the new token and its expiry; raises GraphAPIError on failure.
+        """
+        response = await get_graph_client().get(
+            f"{InstagramService.BASE_URL}/oauth/access_token",
+            params={
+                "grant_type": "fb_exchange_token",
+                "client_id": settings.FACEBOOK_APP_ID,
+                "client_secret": settings.FACEBOOK_APP_SECRET,
+                "fb_exchange_token": access_token
+            }
+        )
+
+        if response.status_code != 200:
+            raise GraphAPIError.from_response(f"Failed to refresh token: {response.text}", response)
+
+        data = response.json()
+        expires_in = data.get("expires_in", 5184000)
+        return data["access_token"], datetime.utcnow() + timedelta(seconds=expires_in)
+
+    @staticmethod
+    async def refresh_token(instagram_account: InstagramAccount, db: AsyncSession):
         """Refresh the page access token to long-lived token"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{InstagramService.BASE_URL}/oauth/access_token",
-                params={
-                    "grant_type": "fb_exchange_token",
-                    "client_id": instagram_account.page_id,
-                    "client_secret": instagram_account.page_access_token,
-                    "fb_exchange_token": instagram_account.page_access_token
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                instagram_account.page_access_token = data["access_token"]
-                expires_in = data.get("expires_in", 5184000)
-                instagram_account.token_expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
-                db.commit()
+        token, expires_at = await InstagramService.exchange_token(instagram_account.page_access_token)
+        instagram_account.page_access_token = token
+        instagram_account.token_expires_at = expires_at
+        await db.commit()
+        account_cache.update_token(instagram_account.instagram_business_account_id, token)
@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+from app.core.config import settings
+
+
+class MessageDeduplicator:
+    """
+    Time-windowed seen-set of webhook message ids (mids), checked before
+    any database work so redelivered webhooks are dropped in microseconds.
+
+    Mids committed within the window are kept in a bounded LRU; a hit is
+    a certain duplicate and is dropped. Everything else is passed on and
+    the INSERT ... ON CONFLICT DO NOTHING on messages.message_id decides,
+    which also catches duplicates older than the LRU or seen only by
+    another worker.
+    """
+
+    def __init__(self, max_entries: int, window_seconds: float):
+        self.max_entries = max_entries
+        self.window_seconds = window_seconds
+        self._recent: "OrderedDict[str, float]" = OrderedDict()
+        self.duplicates = 0
+        self.db_duplicates = 0
+
+    def filter(self, messages: Iterable) -> List:
+        """Drop messages whose mid was already processed or repeats within the batch"""
+        now = time.monotonic()
+        self._expire(now)
+        fresh = []
+        batch = set()
+        for message in messages:
+            mid = message.message_id
+            if mid is None:
+                fresh.append(message)
+                continue
+            if mid in batch or mid in self._recent:
+                self.duplicates += 1
+                continue
+            batch.add(mid)
+            fresh.append(message)
+        return fresh
+
+    def mark_seen(self, mids: Iterable[str]):
+        """Remember mids whose messages have been committed"""
+        now = time.monotonic()
+        for mid in mids:
+            if mid is None:
+                continue
+            self._recent[mid] = now
+            self._recent.move_to_end(mid)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+
+    def record_db_duplicates(self, count: int):
+        self.db_duplicates += count
+
+    def _expire(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._recent:
+            mid, seen_at = next(iter(self._recent.items()))
+            if seen_at >= cutoff:
+                break
+            self._recent.popitem(last=False)
+
+    def stats(self) -> Dict:
+        return {
+            "recent": len(self._recent),
+            "max_entries": self.max_entries,
+            "duplicates": self.duplicates,
+            "db_duplicates": self.db_duplicates,
+        }
+
+
+message_dedup = MessageDeduplicator(
+    max_entries=settings.WEBHOOK_DEDUP_MAX_ENTRIES,
+    window_seconds=settings.WEBHOOK_DEDUP_WINDOW_SECONDS
+)
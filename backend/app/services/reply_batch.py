@@ -0,0 +1,123 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.message import Message
+from app.models.automation_rule import AutomationRule
+from app.models.scheduled_reply import ScheduledReply, TimerKind, TimerStatus
+
+
+@dataclass
+class ReplyBatch:
+    """
+    Automated replies, delayed-reply timers and rule statistics collected
+    while processing a batch, written together in one flush.
+    """
+    messages: List[Dict] = field(default_factory=list)
+    timers: List[Dict] = field(default_factory=list)
+    # rule_id -> [triggered, succeeded, failed, last_triggered_at]
+    rule_stats: Dict[int, list] = field(default_factory=dict)
+
+    def record(self, rule_id: int, success: bool):
+        stats = self.rule_stats.setdefault(rule_id, [0, 0, 0, None])
+        stats[0] += 1
+        if success:
+            stats[1] += 1
+            stats[3] = datetime.utcnow()
+        else:
+            stats[2] += 1
+
+    def add_message(
+        self,
+        conversation_id: int,
+        result: Dict,
+        sender_id: str,
+        recipient_id: str,
+        message_text: str,
+        rule_id: Optional[int]
+    ):
+        """Store an automated message that was sent"""
+        self.messages.append({
+            "conversation_id": conversation_id,
+            "message_id": result.get("message_id") or f"auto_{uuid4().hex}",
+            "sender_id": sender_id,
+            "recipient_id": recipient_id,
+            "message_text": message_text,
+            "is_from_me": True,
+            "is_automated": True,
+            "automation_rule_id": rule_id,
+            "sent_at": datetime.utcnow(),
+        })
+
+    def schedule(
+        self,
+        account_id: int,
+        conversation_id: int,
+        recipient_id: str,
+        message_text: str,
+        rule_id: int,
+        delay_seconds: int,
+        trigger_acquired_at: Optional[datetime] = None
+    ):
+        """
+        Queue a reply to be sent by the timer engine after a delay.
+        trigger_acquired_at is the time the rule's trigger limits were
+        counted for it, so the timer engine can undo that if it fails.
+        """
+        self.timers.append({
+            "kind": TimerKind.REPLY.value,
+            "instagram_account_id": account_id,
+            "automation_rule_id": rule_id,
+            "conversation_id": conversation_id,
+            "recipient_id": recipient_id,
+            "message_text": message_text,
+            "due_at": datetime.utcnow() + timedelta(seconds=delay_seconds),
+            "status": TimerStatus.PENDING.value,
+            "attempts": 0,
+            "trigger_acquired_at": trigger_acquired_at,
+        })
+
+    async def write(self, db: AsyncSession) -> List[Tuple[int, datetime]]:
+        """
+        Write automated messages, timers and rule counters; the caller
+        commits. Returns (id, due_at) of the new timers.
+        """
+        if self.messages:
+            await db.execute(insert(Message), self.messages)
+
+        timers = []
+        if self.timers:
+            result = await db.execute(
+                insert(ScheduledReply).returning(ScheduledReply.id, ScheduledReply.due_at),
+                self.timers
+            )
+            timers = [tuple(row) for row in result]
+
+        if self.rule_stats:
+            table = AutomationRule.__table__
+            await db.execute(
+                update(table)
+                .where(table.c.id == bindparam("rule_id"))
+                .values(
+                    triggered_count=table.c.triggered_count + bindparam("triggered"),
+                    success_count=table.c.success_count + bindparam("succeeded"),
+                    failure_count=table.c.failure_count + bindparam("failed"),
+                    last_triggered_at=func.coalesce(bindparam("fired_at"), table.c.last_triggered_at)
+                ),
+                [
+                    {
+                        "rule_id": rule_id,
+                        "triggered": triggered,
+                        "succeeded": succeeded,
+                        "failed": failed,
+                        "fired_at": fired_at,
+                    }
+                    for rule_id, (triggered, succeeded, failed, fired_at) in self.rule_stats.items()
+                ]
+            )
+
+        return timers
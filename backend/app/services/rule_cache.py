@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.automation_rule import AutomationRule, RuleStatus, TriggerType
+from app.models.instagram_account import InstagramAccount
+from app.services.rule_matcher import RuleMatcher
+
+
+@dataclass(frozen=True)
+class RuleSnapshot:
+    """Read-only copy of the rule fields needed to evaluate and fire a rule"""
+    id: int
+    trigger_type: TriggerType
+    trigger_keywords: Optional[Tuple[str, ...]]
+    trigger_schedule: Optional[dict]
+    reply_message: str
+    reply_delay_seconds: int
+    priority: int
+    max_triggers_per_user: Optional[int]
+    cooldown_minutes: Optional[int]
+
+
+@dataclass(frozen=True)
+class CachedRuleSet:
+    """An account's active rules, highest priority first, with their compiled matcher"""
+    version: int
+    rules: Tuple[RuleSnapshot, ...]
+    matcher: RuleMatcher
+
+
+class RuleCache:
+    """
+    In-process LRU cache of each account's active rule set.
+
+    Entries are stamped with the account's rules_version. The automation
+    routes bump that column whenever rules change, and every lookup reads
+    the current stamp from the database (one indexed primary-key query per
+    payload, never cached), so any process holding a copy with an older
+    stamp reloads it as soon as the change is committed. A reload racing
+    an uncommitted change caches the old rules under the old stamp, which
+    the committed bump then makes stale.
+    """
+
+    def __init__(self, max_accounts: int):
+        self.max_accounts = max_accounts
+        self._entries: "OrderedDict[int, CachedRuleSet]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    async def get_many(self, db: AsyncSession, account_ids: Iterable[int]) -> Dict[int, CachedRuleSet]:
+        """Return the active rules of several accounts, checked against their current rules_version"""
+        account_ids = set(account_ids)
+        if not account_ids:
+            return {}
+        result = await db.execute(
+            select(InstagramAccount.id, InstagramAccount.rules_version).where(InstagramAccount.id.in_(account_ids))
+        )
+        return {account_id: await self.get(db, account_id, version) for account_id, version in result.all()}
+
+    async def get(self, db: AsyncSession, account_id: int, version: int) -> CachedRuleSet:
+        """Return the active rules for an account, loading them on miss or stale version"""
+        cached = self._entries.get(account_id)
+        if cached is not None:
+            if cached.version == version:
+                self.hits += 1
+                self._entries.move_to_end(account_id)
+                return cached
+            self.stale += 1
+        self.misses += 1
+
+        rule_set = await self._load(db, account_id, version)
+        self._entries[account_id] = rule_set
+        self._entries.move_to_end(account_id)
+        while len(self._entries) > self.max_accounts:
+            self._entries.popitem(last=False)
+        return rule_set
+
+    async def _load(self, db: AsyncSession, account_id: int, version: int) -> CachedRuleSet:
+        result = await db.execute(select(
+            AutomationRule.id,
+            AutomationRule.trigger_type,
+            AutomationRule.trigger_keywords,
+            AutomationRule.trigger_schedule,
+            AutomationRule.reply_message,
+            AutomationRule.reply_delay_seconds,
+            AutomationRule.priority,
+            AutomationRule.max_triggers_per_user,
+            AutomationRule.cooldown_minutes
+        ).where(
+            AutomationRule.instagram_account_id == account_id,
+            AutomationRule.status == RuleStatus.ACTIVE
+        ).order_by(AutomationRule.priority.desc(), AutomationRule.id))
+
+        rules = tuple(
+            RuleSnapshot(
+                id=row.id,
+                trigger_type=row.trigger_type,
+                trigger_keywords=tuple(row.trigger_keywords) if row.trigger_keywords else None,
+                trigger_schedule=row.trigger_schedule,
+                reply_message=row.reply_message,
+                reply_delay_seconds=row.reply_delay_seconds or 0,
+                priority=row.priority or 0,
+                max_triggers_per_user=row.max_triggers_per_user,
+                cooldown_minutes=row.cooldown_minutes
+            )
+            for row in result
+        )
+        return CachedRuleSet(version=version, rules=rules, matcher=RuleMatcher(rules))
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "accounts": len(self._entries),
+            "max_accounts": self.max_accounts,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+rule_cache = RuleCache(max_accounts=settings.RULE_CACHE_MAX_ACCOUNTS)
+
+
+async def bump_rules_version(db: AsyncSession, account_id: int):
+    """
+    Mark an account's rules as changed. Must run in the same transaction
+    as the rule change; every process sees the new stamp after commit.
+    """
+    await db.execute(
+        update(InstagramAccount)
+        .where(InstagramAccount.id == account_id)
+        .values(rules_version=InstagramAccount.rules_version + 1)
+    )
@@ -0,0 +1,88 @@
+from collections import deque
+from typing import Dict, List, Sequence
+
+from app.models.automation_rule import TriggerType
+
+
+class RuleMatcher:
+    """
+    Compiled matcher for one account's active automation rules.
+
+    Keywords of all KEYWORD rules are lowercased once and compiled into a
+    single Aho-Corasick automaton, so a message is scanned in one pass
+    regardless of how many rules or keywords the account has. Rules are
+    identified by their rank, i.e. their index in the priority-ordered
+    list the matcher was built from.
+    """
+
+    def __init__(self, rules: Sequence):
+        self.size = len(rules)
+        # Ranks of rules that are candidates for every message
+        self._unconditional: List[int] = []
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[frozenset] = [frozenset()]
+
+        own_output: List[set] = [set()]
+        for rank, rule in enumerate(rules):
+            if rule.trigger_type in (TriggerType.NEW_MESSAGE, TriggerType.WELCOME):
+                self._unconditional.append(rank)
+            elif rule.trigger_type == TriggerType.KEYWORD:
+                for keyword in rule.trigger_keywords or []:
+                    keyword = keyword.lower()
+                    if not keyword:
+                        # An empty keyword is contained in every message
+                        self._unconditional.append(rank)
+                        continue
+                    node = self._insert(keyword, own_output)
+                    own_output[node].add(rank)
+
+        self._build_links(own_output)
+
+    def _insert(self, keyword: str, own_output: List[set]) -> int:
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                own_output.append(set())
+            node = next_node
+        return node
+
+    def _build_links(self, own_output: List[set]):
+        self._output = [frozenset(ranks) for ranks in own_output]
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                # Merge outputs along the suffix chain so a scan never walks it
+                if self._output[self._fail[child]]:
+                    self._output[child] = self._output[child] | self._output[self._fail[child]]
+                queue.append(child)
+
+    def candidates(self, message_text: str) -> List[int]:
+        """
+        Return the ranks of rules that may fire for a message, highest
+        priority first. KEYWORD rules are included only if one of their
+        keywords occurs in the text; WELCOME rules still need the caller
+        to check the conversation state.
+        """
+        matched = set(self._unconditional)
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for char in message_text.lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                matched |= output[node]
+        return sorted(matched)
+
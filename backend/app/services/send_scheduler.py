@@ -0,0 +1,249 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+
+from app.core.config import settings
+from app.services.instagram_service import GraphAPIError, InstagramService
+
+
+class TokenBucket:
+    """
+    Token bucket with an adaptive refill rate.
+    The rate is halved when the Graph API throttles us and recovers
+    additively on every successful send, up to the configured rate.
+    """
+
+    def __init__(self, rate: float, capacity: float, min_rate: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for a while and slow down afterwards"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+@dataclass
+class _SendRequest:
+    instagram_account: object
+    recipient_id: str
+    message_text: str
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class _PageLane:
+    """FIFO of pending sends for one page, dispatched by a single worker"""
+
+    def __init__(self, account_id: int):
+        self.account_id = account_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.SEND_QUEUE_MAXSIZE)
+        self.bucket = TokenBucket(
+            rate=settings.SEND_RATE_PER_SECOND,
+            capacity=settings.SEND_BURST,
+            min_rate=settings.SEND_MIN_RATE_PER_SECOND
+        )
+        self.slots = asyncio.Semaphore(settings.SEND_CONCURRENCY)
+        self.worker: Optional[asyncio.Task] = None
+        # Sends in flight, and the latest one per recipient, which the next send to them waits for
+        self.in_flight: Set[asyncio.Task] = set()
+        self.tails: Dict[str, asyncio.Task] = {}
+        self.rate_limited_count = 0
+
+
+class SendScheduler:
+    """
+    Per-page rate limiter and ordered send queue in front of
+    InstagramService.send_message.
+
+    Every page gets its own token bucket and FIFO lane, so one busy page
+    cannot starve the others. The lane worker starts sends in the order
+    they were scheduled, as fast as the bucket hands out tokens and with
+    at most SEND_CONCURRENCY in flight, so throughput follows the rate
+    rather than the Graph API round trip. A send to a recipient who
+    already has one in flight waits for it, keeping each recipient's
+    messages in order. Rate-limit errors pause the bucket (honoring
+    Retry-After when present) and the send is retried in place.
+    """
+
+    def __init__(self):
+        self._lanes: Dict[int, _PageLane] = {}
+        self.sent_count = 0
+        self.failed_count = 0
+        self.retried_count = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def send(self, instagram_account, recipient_id: str, message_text: str) -> Dict:
+        """Schedule a message and wait until it has been sent"""
+        lane = self._lanes.get(instagram_account.id)
+        if lane is None:
+            lane = self._lanes[instagram_account.id] = _PageLane(instagram_account.id)
+        if lane.worker is None or lane.worker.done():
+            lane.worker = asyncio.create_task(
+                self._drain(lane), name=f"send-lane-{instagram_account.id}"
+            )
+
+        request = _SendRequest(
+            instagram_account=instagram_account,
+            recipient_id=recipient_id,
+            message_text=message_text,
+            future=asyncio.get_running_loop().create_future()
+        )
+        await lane.queue.put(request)
+        return await request.future
+
+    async def _drain(self, lane: _PageLane):
+        while True:
+            try:
+                request = await asyncio.wait_for(
+                    lane.queue.get(), timeout=settings.SEND_LANE_IDLE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                if lane.queue.empty() and not lane.in_flight:
+                    self._lanes.pop(lane.account_id, None)
+                    return
+                continue
+
+            await lane.slots.acquire()
+            try:
+                await lane.bucket.acquire()
+            except BaseException:
+                lane.slots.release()
+                raise
+            previous = lane.tails.get(request.recipient_id)
+            task = asyncio.create_task(self._dispatch(lane, request, previous))
+            lane.tails[request.recipient_id] = task
+            lane.in_flight.add(task)
+
+    async def _dispatch(self, lane: _PageLane, request: _SendRequest, previous: Optional[asyncio.Task]):
+        try:
+            if previous is not None:
+                # The previous send resolves its own future; only its completion matters here
+                await asyncio.gather(previous, return_exceptions=True)
+            await self._send(lane, request, has_token=True)
+        finally:
+            lane.slots.release()
+            lane.queue.task_done()
+            task = asyncio.current_task()
+            lane.in_flight.discard(task)
+            if lane.tails.get(request.recipient_id) is task:
+                del lane.tails[request.recipient_id]
+
+    async def _send(self, lane: _PageLane, request: _SendRequest, has_token: bool = False):
+        attempt = 0
+        while True:
+            if not has_token:
+                await lane.bucket.acquire()
+            has_token = False
+            if attempt == 0:
+                self._record_wait(time.monotonic() - request.enqueued_at)
+            try:
+                result = await InstagramService.send_message(
+                    request.instagram_account,
+                    request.recipient_id,
+                    request.message_text
+                )
+            except GraphAPIError as e:
+                if e.is_rate_limit and attempt < settings.SEND_MAX_RETRIES:
+                    lane.rate_limited_count += 1
+                    self.retried_count += 1
+                    delay = e.retry_after or min(
+                        settings.SEND_BACKOFF_SECONDS * (2 ** attempt),
+                        settings.SEND_MAX_BACKOFF_SECONDS
+                    )
+                    lane.bucket.pause(delay)
+                    attempt += 1
+                    continue
+                self._fail(request, e)
+                return
+            except Exception as e:
+                self._fail(request, e)
+                return
+
+            lane.bucket.on_success()
+            self.sent_count += 1
+            if not request.future.done():
+                request.future.set_result(result)
+            return
+
+    def _fail(self, request: _SendRequest, error: Exception):
+        self.failed_count += 1
+        if not request.future.done():
+            request.future.set_exception(error)
+
+    def _record_wait(self, waited: float):
+        self.wait_count += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    async def stop(self, timeout: float):
+        """Wait for queued sends to go out, then stop the lane workers"""
+        lanes = list(self._lanes.values())
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(lane.queue.join() for lane in lanes)), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            print("Send scheduler drain timed out; pending sends were dropped")
+
+        workers = [lane.worker for lane in lanes if lane.worker is not None]
+        workers += [task for lane in lanes for task in lane.in_flight]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._lanes.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "lanes": len(self._lanes),
+            "queued": sum(lane.queue.qsize() for lane in self._lanes.values()),
+            "in_flight": sum(len(lane.in_flight) for lane in self._lanes.values()),
+            "sent": self.sent_count,
+            "failed": self.failed_count,
+            "retried": self.retried_count,
+            "wait_avg_seconds": round(self.wait_total / self.wait_count, 4) if self.wait_count else 0.0,
+            "wait_max_seconds": round(self.wait_max, 4),
+            "pages": {
+                lane.account_id: {
+                    "queued": lane.queue.qsize(),
+                    "in_flight": len(lane.in_flight),
+                    "rate": round(lane.bucket.rate, 2),
+                    "rate_limited": lane.rate_limited_count,
+                }
+                for lane in self._lanes.values()
+                if lane.queue.qsize() or lane.rate_limited_count
+            },
+        }
+
+
+send_scheduler = SendScheduler()
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import insert_ignore
+from app.models.service_lease import ServiceLease
+
+
+async def acquire_lease(db: AsyncSession, name: str, owner: str, ttl_seconds: float) -> bool:
+    """
+    Take or renew the named lease for ttl_seconds. Returns True if owner
+    holds it: it was free, expired or already ours. Commits.
+    """
+    now = datetime.utcnow()
+    await db.execute(insert_ignore(db, ServiceLease, ["name"]), [{"name": name, "owner": None, "expires_at": now}])
+    result = await db.execute(
+        update(ServiceLease)
+        .where(
+            ServiceLease.name == name,
+            or_(ServiceLease.owner == owner, ServiceLease.owner.is_(None), ServiceLease.expires_at < now)
+        )
+        .values(owner=owner, expires_at=now + timedelta(seconds=ttl_seconds))
+        .returning(ServiceLease.name)
+        .execution_options(synchronize_session=False)
+    )
+    held = result.first() is not None
+    await db.commit()
+    return held
+
+
+async def release_lease(db: AsyncSession, name: str, owner: str):
+    """Give the named lease up if owner holds it, so another process can take it at once. Commits."""
+    await db.execute(
+        update(ServiceLease)
+        .where(ServiceLease.name == name, ServiceLease.owner == owner)
+        .values(owner=None)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
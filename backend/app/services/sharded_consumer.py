@@ -0,0 +1,314 @@
+import asyncio
+import os
+import socket
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.services.event_log import START, EventLog, HashRing, get_event_log, partition_for
+from app.services.webhook_queue import webhook_queue
+
+
+async def publish_webhook_events(events: List[Dict]):
+    """Append a payload's events to the event log, one entry per partition they hash to"""
+    batches: Dict[int, List[Dict]] = defaultdict(list)
+    for event in events:
+        partition = partition_for(event.get("recipient", {}).get("id"), settings.WEBHOOK_PARTITIONS)
+        batches[partition].append(event)
+    await get_event_log().publish(batches)
+
+
+class ShardedConsumer:
+    """
+    Consumes the partitioned webhook event log in one of many processes.
+
+    Intake hashes each Instagram account onto one of WEBHOOK_PARTITIONS
+    partitions. Consumers register in the log with a heartbeat and place
+    themselves on a consistent hash ring; each wants the partitions that
+    land on its arc, so one account's events, and its dedup and trigger
+    state, stay in one process. When a consumer joins or its registration
+    expires, only the partitions next to it move.
+
+    A consumer only reads a partition while it holds the partition's
+    claim in the log. On a rebalance the previous owner stops reading the
+    partitions it lost, lets the batch in flight finish, commits its
+    position and releases the claim; the new owner, which retries its
+    claims every WEBHOOK_SHARD_HEARTBEAT_SECONDS / 5 until then, resumes
+    from exactly that position. Unclaimed partitions, at startup or after
+    the holder's registration expired, are taken at once. Entries are fed
+    through the local webhook queue, so events keep their per-conversation
+    order. Delivery is at-least-once: a partition's position only moves
+    past entries whose events were all processed. After a failure the
+    partition is read again from the failed entry, after
+    WEBHOOK_SHARD_RETRY_SECONDS doubled per attempt, and an entry still
+    failing after WEBHOOK_SHARD_MAX_ATTEMPTS reads goes to the log's
+    dead-letter stream. Entries read again, after a failure or because a
+    consumer died, are dropped by the message dedup where they were
+    already stored.
+    """
+
+    def __init__(
+        self,
+        partitions: int,
+        heartbeat_seconds: float,
+        member_ttl_seconds: float,
+        read_count: int,
+        max_attempts: int,
+        retry_seconds: float
+    ):
+        self.partitions = partitions
+        self.heartbeat_seconds = heartbeat_seconds
+        self.member_ttl_seconds = member_ttl_seconds
+        self.read_count = read_count
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._log: Optional[EventLog] = None
+        self._membership_task: Optional[asyncio.Task] = None
+        self._consume_task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Claimed partition -> id of the last entry handed to the webhook queue
+        self._owned: Dict[int, str] = {}
+        # Partitions the ring gives us that another consumer still holds
+        self._waiting: Set[int] = set()
+        # Partitions of the batch in flight, and lost ones to release once it is committed
+        self._in_flight: Set[int] = set()
+        self._releasing: Set[int] = set()
+        # (partition, entry id) -> failed reads, and loop time before which a failed partition is not read
+        self._attempts: Dict[Tuple[int, str], int] = {}
+        self._retry_at: Dict[int, float] = {}
+        self._assigned = asyncio.Event()
+        self.member_count = 0
+        self.rebalance_count = 0
+        self.entry_count = 0
+        self.event_count = 0
+        self.failed_count = 0
+        self.retried_count = 0
+        self.dead_letter_count = 0
+
+    async def start(self):
+        if self._consume_task is not None:
+            return
+        self._log = get_event_log()
+        self._assigned = asyncio.Event()
+        self._stopping = False
+        await self._log.heartbeat(self.worker_id, self.member_ttl_seconds)
+        await self._rebalance()
+        self._membership_task = asyncio.create_task(self._membership_loop(), name="webhook-shard-membership")
+        self._consume_task = asyncio.create_task(self._consume_loop(), name="webhook-shard-consumer")
+
+    async def stop(self, timeout: float):
+        """
+        Finish and commit the batch in flight (up to timeout), then release
+        every claim and leave the ring so the partitions move at once.
+        """
+        if self._consume_task is None:
+            return
+        self._stopping = True
+        self._membership_task.cancel()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._consume_task), timeout=timeout)
+        except asyncio.TimeoutError:
+            print("Webhook consumer did not finish its batch in time; it will be read again by the next owner")
+        except Exception as e:
+            print(f"Error stopping webhook consumer: {e}")
+        self._consume_task.cancel()
+        await asyncio.gather(self._membership_task, self._consume_task, return_exceptions=True)
+        self._membership_task = self._consume_task = None
+        try:
+            await self._log.release(self.worker_id, set(self._owned) | self._releasing | self._in_flight)
+            await self._log.leave(self.worker_id)
+        except Exception as e:
+            print(f"Error leaving webhook consumer group: {e}")
+        self._owned.clear()
+        self._waiting.clear()
+        self._in_flight.clear()
+        self._releasing.clear()
+        self._attempts.clear()
+        self._retry_at.clear()
+
+    async def _membership_loop(self):
+        claim_retry_seconds = self.heartbeat_seconds / 5
+        since_heartbeat = 0.0
+        while True:
+            # Retry claims held by a previous owner more often than we heartbeat
+            delay = claim_retry_seconds if self._waiting else self.heartbeat_seconds
+            await asyncio.sleep(delay)
+            since_heartbeat += delay
+            try:
+                if since_heartbeat >= self.heartbeat_seconds or not self._waiting:
+                    await self._log.heartbeat(self.worker_id, self.member_ttl_seconds)
+                    since_heartbeat = 0.0
+                await self._rebalance()
+            except Exception as e:
+                print(f"Error refreshing webhook consumer membership: {e}")
+
+    async def _rebalance(self):
+        members = set(await self._log.members())
+        members.add(self.worker_id)
+        self.member_count = len(members)
+        ring = HashRing(members)
+        wanted = {
+            partition for partition in range(self.partitions)
+            if ring.owner(f"partition-{partition}") == self.worker_id
+        }
+
+        lost = set(self._owned) - wanted
+        for partition in lost:
+            del self._owned[partition]
+            self._retry_at.pop(partition, None)
+        if lost:
+            self._attempts = {key: count for key, count in self._attempts.items() if key[0] in self._owned}
+        # Partitions of the batch in flight are released by the consume loop after its commit
+        self._releasing |= lost & self._in_flight
+        if lost - self._in_flight:
+            await self._log.release(self.worker_id, lost - self._in_flight)
+
+        missing = wanted - set(self._owned) - self._in_flight
+        granted = await self._log.claim(self.worker_id, missing, members) if missing else []
+        if granted:
+            committed = await self._log.committed(granted)
+            for partition in granted:
+                self._owned[partition] = committed.get(partition, START)
+        self._waiting = missing - set(granted)
+
+        if lost or granted:
+            self.rebalance_count += 1
+            print(
+                f"Webhook consumer {self.worker_id}: {len(members)} members, "
+                f"released {len(lost)}, took {len(granted)} and waiting for {len(self._waiting)} partitions"
+            )
+        if self._owned:
+            self._assigned.set()
+        else:
+            self._assigned.clear()
+
+    async def _consume_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._assigned.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+            now = asyncio.get_running_loop().time()
+            positions = {
+                partition: position for partition, position in self._owned.items()
+                if self._retry_at.get(partition, 0) <= now
+            }
+            if not positions:
+                # Every claimed partition is waiting to retry a failed entry
+                await asyncio.sleep(min(max(min(self._retry_at.values(), default=now) - now, 0.01), 1))
+                continue
+            try:
+                batches = await self._log.read(positions, self.read_count, block_ms=1000)
+            except Exception as e:
+                print(f"Error reading webhook event log: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            # Partitions released while the read was blocked are left to their new owner
+            batches = [(partition, entries) for partition, entries in batches if partition in self._owned]
+            if batches:
+                self._in_flight = {partition for partition, _ in batches}
+                try:
+                    await self._process(batches)
+                finally:
+                    self._in_flight = set()
+
+            releasing, self._releasing = self._releasing, set()
+            if releasing:
+                try:
+                    await self._log.release(self.worker_id, releasing)
+                except Exception as e:
+                    print(f"Error releasing webhook partitions: {e}")
+
+    async def _process(self, batches):
+        tracked = []
+        for partition, entries in batches:
+            for entry_id, events in entries:
+                queued = await webhook_queue.enqueue(events, track=True)
+                if queued is None:
+                    # Shutting down; the next owner reads these entries again
+                    return
+                tracked.append((partition, entry_id, events, queued))
+                self.event_count += len(events)
+            self.entry_count += len(entries)
+
+        results = await asyncio.gather(*(
+            asyncio.gather(*futures, return_exceptions=True) for _, _, _, futures in tracked
+        ))
+
+        # Each partition advances up to the entry before its first failure
+        positions: Dict[int, str] = {}
+        failed_partitions: Set[int] = set()
+        for (partition, entry_id, events, _), entry_results in zip(tracked, results):
+            if partition in failed_partitions:
+                continue
+            errors = [result for result in entry_results if isinstance(result, BaseException)]
+            if errors and not await self._give_up(partition, entry_id, events, errors):
+                failed_partitions.add(partition)
+                continue
+            self._attempts.pop((partition, entry_id), None)
+            positions[partition] = entry_id
+        for partition in positions.keys() - failed_partitions:
+            self._retry_at.pop(partition, None)
+
+        for partition, position in positions.items():
+            if partition in self._owned:
+                self._owned[partition] = position
+        try:
+            # Also commits partitions lost during the batch: we hold their claims until released
+            await self._log.commit(self.worker_id, positions)
+        except Exception as e:
+            print(f"Error committing webhook event log positions: {e}")
+
+    async def _give_up(self, partition: int, entry_id: str, events: List[Dict], errors: List[BaseException]) -> bool:
+        """
+        Count a failed read of an entry. Returns True once the entry has
+        been moved to the dead-letter stream and may be committed, False
+        while it is to be read again.
+        """
+        self.failed_count += len(errors)
+        key = (partition, entry_id)
+        attempts = self._attempts.get(key, 0) + 1
+        if attempts < self.max_attempts:
+            self._attempts[key] = attempts
+            self._retry_at[partition] = asyncio.get_running_loop().time() + self.retry_seconds * 2 ** (attempts - 1)
+            self.retried_count += 1
+            print(f"Webhook entry {entry_id} of partition {partition} failed (attempt {attempts}); reading it again")
+            return False
+        try:
+            await self._log.dead_letter(partition, entry_id, events, repr(errors[0]))
+        except Exception as e:
+            print(f"Error dead-lettering webhook entry {entry_id} of partition {partition}: {e}")
+            self._retry_at[partition] = asyncio.get_running_loop().time() + self.retry_seconds
+            return False
+        self._attempts.pop(key, None)
+        self.dead_letter_count += 1
+        print(f"Webhook entry {entry_id} of partition {partition} failed {attempts} times; moved to the dead-letter stream")
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._consume_task is not None,
+            "worker_id": self.worker_id,
+            "members": self.member_count,
+            "partitions": sorted(self._owned),
+            "waiting_partitions": sorted(self._waiting),
+            "rebalances": self.rebalance_count,
+            "entries": self.entry_count,
+            "events": self.event_count,
+            "failed": self.failed_count,
+            "retried": self.retried_count,
+            "dead_lettered": self.dead_letter_count,
+        }
+
+
+sharded_consumer = ShardedConsumer(
+    partitions=settings.WEBHOOK_PARTITIONS,
+    heartbeat_seconds=settings.WEBHOOK_SHARD_HEARTBEAT_SECONDS,
+    member_ttl_seconds=settings.WEBHOOK_SHARD_MEMBER_TTL_SECONDS,
+    read_count=settings.WEBHOOK_SHARD_READ_COUNT,
+    max_attempts=settings.WEBHOOK_SHARD_MAX_ATTEMPTS,
+    retry_seconds=settings.WEBHOOK_SHARD_RETRY_SECONDS
+)
@@ -0,0 +1,497 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+from app.models.automation_rule import AutomationRule, RuleStatus, TriggerType
+from app.models.instagram_account import InstagramAccount
+from app.models.message import Conversation
+from app.models.scheduled_reply import ScheduledReply, TimerKind, TimerStatus
+from app.services.reply_batch import ReplyBatch
+from app.services.send_scheduler import send_scheduler
+from app.services.trigger_store import has_limits, trigger_store
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel.
+
+    Level 0 has one slot per tick; each higher level has slots that span
+    a full rotation of the level below. Adding a timer and advancing the
+    clock are O(1) per timer, independent of how many timers are pending.
+    Timers further out than the wheel covers are rejected and stay in
+    the database until the loader brings them into range.
+    """
+
+    def __init__(self, tick_seconds: float, slots: int, levels: int, now: float):
+        self.tick_seconds = tick_seconds
+        self.slots = slots
+        self.levels = levels
+        self.current_tick = int(now / tick_seconds)
+        self._wheel: List[List[List[Tuple[int, int]]]] = [
+            [[] for _ in range(slots)] for _ in range(levels)
+        ]
+        self._expired: List[int] = []
+        self.size = 0
+
+    def add(self, timer_id: int, due: float) -> bool:
+        """Schedule a timer id at a unix timestamp. Returns False if out of range."""
+        due_tick = int(due / self.tick_seconds)
+        if due_tick <= self.current_tick:
+            self._expired.append(timer_id)
+            self.size += 1
+            return True
+        if not self._place(timer_id, due_tick):
+            return False
+        self.size += 1
+        return True
+
+    def _place(self, timer_id: int, due_tick: int) -> bool:
+        delta = due_tick - self.current_tick
+        span = self.slots
+        for level in range(self.levels):
+            if delta < span:
+                slot = (due_tick // (span // self.slots)) % self.slots
+                self._wheel[level][slot].append((due_tick, timer_id))
+                return True
+            span *= self.slots
+        return False
+
+    def advance(self, now: float) -> List[int]:
+        """Move the clock to now and return the ids of all timers that came due"""
+        due = self._expired
+        self._expired = []
+        target = int(now / self.tick_seconds)
+        while self.current_tick < target:
+            self.current_tick += 1
+            # Cascade higher levels down as their slot comes up
+            span = self.slots ** (self.levels - 1)
+            for level in range(self.levels - 1, 0, -1):
+                if self.current_tick % span == 0:
+                    slot = (self.current_tick // span) % self.slots
+                    entries = self._wheel[level][slot]
+                    self._wheel[level][slot] = []
+                    for due_tick, timer_id in entries:
+                        if due_tick <= self.current_tick:
+                            due.append(timer_id)
+                        else:
+                            self._place(timer_id, due_tick)
+                span //= self.slots
+
+            slot = self.current_tick % self.slots
+            entries = self._wheel[0][slot]
+            self._wheel[0][slot] = []
+            due.extend(timer_id for _, timer_id in entries)
+
+        self.size -= len(due)
+        return due
+
+
+def validate_schedule(schedule: Optional[dict]) -> Optional[dict]:
+    """
+    Check that a trigger_schedule is one of the definitions next_fire_time
+    supports. Raises ValueError describing the first problem found.
+    """
+    if not schedule:
+        return schedule
+    kinds = [key for key in ("interval_minutes", "daily_at", "run_at") if key in schedule]
+    if len(kinds) != 1:
+        raise ValueError("trigger_schedule needs exactly one of interval_minutes, daily_at or run_at")
+    unknown = set(schedule) - {kinds[0]} - ({"weekdays"} if kinds[0] == "daily_at" else set())
+    if unknown:
+        raise ValueError(f"Unsupported trigger_schedule keys: {', '.join(sorted(unknown))}")
+
+    if kinds[0] == "interval_minutes":
+        minutes = schedule["interval_minutes"]
+        if isinstance(minutes, bool) or not isinstance(minutes, int) or minutes <= 0:
+            raise ValueError("interval_minutes must be a positive whole number")
+
+    elif kinds[0] == "daily_at":
+        daily_at = schedule["daily_at"]
+        try:
+            hour, minute = (int(part) for part in daily_at.split(":"))
+        except (AttributeError, ValueError):
+            raise ValueError("daily_at must be a time of day as HH:MM")
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError("daily_at must be a time of day as HH:MM")
+        weekdays = schedule.get("weekdays")
+        if weekdays is not None and (
+            not isinstance(weekdays, list)
+            or not all(isinstance(day, int) and not isinstance(day, bool) and 0 <= day <= 6 for day in weekdays)
+        ):
+            raise ValueError("weekdays must be a list of days from 0 (Monday) to 6")
+
+    else:
+        try:
+            datetime.fromisoformat(schedule["run_at"].replace("Z", "+00:00"))
+        except (AttributeError, ValueError):
+            raise ValueError("run_at must be an ISO 8601 date and time")
+    return schedule
+
+
+def next_fire_time(schedule: Optional[dict], after: datetime) -> Optional[datetime]:
+    """
+    Next occurrence of a trigger_schedule strictly after a UTC datetime.
+
+    Supported definitions:
+        {"interval_minutes": 60}
+        {"daily_at": "09:30", "weekdays": [0, 1, 2, 3, 4]}  (UTC, Monday = 0)
+        {"run_at": "2024-06-01T12:00:00"}                    (UTC, fires once)
+    """
+    if not schedule:
+        return None
+
+    if schedule.get("interval_minutes"):
+        return after + timedelta(minutes=int(schedule["interval_minutes"]))
+
+    if schedule.get("daily_at"):
+        hour, minute = (int(part) for part in schedule["daily_at"].split(":"))
+        weekdays = set(schedule.get("weekdays") or range(7))
+        candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        for _ in range(8):
+            if candidate > after and candidate.weekday() in weekdays:
+                return candidate
+            candidate += timedelta(days=1)
+        return None
+
+    if schedule.get("run_at"):
+        run_at = datetime.fromisoformat(schedule["run_at"].replace("Z", "+00:00"))
+        if run_at.tzinfo is not None:
+            run_at = run_at.astimezone(timezone.utc).replace(tzinfo=None)
+        return run_at if run_at > after else None
+
+    return None
+
+
+async def reschedule_rule(db: AsyncSession, rule: AutomationRule, deleted: bool = False):
+    """
+    Re-arm a SCHEDULED rule after it was created, updated, toggled or
+    deleted. Cancels its pending occurrence and inserts the next one if
+    the rule is still active. Runs in the caller's transaction; the
+    timer loader picks the new occurrence up on its next scan.
+    """
+    await db.execute(
+        update(ScheduledReply)
+        .where(
+            ScheduledReply.automation_rule_id == rule.id,
+            ScheduledReply.kind == TimerKind.RULE_SCHEDULE.value,
+            ScheduledReply.status == TimerStatus.PENDING.value
+        )
+        .values(status=TimerStatus.CANCELLED.value)
+    )
+    if deleted or rule.status != RuleStatus.ACTIVE or rule.trigger_type != TriggerType.SCHEDULED:
+        return
+
+    due_at = next_fire_time(rule.trigger_schedule, datetime.utcnow())
+    if due_at is not None:
+        db.add(ScheduledReply(
+            kind=TimerKind.RULE_SCHEDULE.value,
+            instagram_account_id=rule.instagram_account_id,
+            automation_rule_id=rule.id,
+            due_at=due_at,
+            status=TimerStatus.PENDING.value
+        ))
+
+
+def _timestamp(value: datetime) -> float:
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+class TimerEngine:
+    """
+    Durable timers for delayed replies and SCHEDULED rules.
+
+    The scheduled_replies table is the source of truth, so timers survive
+    restarts and the number of pending timers is bounded only by the
+    database. Timers due within the load horizon are pulled into an
+    in-memory timing wheel by an indexed range scan; when they come due
+    they are claimed with a conditional UPDATE (so several workers never
+    fire the same row) and fired in batches.
+    """
+
+    def __init__(self):
+        self._wheel: Optional[TimingWheel] = None
+        self._loaded: Set[int] = set()
+        self._tasks: List[asyncio.Task] = []
+        self.fired_count = 0
+        self.sent_count = 0
+        self.failed_count = 0
+        self.batches = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._wheel = TimingWheel(
+            tick_seconds=settings.TIMER_TICK_SECONDS,
+            slots=64,
+            levels=3,
+            now=time.time()
+        )
+        self._tasks = [
+            asyncio.create_task(self._load_loop(), name="timer-loader"),
+            asyncio.create_task(self._tick_loop(), name="timer-ticker"),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loaded.clear()
+        self._wheel = None
+
+    def notify(self, timers: Iterable[Tuple[int, datetime]]):
+        """Add freshly committed timers that are due before the next load"""
+        if self._wheel is None:
+            return
+        horizon = time.time() + settings.TIMER_LOAD_HORIZON_SECONDS
+        for timer_id, due_at in timers:
+            due = _timestamp(due_at)
+            if due <= horizon and timer_id not in self._loaded and self._wheel.add(timer_id, due):
+                self._loaded.add(timer_id)
+
+    async def _load_loop(self):
+        while True:
+            try:
+                await self._load()
+            except Exception as e:
+                print(f"Error loading timers: {e}")
+            await asyncio.sleep(settings.TIMER_LOAD_INTERVAL_SECONDS)
+
+    async def _load(self):
+        now = datetime.utcnow()
+        horizon = now + timedelta(seconds=settings.TIMER_LOAD_HORIZON_SECONDS)
+        stale_claim = now - timedelta(seconds=settings.TIMER_CLAIM_TIMEOUT_SECONDS)
+        last_id = 0
+        async with AsyncSessionLocal() as db:
+            while True:
+                result = await db.execute(
+                    select(ScheduledReply.id, ScheduledReply.due_at).where(
+                        or_(
+                            and_(
+                                ScheduledReply.status == TimerStatus.PENDING.value,
+                                ScheduledReply.due_at <= horizon
+                            ),
+                            # Claimed by a worker that died before finishing
+                            and_(
+                                ScheduledReply.status == TimerStatus.FIRING.value,
+                                ScheduledReply.claimed_at < stale_claim
+                            )
+                        ),
+                        ScheduledReply.id > last_id
+                    ).order_by(ScheduledReply.id).limit(settings.TIMER_BATCH_SIZE)
+                )
+                rows = result.all()
+                if not rows:
+                    break
+                self.notify(rows)
+                last_id = rows[-1].id
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(settings.TIMER_TICK_SECONDS)
+            due = self._wheel.advance(time.time())
+            for start in range(0, len(due), settings.TIMER_BATCH_SIZE):
+                batch = due[start:start + settings.TIMER_BATCH_SIZE]
+                try:
+                    await self._fire(batch)
+                except Exception as e:
+                    print(f"Error firing timers: {e}")
+                finally:
+                    self._loaded.difference_update(batch)
+
+    async def _fire(self, timer_ids: List[int]):
+        now = datetime.utcnow()
+        stale_claim = now - timedelta(seconds=settings.TIMER_CLAIM_TIMEOUT_SECONDS)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(ScheduledReply)
+                .where(
+                    ScheduledReply.id.in_(timer_ids),
+                    or_(
+                        ScheduledReply.status == TimerStatus.PENDING.value,
+                        and_(
+                            ScheduledReply.status == TimerStatus.FIRING.value,
+                            ScheduledReply.claimed_at < stale_claim
+                        )
+                    )
+                )
+                .values(
+                    status=TimerStatus.FIRING.value,
+                    claimed_at=now,
+                    attempts=ScheduledReply.attempts + 1
+                )
+                .returning(ScheduledReply.id)
+                .execution_options(synchronize_session=False)
+            )
+            claimed = [row.id for row in result]
+            await db.commit()
+            if not claimed:
+                return
+
+            result = await db.execute(
+                select(ScheduledReply, InstagramAccount)
+                .join(InstagramAccount, InstagramAccount.id == ScheduledReply.instagram_account_id)
+                .where(ScheduledReply.id.in_(claimed))
+            )
+            timers = result.all()
+            self.batches += 1
+            self.fired_count += len(timers)
+
+            replies = ReplyBatch()
+            outcomes: Dict[int, Tuple[str, Optional[str]]] = {}
+            new_timers: List[Tuple[int, datetime]] = []
+
+            reply_timers = []
+            for timer, account in timers:
+                if not account.is_active:
+                    outcomes[timer.id] = (TimerStatus.CANCELLED.value, "Account disconnected")
+                elif timer.kind == TimerKind.RULE_SCHEDULE.value:
+                    new_timers.extend(await self._expand_rule_schedule(db, timer))
+                    outcomes[timer.id] = (TimerStatus.SENT.value, None)
+                else:
+                    reply_timers.append((timer, account))
+
+            async def send(timer, account):
+                try:
+                    result = await send_scheduler.send(account, timer.recipient_id, timer.message_text)
+                except Exception as e:
+                    return timer, account, None, e
+                return timer, account, result, None
+
+            for timer, account, result, error in await asyncio.gather(
+                *(send(timer, account) for timer, account in reply_timers)
+            ):
+                if error is not None:
+                    self.failed_count += 1
+                    outcomes[timer.id] = (TimerStatus.FAILED.value, str(error))
+                    if timer.automation_rule_id:
+                        replies.record(timer.automation_rule_id, success=False)
+                    continue
+
+                self.sent_count += 1
+                outcomes[timer.id] = (TimerStatus.SENT.value, None)
+                if timer.automation_rule_id:
+                    replies.record(timer.automation_rule_id, success=True)
+                if timer.conversation_id:
+                    replies.add_message(
+                        conversation_id=timer.conversation_id,
+                        result=result,
+                        sender_id=account.instagram_business_account_id,
+                        recipient_id=timer.recipient_id,
+                        message_text=timer.message_text,
+                        rule_id=timer.automation_rule_id
+                    )
+
+            # Give back the trigger limits counted for replies that were not sent
+            unsent = [
+                timer for timer, _ in timers
+                if timer.trigger_acquired_at is not None
+                and timer.automation_rule_id
+                and outcomes[timer.id][0] != TimerStatus.SENT.value
+            ]
+            if unsent:
+                await trigger_store.load(db, {(timer.automation_rule_id, timer.recipient_id) for timer in unsent})
+                for timer in unsent:
+                    trigger_store.revert(timer.automation_rule_id, timer.recipient_id, timer.trigger_acquired_at)
+
+            for timer_id, (status, error) in outcomes.items():
+                await db.execute(
+                    update(ScheduledReply)
+                    .where(ScheduledReply.id == timer_id)
+                    .values(status=status, last_error=error)
+                    .execution_options(synchronize_session=False)
+                )
+            await replies.write(db)
+            await db.commit()
+            self.notify(new_timers)
+
+    async def _expand_rule_schedule(self, db: AsyncSession, timer: ScheduledReply) -> List[Tuple[int, datetime]]:
+        """
+        Fire one occurrence of a SCHEDULED rule: queue its message for every
+        conversation still inside the messaging window, then arm the next
+        occurrence.
+        """
+        rule = await db.get(AutomationRule, timer.automation_rule_id)
+        if rule is None or rule.status != RuleStatus.ACTIVE or rule.trigger_type != TriggerType.SCHEDULED:
+            return []
+
+        now = datetime.utcnow()
+        window_start = now - timedelta(hours=settings.SCHEDULED_RULE_WINDOW_HOURS)
+        result = await db.execute(
+            select(Conversation.id, Conversation.participant_id).where(
+                Conversation.instagram_account_id == rule.instagram_account_id,
+                Conversation.last_message_time >= window_start
+            )
+        )
+        targets = [(conversation_id, participant_id) for conversation_id, participant_id in result if participant_id]
+        acquired_at = None
+        if has_limits(rule):
+            acquired_at = now
+            await trigger_store.load(db, {(rule.id, participant_id) for _, participant_id in targets})
+            targets = [
+                (conversation_id, participant_id)
+                for conversation_id, participant_id in targets
+                if trigger_store.acquire(rule, participant_id, now) is not None
+            ]
+
+        rows = [
+            {
+                "kind": TimerKind.REPLY.value,
+                "instagram_account_id": rule.instagram_account_id,
+                "automation_rule_id": rule.id,
+                "conversation_id": conversation_id,
+                "recipient_id": participant_id,
+                "message_text": rule.reply_message,
+                "due_at": now,
+                "status": TimerStatus.PENDING.value,
+                "attempts": 0,
+                "trigger_acquired_at": acquired_at,
+            }
+            for conversation_id, participant_id in targets
+        ]
+
+        next_due = next_fire_time(rule.trigger_schedule, max(timer.due_at, now))
+        if next_due is not None:
+            rows.append({
+                "kind": TimerKind.RULE_SCHEDULE.value,
+                "instagram_account_id": rule.instagram_account_id,
+                "automation_rule_id": rule.id,
+                "conversation_id": None,
+                "recipient_id": None,
+                "message_text": None,
+                "due_at": next_due,
+                "status": TimerStatus.PENDING.value,
+                "attempts": 0,
+                "trigger_acquired_at": None,
+            })
+
+        if not rows:
+            return []
+        result = await db.execute(
+            insert(ScheduledReply).returning(ScheduledReply.id, ScheduledReply.due_at),
+            rows
+        )
+        return [tuple(row) for row in result]
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "in_memory": self._wheel.size if self._wheel else 0,
+            "fired": self.fired_count,
+            "sent": self.sent_count,
+            "failed": self.failed_count,
+            "batches": self.batches,
+        }
+
+
+timer_engine = TimerEngine()
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, select, update
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+from app.models.instagram_account import InstagramAccount
+from app.models.user import User
+from app.services.account_cache import account_cache
+from app.services.instagram_service import InstagramService
+from app.services.service_lease import acquire_lease, release_lease
+
+LEASE_NAME = "token-refresher"
+
+
+class TokenRefresher:
+    """
+    Refreshes page and user access tokens before they expire.
+
+    Every API process runs the loop, but only the holder of the
+    token-refresher service lease refreshes; it renews the lease each
+    run and the others take over once it lapses (TOKEN_REFRESH_LEASE_SECONDS).
+    Every TOKEN_REFRESH_INTERVAL_SECONDS the accounts and users whose
+    token has no known expiry (such as page tokens connected without
+    expires_in) are refreshed first, then those expiring within
+    TOKEN_REFRESH_LEAD_SECONDS are read by an indexed range scan on
+    token_expires_at, soonest first, in batches of TOKEN_REFRESH_BATCH_SIZE. Each batch is exchanged with up to
+    TOKEN_REFRESH_CONCURRENCY calls in flight and written back with one
+    statement. Refreshed page tokens are swapped into the account cache,
+    so the webhook path never refreshes inline. Tokens whose refresh
+    failed are retried after TOKEN_REFRESH_RETRY_SECONDS.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.owner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        # (model name, row id) -> monotonic time before which a failed refresh is not retried
+        self._retry_after: Dict[Tuple[str, int], float] = {}
+        self.refreshed_count = 0
+        self.failed_count = 0
+        self.last_run_at: Optional[datetime] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="token-refresher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await release_lease(db, LEASE_NAME, self.owner_id)
+            except Exception as e:
+                print(f"Error releasing token refresher lease: {e}")
+            self.is_leader = False
+
+    async def _loop(self):
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    self.is_leader = await acquire_lease(
+                        db, LEASE_NAME, self.owner_id, settings.TOKEN_REFRESH_LEASE_SECONDS
+                    )
+                if self.is_leader:
+                    await self.refresh_expiring()
+            except Exception as e:
+                print(f"Error refreshing tokens: {e}")
+            await asyncio.sleep(settings.TOKEN_REFRESH_INTERVAL_SECONDS)
+
+    async def refresh_expiring(self):
+        """Refresh every active account and user token that expires within the lead time"""
+        if not settings.FACEBOOK_APP_ID or not settings.FACEBOOK_APP_SECRET:
+            return
+        self.last_run_at = datetime.utcnow()
+        now = time.monotonic()
+        self._retry_after = {key: until for key, until in self._retry_after.items() if until > now}
+        await self._refresh_all(InstagramAccount, InstagramAccount.page_access_token)
+        await self._refresh_all(User, User.access_token)
+
+    async def _refresh_all(self, model, token_column):
+        async with AsyncSessionLocal() as db:
+            await self._refresh_unknown_expiry(db, model, token_column)
+            await self._refresh_expiring(db, model, token_column)
+
+    async def _refresh_unknown_expiry(self, db, model, token_column):
+        last_id = 0
+        while True:
+            # Keyset scan in id order; refreshed rows get an expiry and leave the scan
+            result = await db.execute(
+                select(model.id, token_column.label("token")).where(
+                    model.is_active.is_(True),
+                    token_column.isnot(None),
+                    model.token_expires_at.is_(None),
+                    model.id > last_id
+                ).order_by(model.id).limit(settings.TOKEN_REFRESH_BATCH_SIZE)
+            )
+            rows = result.all()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            await self._refresh_due(db, model, token_column, rows)
+
+    async def _refresh_expiring(self, db, model, token_column):
+        deadline = datetime.utcnow() + timedelta(seconds=settings.TOKEN_REFRESH_LEAD_SECONDS)
+        last = (datetime.min, 0)
+        while True:
+            # Keyset scan in (expiry, id) order; refreshed rows move past the deadline
+            result = await db.execute(
+                select(model.id, token_column.label("token"), model.token_expires_at).where(
+                    model.is_active.is_(True),
+                    token_column.isnot(None),
+                    model.token_expires_at.isnot(None),
+                    model.token_expires_at < deadline,
+                    (model.token_expires_at > last[0])
+                    | ((model.token_expires_at == last[0]) & (model.id > last[1]))
+                ).order_by(model.token_expires_at, model.id).limit(settings.TOKEN_REFRESH_BATCH_SIZE)
+            )
+            rows = result.all()
+            if not rows:
+                return
+            last = (rows[-1].token_expires_at, rows[-1].id)
+            await self._refresh_due(db, model, token_column, rows)
+
+    async def _refresh_due(self, db, model, token_column, rows: List):
+        """Refresh the rows of a scan batch that are not waiting to retry a failed refresh"""
+        now = time.monotonic()
+        due = [row for row in rows if self._retry_after.get((model.__name__, row.id), 0) <= now]
+        if due:
+            await self._refresh_batch(db, model, token_column, due)
+
+    async def _refresh_batch(self, db, model, token_column, rows: List):
+        semaphore = asyncio.Semaphore(settings.TOKEN_REFRESH_CONCURRENCY)
+
+        async def exchange(row):
+            async with semaphore:
+                try:
+                    return row.id, await InstagramService.exchange_token(row.token)
+                except Exception as e:
+                    print(f"Error refreshing token of {model.__tablename__} {row.id}: {e}")
+                    self._retry_after[(model.__name__, row.id)] = time.monotonic() + settings.TOKEN_REFRESH_RETRY_SECONDS
+                    return row.id, None
+
+        refreshed = {
+            row_id: outcome
+            for row_id, outcome in await asyncio.gather(*(exchange(row) for row in rows))
+            if outcome is not None
+        }
+        self.failed_count += len(rows) - len(refreshed)
+        if not refreshed:
+            return
+
+        table = model.__table__
+        await db.execute(
+            update(table)
+            .where(table.c.id == bindparam("row_id"))
+            .values({token_column.key: bindparam("token"), "token_expires_at": bindparam("expires_at")}),
+            [
+                {"row_id": row_id, "token": token, "expires_at": expires_at}
+                for row_id, (token, expires_at) in refreshed.items()
+            ]
+        )
+        await db.commit()
+        self.refreshed_count += len(refreshed)
+
+        if model is InstagramAccount:
+            result = await db.execute(
+                select(InstagramAccount.id, InstagramAccount.instagram_business_account_id).where(
+                    InstagramAccount.id.in_(refreshed)
+                )
+            )
+            for account_id, business_account_id in result:
+                account_cache.update_token(business_account_id, refreshed[account_id][0])
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._task is not None,
+            "leader": self.is_leader,
+            "refreshed": self.refreshed_count,
+            "failed": self.failed_count,
+            "retry_pending": len(self._retry_after),
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+        }
+
+
+token_refresher = TokenRefresher()
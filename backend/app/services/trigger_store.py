@@ -0,0 +1,215 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal, upsert
+from app.models.rule_trigger import RuleTrigger
+
+# (rule id, participant id) -> (trigger count, last triggered at)
+TriggerKey = Tuple[int, str]
+TriggerState = Tuple[int, Optional[datetime]]
+
+NEVER_TRIGGERED: TriggerState = (0, None)
+
+
+def has_limits(rule) -> bool:
+    """Whether a rule caps or spaces out its triggers per participant"""
+    return bool(rule.max_triggers_per_user or rule.cooldown_minutes)
+
+
+class TriggerStore:
+    """
+    Per-(rule, participant) trigger counts and last-fired times for
+    max_triggers_per_user and cooldown_minutes.
+
+    State lives in an in-process LRU and is written behind to the
+    rule_triggers table: acquire() only touches memory, and a background
+    task upserts changed entries every RULE_TRIGGER_FLUSH_INTERVAL_SECONDS
+    and on shutdown. Callers load() the keys of a batch up front with one
+    query so the checks during rule evaluation never wait on the database.
+    Entries with unflushed changes are never evicted.
+    """
+
+    def __init__(self, max_entries: int, flush_interval: float):
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._entries: "OrderedDict[TriggerKey, TriggerState]" = OrderedDict()
+        self._dirty: Dict[TriggerKey, TriggerState] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.blocked_count = 0
+        self.flushed_count = 0
+
+    async def start(self):
+        """Spawn the write-behind flush loop"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop(), name="trigger-store-flush")
+
+    async def stop(self):
+        """Stop the flush loop and write out everything still pending"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    async def load(self, db: AsyncSession, keys: Iterable[TriggerKey]):
+        """Bring the state of the given keys into memory with a single query"""
+        keys = set(keys)
+        missing = {key for key in keys if key not in self._entries and key not in self._dirty}
+        self.hits += len(keys) - len(missing)
+        if not missing:
+            return
+        self.misses += len(missing)
+
+        result = await db.execute(
+            select(
+                RuleTrigger.automation_rule_id,
+                RuleTrigger.participant_id,
+                RuleTrigger.trigger_count,
+                RuleTrigger.last_triggered_at
+            ).where(
+                RuleTrigger.automation_rule_id.in_({rule_id for rule_id, _ in missing}),
+                RuleTrigger.participant_id.in_({participant_id for _, participant_id in missing})
+            )
+        )
+        loaded = {
+            (rule_id, participant_id): (trigger_count or 0, last_triggered_at)
+            for rule_id, participant_id, trigger_count, last_triggered_at in result
+        }
+        for key in missing:
+            # Keys without a row are cached too, so they are not queried again
+            self._remember(key, loaded.get(key, NEVER_TRIGGERED))
+
+    def acquire(self, rule, participant_id: str, now: datetime) -> Optional[TriggerState]:
+        """
+        Count a trigger of rule for participant if its cap and cooldown allow it.
+        Returns the previous state (for release()) or None if the trigger is blocked.
+        """
+        key = (rule.id, participant_id)
+        previous = self._get(key)
+        count, last_triggered_at = previous
+
+        if rule.max_triggers_per_user and count >= rule.max_triggers_per_user:
+            self.blocked_count += 1
+            return None
+        if (
+            rule.cooldown_minutes
+            and last_triggered_at is not None
+            and now - last_triggered_at < timedelta(minutes=rule.cooldown_minutes)
+        ):
+            self.blocked_count += 1
+            return None
+
+        self._set(key, (count + 1, now))
+        return previous
+
+    def release(self, rule_id: int, participant_id: str, previous: TriggerState):
+        """Undo an acquire() whose reply could not be sent"""
+        self._set((rule_id, participant_id), previous)
+
+    def revert(self, rule_id: int, participant_id: str, acquired_at: datetime):
+        """
+        Undo an acquire() made at acquired_at by an earlier batch, whose
+        previous state is gone (a delayed reply that was not sent). The
+        count drops by one; the cooldown is cleared unless a later trigger
+        replaced it, as any earlier trigger's cooldown had already run out
+        when acquire() let this one through. Callers load() the key first.
+        """
+        key = (rule_id, participant_id)
+        count, last_triggered_at = self._get(key)
+        self._set(key, (max(count - 1, 0), None if last_triggered_at == acquired_at else last_triggered_at))
+
+    def _get(self, key: TriggerKey) -> TriggerState:
+        state = self._dirty.get(key)
+        if state is None:
+            state = self._entries.get(key)
+        if state is None:
+            # Not loaded by the caller; treat as never triggered rather than block the send
+            return NEVER_TRIGGERED
+        return state
+
+    def _set(self, key: TriggerKey, state: TriggerState):
+        self._dirty[key] = state
+        self._remember(key, state)
+
+    def _remember(self, key: TriggerKey, state: TriggerState):
+        self._entries[key] = state
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget_rule(self, rule_id: int):
+        """Drop all local state of a rule"""
+        for key in [key for key in self._entries if key[0] == rule_id]:
+            del self._entries[key]
+        for key in [key for key in self._dirty if key[0] == rule_id]:
+            del self._dirty[key]
+
+    async def delete_rule(self, db: AsyncSession, rule_id: int):
+        """Remove a deleted rule's stored state. Runs in the caller's transaction."""
+        self.forget_rule(rule_id)
+        await db.execute(delete(RuleTrigger).where(RuleTrigger.automation_rule_id == rule_id))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Upsert every entry changed since the last flush"""
+        if not self._dirty:
+            return
+        pending, self._dirty = self._dirty, {}
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    upsert(
+                        db,
+                        RuleTrigger,
+                        ["automation_rule_id", "participant_id"],
+                        ["trigger_count", "last_triggered_at"]
+                    ),
+                    [
+                        {
+                            "automation_rule_id": rule_id,
+                            "participant_id": participant_id,
+                            "trigger_count": count,
+                            "last_triggered_at": last_triggered_at,
+                        }
+                        for (rule_id, participant_id), (count, last_triggered_at) in pending.items()
+                    ]
+                )
+                await db.commit()
+        except Exception as e:
+            # Keep the entries for the next flush unless they changed meanwhile
+            for key, state in pending.items():
+                self._dirty.setdefault(key, state)
+            print(f"Error flushing rule trigger state: {e}")
+            return
+        self.flushed_count += len(pending)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "pending_writes": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "blocked": self.blocked_count,
+            "flushed": self.flushed_count,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+trigger_store = TriggerStore(
+    max_entries=settings.RULE_TRIGGER_CACHE_MAX_ENTRIES,
+    flush_interval=settings.RULE_TRIGGER_FLUSH_INTERVAL_SECONDS
+)
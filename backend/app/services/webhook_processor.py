@@ -0,0 +1,383 @@
+import asyncio
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.metrics import webhook_events, webhook_stage_seconds
+from app.database import insert_ignore
+from app.models.message import Conversation, Message
+from app.models.automation_rule import TriggerType
+from app.services.account_cache import AccountRecord, account_cache
+from app.services.message_dedup import message_dedup
+from app.services.reply_batch import ReplyBatch
+from app.services.rule_cache import rule_cache
+from app.services.send_scheduler import send_scheduler
+from app.services.timer_engine import timer_engine
+from app.services.trigger_store import has_limits, trigger_store
+
+
+# (recipient_id, sender_id): the conversation whose events must be processed in order
+ConversationKey = Tuple[Optional[str], Optional[str]]
+
+
+def conversation_key(event: Dict) -> ConversationKey:
+    """The (recipient_id, sender_id) pair whose events must be processed in order"""
+    return event.get("recipient", {}).get("id"), event.get("sender", {}).get("id")
+
+
+@dataclass
+class InboundMessage:
+    """A message event parsed out of a webhook payload"""
+    sender_id: str
+    recipient_id: str
+    message_id: str
+    message_text: str
+    sent_at: datetime
+    conversation_id: Optional[int] = None
+    is_first_inbound: bool = False
+
+
+def parse_messaging_event(event: dict) -> Optional[InboundMessage]:
+    """
+    Extract an inbound message from a messaging event, or None for other
+    event types. Events without a usable timestamp get the receive time.
+    """
+    message_data = event.get("message")
+    if not message_data:
+        return None
+
+    timestamp = event.get("timestamp")
+    if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)):
+        timestamp = time.time() * 1000
+
+    return InboundMessage(
+        sender_id=event.get("sender", {}).get("id"),
+        recipient_id=event.get("recipient", {}).get("id"),
+        message_id=message_data.get("mid"),
+        message_text=message_data.get("text", ""),
+        sent_at=datetime.fromtimestamp(timestamp / 1000)
+    )
+
+
+async def process_messaging_event(event: dict, db: AsyncSession):
+    """Process a single messaging event from webhook"""
+    failures = await process_webhook_events([event], db)
+    if failures:
+        raise next(iter(failures.values()))
+
+
+async def process_webhook_events(events: List[dict], db: AsyncSession) -> Dict[ConversationKey, Exception]:
+    """
+    Process the messaging events of one or more webhook payloads as a batch.
+
+    Redelivered messages are dropped up front by the in-memory seen-set;
+    the rest are stored with ON CONFLICT DO NOTHING on message_id and
+    only messages actually stored update conversations or fire rules.
+    Accounts and conversations are resolved with one query each, new
+    conversations and messages are written in bulk and committed once
+    (WELCOME rules read the maintained inbound_count, no extra query),
+    then automated replies, delayed-reply timers and rule counters are
+    written in a second commit. Per-participant cooldown and trigger-cap
+    state is loaded for the whole payload with one query. DB round-trips
+    grow with the number of payloads rather than the number of events.
+    Each stage's duration is recorded in webhook_stage_seconds.
+
+    Rules are evaluated with no transaction open, one task per
+    conversation: a conversation's messages are answered in order while
+    different conversations send their replies concurrently.
+
+    An event that cannot be parsed, or whose rule evaluation raises,
+    fails only its own conversation. Returns those failures by
+    conversation_key; errors storing the batch are raised.
+    """
+    webhook_events.inc(len(events))
+    failures: Dict[ConversationKey, Exception] = {}
+    inbound = []
+    for event in events:
+        try:
+            message = parse_messaging_event(event)
+        except Exception as e:
+            print(f"Error parsing webhook event: {e}")
+            failures.setdefault(conversation_key(event), e)
+            continue
+        if message:
+            inbound.append(message)
+    inbound = message_dedup.filter(inbound)
+    if not inbound:
+        return failures
+
+    # Find Instagram accounts; events for unknown or disconnected accounts are dropped
+    with webhook_stage_seconds.labels("account_lookup").time():
+        accounts = await account_cache.get_many(db, {message.recipient_id for message in inbound})
+    inbound = [message for message in inbound if message.recipient_id in accounts]
+    if not inbound:
+        return failures
+
+    started = time.perf_counter()
+    conversations = await _resolve_conversations(db, _group_by_conversation(inbound, accounts))
+    upsert_seconds = time.perf_counter() - started
+
+    # Save messages; ones another worker already stored come back missing from RETURNING
+    started = time.perf_counter()
+    result = await db.execute(
+        insert_ignore(db, Message, ["message_id"]).returning(Message.message_id),
+        [
+            {
+                "conversation_id": message.conversation_id,
+                "message_id": message.message_id,
+                "sender_id": message.sender_id,
+                "recipient_id": message.recipient_id,
+                "message_text": message.message_text,
+                "is_from_me": False,
+                "sent_at": message.sent_at,
+            }
+            for message in inbound
+        ]
+    )
+    stored = {message_id for message_id, in result}
+    webhook_stage_seconds.labels("message_insert").observe(time.perf_counter() - started)
+    seen = [message.message_id for message in inbound]
+    inbound = [message for message in inbound if message.message_id is None or message.message_id in stored]
+    message_dedup.record_db_duplicates(len(seen) - len(inbound))
+
+    if inbound:
+        started = time.perf_counter()
+        await _update_conversations(db, _group_by_conversation(inbound, accounts), conversations)
+        upsert_seconds += time.perf_counter() - started
+    webhook_stage_seconds.labels("conversation_upsert").observe(upsert_seconds)
+    with webhook_stage_seconds.labels("commit").time():
+        await db.commit()
+    message_dedup.mark_seen(seen)
+    if not inbound:
+        return failures
+
+    # Includes waiting for the replies it sends, which graph_send also records on its own
+    with webhook_stage_seconds.labels("rule_evaluation").time():
+        rule_sets = await rule_cache.get_many(db, {account.id for account in accounts.values()})
+
+        # Load cooldown / cap state of every rule with limits for this payload's senders
+        await trigger_store.load(db, {
+            (rule.id, message.sender_id)
+            for message in inbound
+            for rule in rule_sets[accounts[message.recipient_id].id].rules
+            if has_limits(rule)
+        })
+        # End the read transaction: no connection is held while replies are sent
+        await db.commit()
+
+        # Check automation rules, conversations concurrently
+        replies = ReplyBatch()
+        lanes: Dict[ConversationKey, List[InboundMessage]] = defaultdict(list)
+        for message in inbound:
+            lanes[(message.recipient_id, message.sender_id)].append(message)
+        results = await asyncio.gather(
+            *(_answer_conversation(messages, accounts, rule_sets, replies) for messages in lanes.values()),
+            return_exceptions=True
+        )
+        for key, result in zip(lanes, results):
+            if isinstance(result, Exception):
+                print(f"Error checking automation rules: {result}")
+                failures[key] = result
+
+    with webhook_stage_seconds.labels("reply_write").time():
+        timers = await replies.write(db)
+        await db.commit()
+    timer_engine.notify(timers)
+    return failures
+
+
+async def _answer_conversation(
+    messages: List[InboundMessage],
+    accounts: Dict[str, AccountRecord],
+    rule_sets: Dict,
+    replies: ReplyBatch
+):
+    """Check the rules for one conversation's messages, in order"""
+    for message in messages:
+        account = accounts[message.recipient_id]
+        await check_automation_rules(account, message, rule_sets[account.id], replies)
+
+
+def _group_by_conversation(
+    inbound: List[InboundMessage],
+    accounts: Dict[str, AccountRecord]
+) -> Dict[Tuple[int, str], List[InboundMessage]]:
+    """Group messages by (account, sender), keeping payload order"""
+    grouped: Dict[Tuple[int, str], List[InboundMessage]] = defaultdict(list)
+    for message in inbound:
+        grouped[(accounts[message.recipient_id].id, message.sender_id)].append(message)
+    return grouped
+
+
+async def _resolve_conversations(
+    db: AsyncSession,
+    grouped: Dict[Tuple[int, str], List[InboundMessage]]
+) -> Dict[Tuple[int, str], Tuple[int, int]]:
+    """
+    Resolve the conversation of every (account, sender) pair, creating
+    missing ones in bulk, and set conversation_id on each message.
+    Returns (account, sender) -> (conversation id, inbound messages
+    before this payload).
+    """
+    account_ids = {account_id for account_id, _ in grouped}
+    sender_ids = {sender_id for _, sender_id in grouped}
+
+    conversations: Dict[Tuple[int, str], Tuple[int, int]] = {}
+    result = await db.execute(
+        select(
+            Conversation.id,
+            Conversation.instagram_account_id,
+            Conversation.participant_id,
+            Conversation.inbound_count
+        ).where(
+            Conversation.instagram_account_id.in_(account_ids),
+            Conversation.participant_id.in_(sender_ids)
+        )
+    )
+    for conversation_id, account_id, participant_id, inbound_count in result:
+        if (account_id, participant_id) in grouped:
+            conversations.setdefault((account_id, participant_id), (conversation_id, inbound_count or 0))
+
+    missing = [key for key in grouped if key not in conversations]
+    if missing:
+        # Counters start at zero and are maintained by _update_conversations like for existing threads
+        thread_ids = {}
+        rows = []
+        for account_id, sender_id in missing:
+            messages = grouped[(account_id, sender_id)]
+            thread_id = f"t_{sender_id}_{messages[0].recipient_id}"
+            thread_ids[thread_id] = (account_id, sender_id)
+            rows.append({
+                "instagram_account_id": account_id,
+                "thread_id": thread_id,
+                "participant_id": sender_id,
+                "last_message_time": messages[-1].sent_at,
+                "unread_count": 0,
+                "inbound_count": 0,
+            })
+        result = await db.execute(
+            insert_ignore(db, Conversation, ["thread_id"]).returning(Conversation.id, Conversation.thread_id),
+            rows
+        )
+        for conversation_id, thread_id in result:
+            conversations[thread_ids[thread_id]] = (conversation_id, 0)
+
+        # Threads created concurrently by another worker
+        lost = [thread_id for thread_id, key in thread_ids.items() if key not in conversations]
+        if lost:
+            result = await db.execute(
+                select(Conversation.id, Conversation.thread_id, Conversation.inbound_count).where(
+                    Conversation.thread_id.in_(lost)
+                )
+            )
+            for conversation_id, thread_id, inbound_count in result:
+                conversations[thread_ids[thread_id]] = (conversation_id, inbound_count or 0)
+
+    for key, messages in grouped.items():
+        for message in messages:
+            message.conversation_id = conversations[key][0]
+    return conversations
+
+
+async def _update_conversations(
+    db: AsyncSession,
+    grouped: Dict[Tuple[int, str], List[InboundMessage]],
+    conversations: Dict[Tuple[int, str], Tuple[int, int]]
+):
+    """
+    Maintain the inbound counters of conversations that received stored
+    messages, and flag each conversation's first inbound message for
+    WELCOME rules.
+    """
+    table = Conversation.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.id == bindparam("conversation_id"))
+        .values(
+            last_message_time=bindparam("message_time"),
+            unread_count=func.coalesce(table.c.unread_count, 0) + bindparam("received"),
+            inbound_count=table.c.inbound_count + bindparam("received"),
+            first_inbound_at=func.coalesce(table.c.first_inbound_at, bindparam("first_time"))
+        ),
+        [
+            {
+                "conversation_id": conversations[key][0],
+                "message_time": messages[-1].sent_at,
+                "first_time": messages[0].sent_at,
+                "received": len(messages),
+            }
+            for key, messages in grouped.items()
+        ]
+    )
+
+    for key, messages in grouped.items():
+        if conversations[key][1] == 0:
+            messages[0].is_first_inbound = True
+
+
+async def check_automation_rules(
+    instagram_account: AccountRecord,
+    message: InboundMessage,
+    rule_set,
+    replies: ReplyBatch
+):
+    """Check if any automation rules should be triggered"""
+    for rank in rule_set.matcher.candidates(message.message_text):
+        rule = rule_set.rules[rank]
+
+        if rule.trigger_type == TriggerType.WELCOME and not message.is_first_inbound:
+            continue
+
+        previous = None
+        acquired_at = datetime.utcnow()
+        if has_limits(rule):
+            previous = trigger_store.acquire(rule, message.sender_id, acquired_at)
+            if previous is None:
+                # Cooldown running or cap reached for this participant
+                continue
+
+        # Delayed replies are handed to the timer engine instead of sleeping here
+        if rule.reply_delay_seconds > 0:
+            replies.schedule(
+                account_id=instagram_account.id,
+                conversation_id=message.conversation_id,
+                recipient_id=message.sender_id,
+                message_text=rule.reply_message,
+                rule_id=rule.id,
+                delay_seconds=rule.reply_delay_seconds,
+                trigger_acquired_at=acquired_at if previous is not None else None
+            )
+            break
+
+        # Send automated reply
+        try:
+            with webhook_stage_seconds.labels("graph_send").time():
+                result = await send_scheduler.send(
+                    instagram_account,
+                    message.sender_id,
+                    rule.reply_message
+                )
+        except Exception as e:
+            if previous is not None:
+                trigger_store.release(rule.id, message.sender_id, previous)
+            replies.record(rule.id, success=False)
+            print(f"Error sending automated reply: {e}")
+            continue
+
+        replies.record(rule.id, success=True)
+        replies.add_message(
+            conversation_id=message.conversation_id,
+            result=result,
+            sender_id=instagram_account.instagram_business_account_id,
+            recipient_id=message.sender_id,
+            message_text=rule.reply_message,
+            rule_id=rule.id
+        )
+
+        # Only trigger first matching rule (by priority)
+        break
@@ -0,0 +1,274 @@
+import asyncio
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+from app.services.webhook_processor import conversation_key, process_webhook_events
+
+
+@dataclass
+class _QueuedEvent:
+    event: Dict
+    # Set when the submitter waits for the event to be processed
+    future: Optional[asyncio.Future]
+
+
+class WebhookQueue:
+    """
+    Keyed dispatcher for webhook events.
+
+    Events are routed by (recipient_id, sender_id) onto per-conversation
+    lanes. A lane is handed to at most one worker at a time, so messages
+    from one sender are stored and answered in arrival order and never
+    race on conversation creation or counters. Each of the WEBHOOK_WORKERS
+    workers takes everything queued on all lanes that are not in flight,
+    up to WEBHOOK_BATCH_MAX_EVENTS, and processes it as one batch in one
+    session. A payload touching many conversations is therefore still
+    stored with one commit, and under load several payloads share one.
+    Lanes are plain deques dropped as soon as they are empty; no task is
+    kept per conversation.
+
+    Outcomes are reported per lane: an event the processor fails fails
+    only its own conversation's events. If storing the merged batch
+    fails, its lanes are processed again one by one, so a poison event
+    cannot fail the other payloads it was batched with.
+
+    Each lane holds at most WEBHOOK_LANE_MAXSIZE events and all lanes
+    together at most WEBHOOK_QUEUE_MAXSIZE; submitters wait for room up
+    to WEBHOOK_ENQUEUE_TIMEOUT_SECONDS and are refused after that.
+    """
+
+    def __init__(self, maxsize: int, workers: int, lane_maxsize: int, batch_max_events: int):
+        self.maxsize = maxsize
+        self.worker_count = workers
+        self.lane_maxsize = lane_maxsize
+        self.batch_max_events = batch_max_events
+        self._lanes: Dict[Tuple, Deque[_QueuedEvent]] = {}
+        # Lanes with queued events and no batch in flight, oldest first
+        self._ready: Deque[Tuple] = deque()
+        self._busy: Set[Tuple] = set()
+        self._has_ready: Optional[asyncio.Event] = None
+        self._room: Optional[asyncio.Condition] = None
+        self._capacity: Optional[asyncio.Semaphore] = None
+        self._workers: List[asyncio.Task] = []
+        self._pending = 0
+        self._drained: Optional[asyncio.Event] = None
+        self._accepting = False
+        self.processed_count = 0
+        self.failed_count = 0
+        self.rejected_count = 0
+        self.batch_count = 0
+
+    @property
+    def running(self) -> bool:
+        return self._accepting
+
+    async def start(self):
+        if self._accepting:
+            return
+        self._capacity = asyncio.Semaphore(self.maxsize)
+        self._has_ready = asyncio.Event()
+        self._room = asyncio.Condition()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"webhook-worker-{n}")
+            for n in range(self.worker_count)
+        ]
+        self._accepting = True
+
+    async def stop(self, timeout: float):
+        """
+        Stop accepting new events and drain in-flight work.
+        Workers are cancelled if the lanes do not drain within timeout.
+        """
+        if self._drained is None:
+            return
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Webhook queue drain timed out with {self._pending} events pending")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._lanes.clear()
+        self._ready.clear()
+        self._busy.clear()
+        self._drained = None
+
+    async def submit(self, events: List[Dict], wait: bool = False) -> bool:
+        """
+        Route a payload's events onto their lanes, waiting up to
+        WEBHOOK_ENQUEUE_TIMEOUT_SECONDS for room. With wait=True, also wait
+        until they have been processed (errors are raised). Returns False
+        if the dispatcher is stopped or stayed full; events queued before
+        that are still processed, and redelivered copies are dropped by
+        the message dedup.
+        """
+        try:
+            futures = await self.enqueue(events, track=wait, timeout=settings.WEBHOOK_ENQUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self.rejected_count += 1
+            return False
+        if futures is None:
+            return False
+        if futures:
+            await asyncio.gather(*futures)
+        return True
+
+    async def enqueue(
+        self,
+        events: List[Dict],
+        track: bool = False,
+        timeout: Optional[float] = None
+    ) -> Optional[List[asyncio.Future]]:
+        """
+        Put events on their lanes in order, waiting for room (up to timeout
+        seconds in total, or without limit). With track=True, returns one
+        future per event that completes once it has been processed. Returns
+        None if the dispatcher is stopped.
+
+        Events are queued without yielding to the event loop while there is
+        room, so a payload lands in one batch.
+        """
+        if not self._accepting:
+            return None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+
+        def remaining() -> Optional[float]:
+            return max(deadline - loop.time(), 0) if deadline is not None else None
+
+        futures = []
+        for event in events:
+            key = conversation_key(event)
+            lane = self._lanes.get(key)
+            if lane is not None and len(lane) >= self.lane_maxsize:
+                await asyncio.wait_for(self._wait_for_room(key), timeout=remaining())
+            if self._capacity.locked():
+                await asyncio.wait_for(self._capacity.acquire(), timeout=remaining())
+            else:
+                await self._capacity.acquire()
+
+            future = loop.create_future() if track else None
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = deque()
+            lane.append(_QueuedEvent(event=event, future=future))
+            if len(lane) == 1 and key not in self._busy:
+                self._ready.append(key)
+                self._has_ready.set()
+            self._pending += 1
+            self._drained.clear()
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    async def _wait_for_room(self, key: Tuple):
+        async with self._room:
+            await self._room.wait_for(lambda: len(self._lanes.get(key, ())) < self.lane_maxsize)
+
+    def _take_batch(self) -> Tuple[List[Tuple], List[_QueuedEvent]]:
+        """Everything queued on ready lanes, whole lanes at a time, up to the batch limit"""
+        keys: List[Tuple] = []
+        batch: List[_QueuedEvent] = []
+        while self._ready and (not batch or len(batch) + len(self._lanes[self._ready[0]]) <= self.batch_max_events):
+            key = self._ready.popleft()
+            lane = self._lanes[key]
+            keys.append(key)
+            self._busy.add(key)
+            batch.extend(lane)
+            lane.clear()
+        if not self._ready:
+            self._has_ready.clear()
+        return keys, batch
+
+    async def _work(self):
+        while True:
+            await self._has_ready.wait()
+            keys, batch = self._take_batch()
+            if not batch:
+                continue
+            async with self._room:
+                self._room.notify_all()
+
+            failures: Dict[Tuple, Exception] = {}
+            try:
+                failures = await self._process(keys, batch)
+            finally:
+                self.batch_count += 1
+                for queued in batch:
+                    self._capacity.release()
+                    error = failures.get(conversation_key(queued.event))
+                    if error is None:
+                        self.processed_count += 1
+                    else:
+                        self.failed_count += 1
+                    if queued.future is not None and not queued.future.done():
+                        if error is None:
+                            queued.future.set_result(None)
+                        else:
+                            queued.future.set_exception(error)
+                for key in keys:
+                    self._busy.discard(key)
+                    if self._lanes.get(key):
+                        # Events that arrived while the batch was in flight
+                        self._ready.append(key)
+                        self._has_ready.set()
+                    else:
+                        self._lanes.pop(key, None)
+                self._pending -= len(batch)
+                if self._pending == 0:
+                    self._drained.set()
+
+    async def _process(self, keys: List[Tuple], batch: List[_QueuedEvent]) -> Dict[Tuple, Exception]:
+        """Process a batch; returns the errors of the lanes that failed"""
+        try:
+            async with AsyncSessionLocal() as db:
+                return await process_webhook_events([queued.event for queued in batch], db) or {}
+        except Exception as e:
+            print(f"Error processing webhook events: {e}")
+            if len(keys) == 1:
+                return {keys[0]: e}
+
+        # Rare: find the failing lanes by processing each on its own
+        lanes: Dict[Tuple, List[Dict]] = defaultdict(list)
+        for queued in batch:
+            lanes[conversation_key(queued.event)].append(queued.event)
+        failures: Dict[Tuple, Exception] = {}
+        for key, events in lanes.items():
+            try:
+                async with AsyncSessionLocal() as db:
+                    failures.update(await process_webhook_events(events, db) or {})
+            except Exception as e:
+                print(f"Error processing webhook events of one conversation: {e}")
+                failures[key] = e
+        return failures
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._accepting,
+            "lanes": len(self._lanes),
+            "lanes_in_flight": len(self._busy),
+            "workers": self.worker_count,
+            "depth": self._pending,
+            "maxsize": self.maxsize,
+            "lane_maxsize": self.lane_maxsize,
+            "processed": self.processed_count,
+            "failed": self.failed_count,
+            "rejected": self.rejected_count,
+            "batches": self.batch_count,
+        }
+
+
+webhook_queue = WebhookQueue(
+    maxsize=settings.WEBHOOK_QUEUE_MAXSIZE,
+    workers=settings.WEBHOOK_WORKERS,
+    lane_maxsize=settings.WEBHOOK_LANE_MAXSIZE,
+    batch_max_events=settings.WEBHOOK_BATCH_MAX_EVENTS
+)
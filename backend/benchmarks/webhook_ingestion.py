@@ -0,0 +1,332 @@
+"""
+Benchmarks for the webhook ingestion and rule-matching hot paths.
+
+Run from the backend directory:
+
+    python -m benchmarks.webhook_ingestion --output results.json
+    python -m benchmarks.webhook_ingestion --compare results.json
+
+Every scenario creates its own Instagram account with the requested
+number of keywords and feeds it webhook payloads through
+process_webhook_events (the batch form of process_messaging_event).
+Graph API calls go to an in-process stub, so only our own code and the
+database are measured. By default a temporary SQLite file is used; pass
+--database-url to run against a throwaway PostgreSQL database instead
+(tables are created and benchmark rows are left behind).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Throwaway database to run against (default: temporary SQLite file)")
+    parser.add_argument("--payload-sizes", default="1,10,100", help="Events per webhook payload")
+    parser.add_argument("--keywords", default="10,100,1000,10000", help="Keywords per account, 10 per rule")
+    parser.add_argument("--message-lengths", default="20,280,2000", help="Characters per message")
+    parser.add_argument("--match-rate", type=float, default=0.1, help="Share of messages that trigger a reply")
+    parser.add_argument("--payloads", type=int, default=30, help="Measured payloads per ingestion scenario")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured payloads per ingestion scenario")
+    parser.add_argument("--match-iterations", type=int, default=2000, help="Messages per rule-matching scenario")
+    parser.add_argument("--senders", type=int, default=200, help="Distinct participants per account")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Compare against the results JSON of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Throughput drop (fraction) reported as a regression by --compare")
+    return parser.parse_args(argv)
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Workload:
+    """
+    Deterministic messages and keywords for one scenario.
+
+    Keywords start with '#', which filler text never contains, so a
+    message matches exactly when a keyword was planted in it and the
+    match rate is the one asked for.
+    """
+
+    FILLER = (
+        "hey hi hello thanks price shipping order size color available "
+        "when how much is the still can you send me info please love this"
+    ).split()
+
+    def __init__(self, rng: random.Random, keyword_count: int, message_length: int, match_rate: float):
+        self.rng = rng
+        self.message_length = message_length
+        self.match_rate = match_rate
+        self.keywords = [
+            "#" + "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 10)))
+            for _ in range(keyword_count)
+        ]
+
+    def message(self) -> str:
+        words = []
+        length = 0
+        while length < self.message_length:
+            word = self.rng.choice(self.FILLER)
+            words.append(word)
+            length += len(word) + 1
+        if self.rng.random() < self.match_rate:
+            words.insert(self.rng.randrange(len(words) + 1), self.rng.choice(self.keywords))
+        return " ".join(words)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_environment(args: argparse.Namespace) -> Optional[str]:
+    """Point the app settings at the benchmark database before anything imports them"""
+    temp_path = None
+    database_url = args.database_url
+    if not database_url:
+        handle, temp_path = tempfile.mkstemp(prefix="webhook-bench-", suffix=".db")
+        os.close(handle)
+        database_url = f"sqlite:///{temp_path}"
+    os.environ["DATABASE_URL"] = database_url
+    # Replies go to a stub; per-page send pacing would only measure the configured rate
+    os.environ["SEND_RATE_PER_SECOND"] = "1000000"
+    os.environ["SEND_BURST"] = "1000000"
+    return temp_path
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    import httpx
+
+    from app.database import Base, SessionLocal, engine, async_engine, AsyncSessionLocal
+    from app.models.automation_rule import AutomationRule, RuleStatus, TriggerType
+    from app.models.instagram_account import InstagramAccount
+    from app.models.user import User
+    from app.schema import upgrade_schema
+    from app.services import http_client
+    from app.services.rule_cache import rule_cache
+    from app.services.send_scheduler import send_scheduler
+    from app.services.webhook_processor import process_webhook_events
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+    sent = [0]
+
+    def graph_stub(request: httpx.Request) -> httpx.Response:
+        sent[0] += 1
+        return httpx.Response(200, json={"recipient_id": "stub", "message_id": f"stub-{sent[0]}"})
+
+    await http_client.init_graph_client(httpx.MockTransport(graph_stub))
+
+    rng = random.Random(args.seed)
+    run_id = f"{int(time.time())}{rng.randrange(10 ** 6):06d}"
+    mid_counter = [0]
+
+    def create_account(keyword_count: int, keywords: List[str]) -> InstagramAccount:
+        with SessionLocal() as db:
+            user = User(facebook_id=f"bench-{run_id}-{keyword_count}-{rng.randrange(10 ** 9)}")
+            db.add(user)
+            db.flush()
+            account = InstagramAccount(
+                user_id=user.id,
+                instagram_business_account_id=f"bench-ig-{user.facebook_id}",
+                page_id=f"bench-page-{user.id}",
+                page_access_token="bench-token",
+                is_active=True
+            )
+            db.add(account)
+            db.flush()
+            for start in range(0, len(keywords), 10):
+                db.add(AutomationRule(
+                    instagram_account_id=account.id,
+                    name=f"bench rule {start // 10}",
+                    trigger_type=TriggerType.KEYWORD,
+                    trigger_keywords=keywords[start:start + 10],
+                    reply_message="Thanks for your message!",
+                    reply_delay_seconds=0,
+                    status=RuleStatus.ACTIVE,
+                    priority=0
+                ))
+            db.commit()
+            db.refresh(account)
+            db.expunge(account)
+            return account
+
+    def payload_events(account: InstagramAccount, workload: Workload, size: int) -> List[dict]:
+        events = []
+        now = int(time.time() * 1000)
+        for _ in range(size):
+            mid_counter[0] += 1
+            events.append({
+                "sender": {"id": f"bench-user-{run_id}-{rng.randrange(args.senders)}"},
+                "recipient": {"id": account.instagram_business_account_id},
+                "timestamp": now,
+                "message": {"mid": f"bench-mid-{run_id}-{mid_counter[0]}", "text": workload.message()},
+            })
+        return events
+
+    results = []
+    for keyword_count in _int_list(args.keywords):
+        for message_length in _int_list(args.message_lengths):
+            workload = Workload(rng, keyword_count, message_length, args.match_rate)
+            account = create_account(keyword_count, workload.keywords)
+
+            # Rule matching alone: the compiled matcher, no database
+            async with AsyncSessionLocal() as db:
+                rule_set = await rule_cache.get(db, account.id, account.rules_version)
+            messages = [workload.message() for _ in range(args.match_iterations)]
+            samples = []
+            matched = 0
+            for text in messages:
+                started = time.perf_counter()
+                matched += bool(rule_set.matcher.candidates(text))
+                samples.append(time.perf_counter() - started)
+            total = sum(samples)
+            results.append({
+                "benchmark": "rule_matching",
+                "keywords": keyword_count,
+                "message_length": message_length,
+                "messages": len(messages),
+                "matched": matched,
+                "messages_per_second": round(len(messages) / total, 1) if total else None,
+                "p50_us": round(percentile(samples, 0.50) * 1e6, 2),
+                "p99_us": round(percentile(samples, 0.99) * 1e6, 2),
+            })
+            print(_describe(results[-1]))
+
+            for payload_size in _int_list(args.payload_sizes):
+                samples = []
+                sent_before = sent[0]
+                for index in range(args.warmup + args.payloads):
+                    events = payload_events(account, workload, payload_size)
+                    async with AsyncSessionLocal() as db:
+                        started = time.perf_counter()
+                        await process_webhook_events(events, db)
+                        elapsed = time.perf_counter() - started
+                    if index >= args.warmup:
+                        samples.append(elapsed)
+                total = sum(samples)
+                events_measured = payload_size * len(samples)
+                results.append({
+                    "benchmark": "ingestion",
+                    "keywords": keyword_count,
+                    "message_length": message_length,
+                    "payload_size": payload_size,
+                    "payloads": len(samples),
+                    "events": events_measured,
+                    "replies_sent": sent[0] - sent_before,
+                    "events_per_second": round(events_measured / total, 1) if total else None,
+                    "p50_ms": round(percentile(samples, 0.50) * 1e3, 3),
+                    "p99_ms": round(percentile(samples, 0.99) * 1e3, 3),
+                })
+                print(_describe(results[-1]))
+
+    await send_scheduler.stop(timeout=30)
+    await http_client.close_graph_client()
+    await async_engine.dispose()
+    engine.dispose()
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "parameters": {
+                key: value for key, value in vars(args).items()
+                if key not in ("database_url", "output", "compare")
+            },
+        },
+        "results": results,
+    }
+
+
+def _scenario_key(result: Dict) -> tuple:
+    return (result["benchmark"], result["keywords"], result["message_length"], result.get("payload_size"))
+
+
+def _throughput(result: Dict) -> Optional[float]:
+    return result.get("events_per_second") or result.get("messages_per_second")
+
+
+def _describe(result: Dict) -> str:
+    if result["benchmark"] == "ingestion":
+        return (
+            f"ingestion      keywords={result['keywords']:<6} length={result['message_length']:<5} "
+            f"payload={result['payload_size']:<4} {result['events_per_second']:>10} events/s  "
+            f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms"
+        )
+    return (
+        f"rule_matching  keywords={result['keywords']:<6} length={result['message_length']:<5} "
+        f"{'':13}{result['messages_per_second']:>10} msgs/s    "
+        f"p50={result['p50_us']}us p99={result['p99_us']}us"
+    )
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> bool:
+    """Print the throughput change of every scenario; returns False if any regressed past threshold"""
+    previous = {_scenario_key(result): result for result in baseline["results"]}
+    ok = True
+    print(f"\nCompared with {baseline['meta'].get('revision') or 'baseline'}:")
+    for result in current["results"]:
+        before = previous.get(_scenario_key(result))
+        if before is None or not _throughput(before) or not _throughput(result):
+            continue
+        change = _throughput(result) / _throughput(before) - 1
+        regressed = change < -threshold
+        ok = ok and not regressed
+        print(f"{'REGRESSION ' if regressed else '           '}{change:+7.1%}  {_describe(result)}")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import asyncio
+
+    args = parse_args(argv)
+    temp_path = configure_environment(args)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        if not compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
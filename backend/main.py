@@ -1,22 +1,61 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from typing import Optional
+import hmac
 import uvicorn
 
-from app.database import engine, Base
-from app.api.routes import auth, instagram, automation, webhooks
+from app.database import engine, async_engine, Base
+from app.api.routes import auth, instagram, automation, webhooks, campaigns
 from app.core.config import settings
+from app.core import metrics
+from app.core.profiling import ProfilingMiddleware, profiling_stats
+from app.schema import upgrade_schema
+from app.services.webhook_queue import webhook_queue
+from app.services.event_log import close_event_log
+from app.services.sharded_consumer import sharded_consumer
+from app.services.http_client import init_graph_client, close_graph_client, pool_stats
+from app.services.graph_batch import graph_batcher
+from app.services.rule_cache import rule_cache
+from app.services.account_cache import account_cache
+from app.services.auth_cache import auth_cache
+from app.services.message_dedup import message_dedup
+from app.services.send_scheduler import send_scheduler
+from app.services.timer_engine import timer_engine
+from app.services.trigger_store import trigger_store
+from app.services.campaign_runner import campaign_runner
+from app.services.token_refresher import token_refresher
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("Starting Instagram DM Automation API...")
+    await init_graph_client()
+    await timer_engine.start()
+    await trigger_store.start()
+    await campaign_runner.start()
+    await token_refresher.start()
+    await webhook_queue.start()
+    if settings.WEBHOOK_PROCESSING_MODE == "sharded" and settings.WEBHOOK_SHARD_CONSUME:
+        await sharded_consumer.start()
     yield
     # Shutdown
     print("Shutting down...")
+    await sharded_consumer.stop(timeout=settings.WEBHOOK_SHUTDOWN_TIMEOUT_SECONDS)
+    await webhook_queue.stop(timeout=settings.WEBHOOK_SHUTDOWN_TIMEOUT_SECONDS)
+    await timer_engine.stop()
+    await campaign_runner.stop()
+    await token_refresher.stop()
+    await send_scheduler.stop(timeout=settings.WEBHOOK_SHUTDOWN_TIMEOUT_SECONDS)
+    await trigger_store.stop()
+    await graph_batcher.close()
+    await close_graph_client()
+    await close_event_log()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Instagram DM Automation API",
@@ -32,13 +71,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Sampling profiler for selected requests (see PROFILING_* settings)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(instagram.router, prefix="/api/instagram", tags=["Instagram"])
 app.include_router(automation.router, prefix="/api/automation", tags=["Automation"])
 app.include_router(webhooks.router, prefix="/api/webhooks", tags=["Webhooks"])
+app.include_router(campaigns.router, prefix="/api/campaigns", tags=["Campaigns"])
 
 @app.get("/")
 async def root():
@@ -52,10 +97,46 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+def require_ops_token(authorization: Optional[str] = Header(None)):
+    """
+    /metrics and /stats expose per-worker internals, so they only answer
+    `Authorization: Bearer <OPS_TOKEN>`; without OPS_TOKEN they are off.
+    """
+    if not settings.OPS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {settings.OPS_TOKEN}".encode()
+    if not authorization or not hmac.compare_digest(authorization.encode(), expected):
+        raise HTTPException(status_code=401, detail="Invalid ops token")
+
+@app.get("/metrics", dependencies=[Depends(require_ops_token)], include_in_schema=False)
+async def prometheus_metrics():
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/stats", dependencies=[Depends(require_ops_token)], include_in_schema=False)
+async def stats():
+    return {
+        "webhook_queue": webhook_queue.stats(),
+        "webhook_dedup": message_dedup.stats(),
+        "sharded_consumer": sharded_consumer.stats(),
+        "graph_pool": pool_stats(),
+        "graph_batch": graph_batcher.stats(),
+        "rule_cache": rule_cache.stats(),
+        "account_cache": account_cache.stats(),
+        "auth_cache": auth_cache.stats(),
+        "send_scheduler": send_scheduler.stats(),
+        "timers": timer_engine.stats(),
+        "campaigns": campaign_runner.stats(),
+        "token_refresher": token_refresher.stats(),
+        "rule_triggers": trigger_store.stats(),
+        "profiling": profiling_stats()
+    }
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
         host=settings.API_HOST,
         port=settings.API_PORT,
-        reload=True
+        # Reload runs a single process; several workers need WEBHOOK_PROCESSING_MODE=sharded
+        reload=settings.API_WORKERS == 1,
+        workers=settings.API_WORKERS
     )
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+# Settings are read at import time, so point the app at a throwaway database first
+_DATABASE_DIR = tempfile.mkdtemp(prefix="instagram-dm-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DATABASE_DIR, 'test.db')}"
+os.environ["WEBHOOK_VERIFY_SIGNATURE"] = "false"
+os.environ["WEBHOOK_LOG_BACKEND"] = "memory"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from app import models  # noqa: F401  (registers the tables)
+from app.database import Base, async_engine, engine
+from app.schema import upgrade_schema
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    yield
+    engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+async def dispose_async_engine():
+    # Pooled connections belong to the test's event loop
+    yield
+    await async_engine.dispose()
+
+
+class RecordingGraph:
+    """Stand-in for InstagramService.send_message that records what was sent"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, account, recipient_id, message_text):
+        self.sent.append((recipient_id, message_text))
+        return {"recipient_id": recipient_id, "message_id": f"reply-{len(self.sent)}-{recipient_id}"}
+
+
+@pytest.fixture
+async def graph(monkeypatch):
+    from app.services.instagram_service import InstagramService
+    from app.services.send_scheduler import send_scheduler
+
+    recording = RecordingGraph()
+    monkeypatch.setattr(InstagramService, "send_message", recording.send_message)
+    yield recording
+    await send_scheduler.stop(timeout=1)
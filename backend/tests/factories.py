@@ -0,0 +1,72 @@
+import itertools
+import time
+import uuid
+from typing import List, Optional
+
+from app.database import AsyncSessionLocal
+from app.models.automation_rule import AutomationRule, RuleStatus, TriggerType
+from app.models.instagram_account import InstagramAccount
+from app.models.user import User
+
+_ids = itertools.count(1)
+
+
+async def create_account(keywords: Optional[List[str]] = None, reply: str = "Thanks!") -> InstagramAccount:
+    """A user with one connected account and, given keywords, one active keyword rule"""
+    n = next(_ids)
+    suffix = uuid.uuid4().hex[:8]
+    async with AsyncSessionLocal() as db:
+        user = User(facebook_id=f"fb-{suffix}", email=f"user-{suffix}@example.com", name=f"User {n}")
+        db.add(user)
+        await db.flush()
+        account = InstagramAccount(
+            user_id=user.id,
+            instagram_business_account_id=f"ig-{suffix}",
+            username=f"page{n}",
+            page_id=f"page-{suffix}",
+            page_access_token=f"token-{suffix}",
+            is_active=True
+        )
+        db.add(account)
+        await db.flush()
+        if keywords:
+            db.add(AutomationRule(
+                instagram_account_id=account.id,
+                name="Keyword reply",
+                trigger_type=TriggerType.KEYWORD,
+                trigger_keywords=keywords,
+                reply_message=reply,
+                status=RuleStatus.ACTIVE
+            ))
+        await db.commit()
+        return account
+
+
+def messaging_event(account: InstagramAccount, sender_id: str, text: str) -> dict:
+    """A webhook messaging event for an incoming message with a fresh mid"""
+    return {
+        "sender": {"id": sender_id},
+        "recipient": {"id": account.instagram_business_account_id},
+        "timestamp": int(time.time() * 1000),
+        "message": {"mid": f"mid-{uuid.uuid4().hex}", "text": text},
+    }
+
+
+async def create_conversations(account: InstagramAccount, count: int, last_message_time=None) -> List[int]:
+    """Conversations of an account with one participant each; returns their ids"""
+    from app.models.message import Conversation
+
+    async with AsyncSessionLocal() as db:
+        conversations = [
+            Conversation(
+                instagram_account_id=account.id,
+                thread_id=f"t_{uuid.uuid4().hex}",
+                participant_id=f"participant-{uuid.uuid4().hex[:8]}",
+                last_message_time=last_message_time,
+                inbound_count=1
+            )
+            for _ in range(count)
+        ]
+        db.add_all(conversations)
+        await db.commit()
+        return [conversation.id for conversation in conversations]
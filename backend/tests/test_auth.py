@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+from app.models.revoked_token import RevokedToken
+from app.services.auth_cache import auth_cache
+from app.services.auth_service import create_access_token, decode_access_token_claims
+from main import app
+
+from tests.factories import create_account
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+def _auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def test_logout_revokes_the_token_until_it_expires(client):
+    account = await create_account()
+    token = create_access_token({"sub": str(account.user_id)})
+    other_session = create_access_token({"sub": str(account.user_id)})
+
+    assert (await client.get("/api/auth/me", headers=_auth(token))).status_code == 200
+    assert (await client.post("/api/auth/logout", headers=_auth(token))).status_code == 200
+
+    response = await client.get("/api/auth/me", headers=_auth(token))
+    assert response.status_code == 401
+    # Other sessions of the user stay signed in
+    assert (await client.get("/api/auth/me", headers=_auth(other_session))).status_code == 200
+
+
+async def test_token_revoked_by_another_process_is_refused_once_the_cache_entry_expires(client):
+    account = await create_account()
+    token = create_access_token({"sub": str(account.user_id)})
+    assert (await client.get("/api/auth/me", headers=_auth(token))).status_code == 200
+
+    # Logout handled by another process: only the denylist row is written there
+    claims = decode_access_token_claims(token)
+    async with AsyncSessionLocal() as db:
+        db.add(RevokedToken(
+            jti=claims["jti"],
+            user_id=account.user_id,
+            expires_at=datetime.utcnow() + timedelta(minutes=30)
+        ))
+        await db.commit()
+    auth_cache.invalidate(token)
+
+    assert (await client.get("/api/auth/me", headers=_auth(token))).status_code == 401
+
+
+async def test_facebook_callback_creates_then_updates_the_user(client, monkeypatch):
+    from sqlalchemy import select
+
+    from app.models.user import User
+    from app.services import http_client
+
+    facebook_id = f"fb-{datetime.utcnow().timestamp()}"
+    names = iter(["First Name", "Second Name"])
+    urls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        urls.append(str(request.url.copy_with(query=None)))
+        if request.url.path.endswith("/oauth/access_token"):
+            return httpx.Response(200, json={"access_token": "user-token", "expires_in": 3600})
+        return httpx.Response(200, json={"id": facebook_id, "name": next(names), "email": "me@example.com"})
+
+    graph = http_client.create_graph_client(httpx.MockTransport(handler))
+    monkeypatch.setattr(http_client, "_client", graph)
+    try:
+        for _ in range(2):
+            response = await client.get("/api/auth/callback", params={"code": "abc"})
+            assert response.status_code == 307
+            assert "/auth/callback?token=" in response.headers["location"]
+    finally:
+        await graph.aclose()
+
+    async with AsyncSessionLocal() as db:
+        users = (await db.execute(select(User).where(User.facebook_id == facebook_id))).scalars().all()
+    assert [(user.name, user.access_token) for user in users] == [("Second Name", "user-token")]
+    # Sent through the shared Graph client, to the configured API version
+    assert set(urls) == {f"{settings.GRAPH_BASE_URL}/oauth/access_token", f"{settings.GRAPH_BASE_URL}/me"}
+
+
+def test_request_handlers_only_use_the_async_session():
+    from fastapi.routing import APIRoute
+
+    from app.database import get_db
+
+    def calls(dependant):
+        yield dependant.call
+        for dependency in dependant.dependencies:
+            yield from calls(dependency)
+
+    blocking = [
+        route.path for route in app.routes
+        if isinstance(route, APIRoute) and get_db in set(calls(route.dependant))
+    ]
+    assert blocking == []
@@ -0,0 +1,159 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+from app.models.campaign import Campaign, CampaignStatus
+from app.services.campaign_runner import CampaignRunner
+from app.services.instagram_service import InstagramService
+
+from tests.factories import create_account, create_conversations
+
+
+@pytest.fixture
+def slow_graph(monkeypatch, graph):
+    """Each send takes 0.2 s, so one chunk outlives several heartbeats and the stale window"""
+    async def send_message(account, recipient_id, message_text):
+        await asyncio.sleep(0.2)
+        return await graph.send_message(account, recipient_id, message_text)
+
+    monkeypatch.setattr(InstagramService, "send_message", send_message)
+    monkeypatch.setattr(settings, "CAMPAIGN_HEARTBEAT_SECONDS", 0.05)
+    monkeypatch.setattr(settings, "CAMPAIGN_STALE_SECONDS", 0.15)
+    monkeypatch.setattr(settings, "CAMPAIGN_POLL_INTERVAL_SECONDS", 0.05)
+    monkeypatch.setattr(settings, "CAMPAIGN_CHUNK_SIZE", 5)
+    monkeypatch.setattr(settings, "CAMPAIGN_CONCURRENCY", 5)
+    monkeypatch.setattr(settings, "SEND_CONCURRENCY", 5)
+    return graph
+
+
+async def _create_campaign(recipients: int, **values) -> int:
+    account = await create_account()
+    await create_conversations(account, recipients)
+    async with AsyncSessionLocal() as db:
+        campaign = Campaign(
+            instagram_account_id=account.id,
+            name="Launch",
+            message_text="We launched!",
+            status=CampaignStatus.RUNNING,
+            **values
+        )
+        db.add(campaign)
+        await db.commit()
+        return campaign.id
+
+
+async def _campaign(campaign_id: int) -> Campaign:
+    async with AsyncSessionLocal() as db:
+        return await db.get(Campaign, campaign_id)
+
+
+async def _wait_for_status(campaign_id: int, status: CampaignStatus, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while (await _campaign(campaign_id)).status != status:
+        assert asyncio.get_running_loop().time() < deadline, f"campaign never became {status.value}"
+        await asyncio.sleep(0.02)
+
+
+async def _set_status(campaign_id: int, status: CampaignStatus):
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Campaign).where(Campaign.id == campaign_id).values(status=status))
+        await db.commit()
+
+
+async def test_lease_is_renewed_while_a_slow_chunk_runs(slow_graph):
+    campaign_id = await _create_campaign(recipients=10)
+    first, second = CampaignRunner(), CampaignRunner()
+    await first.start()
+    try:
+        # Chunks take longer than the stale window; the other worker must never get the campaign
+        while (await _campaign(campaign_id)).status == CampaignStatus.RUNNING:
+            assert await second._claim() == []
+            await asyncio.sleep(0.03)
+    finally:
+        await first.stop()
+
+    campaign = await _campaign(campaign_id)
+    assert campaign.status == CampaignStatus.COMPLETED
+    assert campaign.sent_count == 10
+    assert campaign.lease_owner is None
+    assert max(Counter(recipient for recipient, _ in slow_graph.sent).values()) == 1
+
+
+async def test_quick_pause_and_start_keeps_one_runner(slow_graph):
+    campaign_id = await _create_campaign(recipients=10)
+    first, second = CampaignRunner(), CampaignRunner()
+    await first.start()
+    try:
+        await asyncio.sleep(0.05)
+        assert (await _campaign(campaign_id)).lease_owner == first.owner_id
+        await _set_status(campaign_id, CampaignStatus.PAUSED)
+        await _set_status(campaign_id, CampaignStatus.RUNNING)
+        # The first worker still holds the lease, so the restart is not claimable
+        assert await second._claim() == []
+        await _wait_for_status(campaign_id, CampaignStatus.COMPLETED)
+    finally:
+        await first.stop()
+
+    assert len(slow_graph.sent) == 10
+    assert len(set(recipient for recipient, _ in slow_graph.sent)) == 10
+
+
+async def test_paused_campaign_releases_its_lease(slow_graph):
+    campaign_id = await _create_campaign(recipients=10)
+    runner = CampaignRunner()
+    await runner.start()
+    try:
+        await asyncio.sleep(0.05)
+        await _set_status(campaign_id, CampaignStatus.PAUSED)
+        while campaign_id in runner._running:
+            await asyncio.sleep(0.02)
+    finally:
+        await runner.stop()
+
+    campaign = await _campaign(campaign_id)
+    assert campaign.status == CampaignStatus.PAUSED
+    assert campaign.lease_owner is None
+    assert campaign.sent_count == 5
+
+
+async def test_worker_that_lost_its_lease_stops(slow_graph):
+    campaign_id = await _create_campaign(recipients=20)
+    runner = CampaignRunner()
+    await runner.start()
+    try:
+        await asyncio.sleep(0.05)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Campaign).where(Campaign.id == campaign_id).values(
+                    lease_owner="another-worker",
+                    heartbeat_at=datetime.utcnow() + timedelta(minutes=1)
+                )
+            )
+            await db.commit()
+        await asyncio.sleep(0.3)
+        assert campaign_id not in runner._running
+        assert runner.stats()["lost_leases"] == 1
+    finally:
+        await runner.stop()
+
+    campaign = await _campaign(campaign_id)
+    assert campaign.lease_owner == "another-worker"
+    assert campaign.sent_count == 0
+    await _set_status(campaign_id, CampaignStatus.CANCELLED)
+
+
+async def test_stale_lease_is_taken_over(slow_graph):
+    campaign_id = await _create_campaign(
+        recipients=3,
+        lease_owner="crashed-worker",
+        heartbeat_at=datetime.utcnow() - timedelta(seconds=10)
+    )
+    runner = CampaignRunner()
+    assert campaign_id in await runner._claim()
+    assert (await _campaign(campaign_id)).lease_owner == runner.owner_id
+    await _set_status(campaign_id, CampaignStatus.CANCELLED)
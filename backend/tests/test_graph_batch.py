@@ -0,0 +1,57 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import httpx
+
+from app.core.metrics import graph_requests
+from app.services import http_client
+from app.services.graph_batch import GraphBatcher, graph_batcher
+from app.services.instagram_service import InstagramService
+
+
+def _count(method: str, endpoint: str, status: str) -> float:
+    child = graph_requests._children.get((method, endpoint, status))
+    return child.value if child is not None else 0
+
+
+def test_batcher_uses_the_instagram_service_base_url():
+    assert graph_batcher.base_url == InstagramService.BASE_URL
+
+
+async def test_batched_requests_are_recorded_under_their_own_endpoints(monkeypatch):
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        batch = json.loads(parse_qs(request.content.decode())["batch"][0])
+        sent.append((str(request.url), batch))
+        return httpx.Response(200, json=[
+            {"code": 200, "headers": [], "body": "{}"},
+            {"code": 400, "headers": [], "body": "{}"},
+        ])
+
+    client = http_client.create_graph_client(httpx.MockTransport(handler))
+    monkeypatch.setattr(http_client, "_client", client)
+    batcher = GraphBatcher(base_url=InstagramService.BASE_URL, max_size=2, linger=1)
+    before = {
+        "root": _count("POST", "/", "200"),
+        "messages": _count("POST", "/me/messages", "200"),
+        "conversations": _count("GET", "/{id}/conversations", "400"),
+    }
+    try:
+        first = batcher.request("token", "POST", "/me/messages", data={"message": {"text": "hi"}})
+        second = batcher.request("token", "GET", "/17841400000000000/conversations", params={"limit": 5})
+        results = await asyncio.gather(first, second)
+    finally:
+        await batcher.close()
+        await client.aclose()
+
+    assert [result.status_code for result in results] == [200, 400]
+    assert sent[0][0] == f"{InstagramService.BASE_URL}/"
+    assert [entry["relative_url"] for entry in sent[0][1]] == [
+        "me/messages",
+        "17841400000000000/conversations?limit=5",
+    ]
+    assert _count("POST", "/", "200") == before["root"]
+    assert _count("POST", "/me/messages", "200") == before["messages"] + 1
+    assert _count("GET", "/{id}/conversations", "400") == before["conversations"] + 1
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.services.auth_cache import UserPrincipal
+from app.services.auth_service import get_current_principal
+from main import app
+
+from tests.factories import create_account, create_conversations
+
+
+@pytest.fixture
+async def client_for():
+    """An API client authenticated as the owner of an account"""
+    def build(account):
+        app.dependency_overrides[get_current_principal] = lambda: UserPrincipal(id=account.user_id, is_active=True)
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+    yield build
+    app.dependency_overrides.clear()
+
+
+async def _all_pages(client, url: str, limit: int):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = await client.get(url, params=params)
+        assert response.status_code == 200
+        ids.extend(row["id"] for row in response.json())
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return ids
+
+
+async def test_conversation_pages_include_conversations_without_a_message_time(client_for):
+    account = await create_account()
+    now = datetime.utcnow()
+    dated = []
+    for minutes in range(5):
+        dated += await create_conversations(account, 1, last_message_time=now - timedelta(minutes=minutes))
+    undated = await create_conversations(account, 4)
+
+    async with client_for(account) as client:
+        ids = await _all_pages(client, f"/api/instagram/accounts/{account.id}/conversations", limit=2)
+
+    assert ids == dated + sorted(undated, reverse=True)
+
+
+async def test_message_pages_walk_ties_and_missing_timestamps(client_for):
+    from app.database import AsyncSessionLocal
+    from app.models.message import Message
+
+    account = await create_account()
+    conversation_id, = await create_conversations(account, 1)
+    now = datetime.utcnow().replace(microsecond=0)
+    times = [now, now, now - timedelta(seconds=1), None, None, now - timedelta(seconds=2)]
+    async with AsyncSessionLocal() as db:
+        messages = [
+            Message(
+                conversation_id=conversation_id,
+                message_id=f"mid-{conversation_id}-{n}",
+                sender_id="customer",
+                recipient_id=account.instagram_business_account_id,
+                sent_at=sent_at
+            )
+            for n, sent_at in enumerate(times)
+        ]
+        db.add_all(messages)
+        await db.commit()
+        ids = [message.id for message in messages]
+
+    async with client_for(account) as client:
+        paged = await _all_pages(client, f"/api/instagram/conversations/{conversation_id}/messages", limit=2)
+
+    assert paged == [ids[1], ids[0], ids[2], ids[5], ids[4], ids[3]]
+
+
+def test_keyset_pages_are_read_from_the_index_in_order():
+    from sqlalchemy import select
+
+    from app.core.pagination import keyset_before, keyset_order
+    from app.database import engine
+    from app.models.message import Conversation
+
+    query = select(Conversation.id).where(
+        Conversation.instagram_account_id == 1,
+        keyset_before(Conversation.last_message_time, Conversation.id, datetime.utcnow(), 10)
+    ).order_by(*keyset_order(Conversation.last_message_time, Conversation.id)).limit(50)
+    compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+
+    with engine.connect() as connection:
+        plan = " ".join(row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}"))
+
+    assert "ix_conversations_account_recent" in plan
+    assert "TEMP B-TREE" not in plan
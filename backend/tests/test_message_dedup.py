@@ -0,0 +1,37 @@
+import copy
+import uuid
+
+from app.database import AsyncSessionLocal
+from app.services.message_dedup import message_dedup
+from app.services.webhook_processor import process_webhook_events
+
+from tests.factories import create_account, messaging_event
+
+
+async def test_redelivered_payload_is_dropped_before_the_database(graph):
+    account = await create_account(keywords=["price"])
+    payload = [messaging_event(account, f"customer-{uuid.uuid4().hex[:8]}", "price?")]
+    duplicates = message_dedup.duplicates
+
+    async with AsyncSessionLocal() as db:
+        await process_webhook_events(copy.deepcopy(payload), db)
+    async with AsyncSessionLocal() as db:
+        await process_webhook_events(copy.deepcopy(payload), db)
+
+    assert message_dedup.duplicates == duplicates + 1
+    assert len(graph.sent) == 1
+
+
+async def test_duplicates_evicted_from_the_lru_are_caught_by_the_insert(graph, monkeypatch):
+    account = await create_account(keywords=["price"])
+    first = [messaging_event(account, f"customer-{uuid.uuid4().hex[:8]}", "price?")]
+    monkeypatch.setattr(message_dedup, "max_entries", 1)
+    db_duplicates = message_dedup.db_duplicates
+
+    async with AsyncSessionLocal() as db:
+        await process_webhook_events(copy.deepcopy(first), db)
+        await process_webhook_events([messaging_event(account, f"other-{uuid.uuid4().hex[:8]}", "hello")], db)
+        await process_webhook_events(copy.deepcopy(first), db)
+
+    assert message_dedup.db_duplicates == db_duplicates + 1
+    assert len(graph.sent) == 1
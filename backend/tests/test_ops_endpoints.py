@@ -0,0 +1,22 @@
+import httpx
+import pytest
+
+from app.core.config import settings
+from main import app
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/stats"])
+async def test_ops_endpoints_need_the_ops_token(client, monkeypatch, path):
+    monkeypatch.setattr(settings, "OPS_TOKEN", "")
+    assert (await client.get(path)).status_code == 404
+
+    monkeypatch.setattr(settings, "OPS_TOKEN", "ops-secret")
+    assert (await client.get(path)).status_code == 401
+    assert (await client.get(path, headers={"Authorization": "Bearer wrong"})).status_code == 401
+    assert (await client.get(path, headers={"Authorization": "Bearer ops-secret"})).status_code == 200
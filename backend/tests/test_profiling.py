@@ -0,0 +1,49 @@
+import asyncio
+
+import httpx
+
+from app.core.config import settings
+from app.core.profiling import ProfilingMiddleware, SamplingProfiler
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.written = []
+
+    def write(self, profile, duration):
+        self.written.append(profile.label)
+
+
+async def endpoint(scope, receive, send):
+    await asyncio.sleep(0.01)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def _middleware(monkeypatch, secret: str):
+    monkeypatch.setattr(settings, "PROFILING_SECRET", secret)
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(settings, "PROFILING_LATENCY_THRESHOLD_MS", 0.0)
+    writer = RecordingWriter()
+    middleware = ProfilingMiddleware(endpoint, profiler=SamplingProfiler(interval=0.001), writer=writer)
+    return middleware, writer
+
+
+async def test_profiling_header_needs_the_secret(monkeypatch):
+    middleware, writer = _middleware(monkeypatch, secret="s3cret")
+    transport = httpx.ASGITransport(app=middleware)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post("/api/webhooks/instagram", headers={settings.PROFILING_HEADER: "1"})
+        await client.post("/api/webhooks/instagram")
+        await client.get("/api/auth/me", headers={settings.PROFILING_HEADER: "s3cret"})
+
+    assert writer.written == ["GET /api/auth/me"]
+
+
+async def test_profiling_header_is_ignored_without_a_secret(monkeypatch):
+    middleware, writer = _middleware(monkeypatch, secret="")
+    transport = httpx.ASGITransport(app=middleware)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.get("/api/auth/me", headers={settings.PROFILING_HEADER: ""})
+
+    assert writer.written == []
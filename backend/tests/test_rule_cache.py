@@ -0,0 +1,62 @@
+from sqlalchemy import update
+
+from app.database import AsyncSessionLocal
+from app.models.automation_rule import AutomationRule, RuleStatus
+from app.services.account_cache import account_cache
+from app.services.rule_cache import bump_rules_version, rule_cache
+from app.services.webhook_processor import process_webhook_events
+
+from tests.factories import create_account, messaging_event
+
+
+async def _deactivate_rules_elsewhere(account_id: int):
+    """A rule change made by another process: only the database changes, no local cache is touched"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(AutomationRule)
+            .where(AutomationRule.instagram_account_id == account_id)
+            .values(status=RuleStatus.INACTIVE)
+        )
+        await bump_rules_version(db, account_id)
+        await db.commit()
+
+
+async def test_rule_change_in_another_process_stops_the_rule_at_once(graph):
+    account = await create_account(keywords=["price"])
+
+    async with AsyncSessionLocal() as db:
+        await process_webhook_events([messaging_event(account, "customer", "what is the price?")], db)
+    assert len(graph.sent) == 1
+    # Both caches are warm for this account
+    assert account_cache.stats()["entries"] >= 1
+    async with AsyncSessionLocal() as db:
+        assert (await rule_cache.get_many(db, [account.id]))[account.id].rules
+
+    await _deactivate_rules_elsewhere(account.id)
+
+    async with AsyncSessionLocal() as db:
+        await process_webhook_events([messaging_event(account, "customer", "price please")], db)
+    assert len(graph.sent) == 1
+
+
+async def test_reload_before_commit_is_not_kept():
+    account = await create_account(keywords=["price"])
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(AutomationRule)
+            .where(AutomationRule.instagram_account_id == account.id)
+            .values(status=RuleStatus.INACTIVE)
+        )
+        await bump_rules_version(db, account.id)
+
+        # Another worker loads the rules between the change and its commit
+        async with AsyncSessionLocal() as other:
+            stale = await rule_cache.get_many(other, [account.id])
+        assert stale[account.id].rules
+
+        await db.commit()
+
+    async with AsyncSessionLocal() as db:
+        fresh = await rule_cache.get_many(db, [account.id])
+    assert fresh[account.id].rules == ()
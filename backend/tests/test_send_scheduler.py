@@ -0,0 +1,121 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.config import settings
+from app.services import send_scheduler as send_scheduler_module
+from app.services.instagram_service import GraphAPIError
+from app.services.send_scheduler import SendScheduler
+
+
+class FakeGraph:
+    """Stand-in for InstagramService.send_message with a fixed round trip"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.sent = []
+
+    async def send_message(self, account, recipient_id, message_text):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        self.sent.append((recipient_id, message_text))
+        return {"message_id": f"mid-{len(self.sent)}"}
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    fake = FakeGraph(latency=0.1)
+    monkeypatch.setattr(send_scheduler_module.InstagramService, "send_message", fake.send_message)
+    monkeypatch.setattr(settings, "SEND_RATE_PER_SECOND", 20.0)
+    monkeypatch.setattr(settings, "SEND_BURST", 20.0)
+    monkeypatch.setattr(settings, "SEND_CONCURRENCY", 20)
+    return fake
+
+
+async def test_sends_to_different_recipients_run_concurrently(graph):
+    scheduler = SendScheduler()
+    page = SimpleNamespace(id=1)
+
+    started = time.monotonic()
+    await asyncio.gather(*(scheduler.send(page, f"user-{i}", "hi") for i in range(20)))
+    elapsed = time.monotonic() - started
+    await scheduler.stop(timeout=1)
+
+    # The burst covers all 20 sends, so they overlap instead of taking 20 round trips
+    assert graph.max_in_flight == 20
+    assert elapsed < 0.5
+    assert scheduler.stats()["sent"] == 20
+
+
+async def test_concurrency_is_capped_per_page(graph, monkeypatch):
+    monkeypatch.setattr(settings, "SEND_CONCURRENCY", 5)
+    scheduler = SendScheduler()
+    page = SimpleNamespace(id=1)
+
+    await asyncio.gather(*(scheduler.send(page, f"user-{i}", "hi") for i in range(20)))
+    await scheduler.stop(timeout=1)
+
+    assert graph.max_in_flight == 5
+
+
+async def test_rate_limits_how_many_sends_start(graph, monkeypatch):
+    monkeypatch.setattr(settings, "SEND_RATE_PER_SECOND", 10.0)
+    monkeypatch.setattr(settings, "SEND_BURST", 2.0)
+    scheduler = SendScheduler()
+    page = SimpleNamespace(id=1)
+
+    started = time.monotonic()
+    await asyncio.gather(*(scheduler.send(page, f"user-{i}", "hi") for i in range(6)))
+    elapsed = time.monotonic() - started
+    await scheduler.stop(timeout=1)
+
+    # 2 from the burst, then 4 more at 10/s
+    assert elapsed >= 0.38
+    assert graph.max_in_flight >= 2
+
+
+async def test_messages_to_one_recipient_stay_in_order(graph, monkeypatch):
+    scheduler = SendScheduler()
+    page = SimpleNamespace(id=1)
+
+    async def latency_varies(account, recipient_id, message_text):
+        # Earlier messages are slower, so overlapping sends would reorder them
+        graph.latency = 0.05 if message_text == "0" else 0.001
+        return await FakeGraph.send_message(graph, account, recipient_id, message_text)
+
+    monkeypatch.setattr(send_scheduler_module.InstagramService, "send_message", latency_varies)
+    await asyncio.gather(
+        *(scheduler.send(page, "same-user", str(i)) for i in range(5)),
+        *(scheduler.send(page, f"user-{i}", "other") for i in range(5))
+    )
+    await scheduler.stop(timeout=1)
+
+    assert [text for recipient, text in graph.sent if recipient == "same-user"] == ["0", "1", "2", "3", "4"]
+
+
+async def test_rate_limited_send_is_retried(graph, monkeypatch):
+    monkeypatch.setattr(settings, "SEND_BACKOFF_SECONDS", 0.01)
+    scheduler = SendScheduler()
+    page = SimpleNamespace(id=1)
+    calls = []
+
+    async def throttled_once(account, recipient_id, message_text):
+        calls.append(recipient_id)
+        if len(calls) == 1:
+            raise GraphAPIError("Too many calls", status_code=429, error_code=4)
+        return {"message_id": "mid"}
+
+    monkeypatch.setattr(send_scheduler_module.InstagramService, "send_message", throttled_once)
+    assert await scheduler.send(page, "user", "hi") == {"message_id": "mid"}
+    await scheduler.stop(timeout=1)
+
+    assert len(calls) == 2
+    assert scheduler.stats()["retried"] == 1
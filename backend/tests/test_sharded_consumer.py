@@ -0,0 +1,205 @@
+import asyncio
+from collections import defaultdict
+
+import fakeredis
+import pytest
+
+from app.services import event_log as event_log_module
+from app.services import sharded_consumer as sharded_consumer_module
+from app.services import webhook_queue as webhook_queue_module
+from app.services.event_log import START, EventLog, HashRing, MemoryEventLog, RedisEventLog
+from app.services.sharded_consumer import ShardedConsumer
+from app.services.webhook_queue import webhook_queue
+
+
+def _event(recipient: str, n: int) -> dict:
+    return {"sender": {"id": "customer"}, "recipient": {"id": recipient}, "n": n}
+
+
+@pytest.fixture
+def redis_log(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        event_log_module.redis_asyncio,
+        "from_url",
+        lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs)
+    )
+    return RedisEventLog(url="redis://test", prefix="test-webhooks", maxlen=10000)
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def log(request, monkeypatch):
+    if request.param == "memory":
+        event_log = MemoryEventLog(maxlen=10000)
+    else:
+        event_log = request.getfixturevalue("redis_log")
+    monkeypatch.setattr(sharded_consumer_module, "get_event_log", lambda: event_log)
+    yield event_log
+    await event_log.close()
+
+
+@pytest.fixture
+async def processed(monkeypatch):
+    """Events handled by the webhook queue, per recipient, in processing order"""
+    seen = defaultdict(list)
+
+    async def record(events, db):
+        for event in events:
+            seen[event["recipient"]["id"]].append(event["n"])
+
+    monkeypatch.setattr(webhook_queue_module, "process_webhook_events", record)
+    await webhook_queue.start()
+    yield seen
+    await webhook_queue.stop(timeout=1)
+
+
+async def _publish(log, partitions: int, events):
+    batches = defaultdict(list)
+    for event in events:
+        batches[event_log_module.partition_for(event["recipient"]["id"], partitions)].append(event)
+    await log.publish(batches)
+
+
+def _consumer(**kwargs) -> ShardedConsumer:
+    kwargs.setdefault("max_attempts", 3)
+    kwargs.setdefault("retry_seconds", 0.05)
+    return ShardedConsumer(**kwargs)
+
+
+async def _wait_for(condition, timeout: float = 5):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.02)
+    await asyncio.wait_for(poll(), timeout)
+
+
+async def test_redis_log_round_trip_and_fenced_claims(redis_log):
+    await redis_log.publish({0: [{"n": 1}], 1: [{"n": 2}, {"n": 3}]})
+    batches = dict(await redis_log.read({0: START, 1: START}, count=10, block_ms=0))
+    assert [events for _, events in batches[0]] == [[{"n": 1}]]
+    assert [events for _, events in batches[1]] == [[{"n": 2}, {"n": 3}]]
+
+    assert await redis_log.claim("a", [0, 1], members=["a", "b"]) == [0, 1]
+    # Held by a live member
+    assert await redis_log.claim("b", [0, 1], members=["a", "b"]) == []
+    # Holder's registration expired
+    assert await redis_log.claim("b", [1], members=["b"]) == [1]
+
+    position = batches[1][-1][0]
+    assert await redis_log.commit("a", {0: batches[0][-1][0], 1: position}) == [0]
+    assert await redis_log.committed([1]) == {}
+    assert await redis_log.commit("b", {1: position}) == [1]
+    assert await redis_log.committed([1]) == {1: position}
+
+    await redis_log.release("a", [0, 1])
+    assert await redis_log.claim("c", [0, 1], members=["b", "c"]) == [0]
+    await redis_log.close()
+
+
+async def test_consumer_processes_events_right_after_start(log, processed):
+    consumer = _consumer(partitions=4, heartbeat_seconds=5, member_ttl_seconds=15, read_count=100)
+    await consumer.start()
+    try:
+        assert sorted(consumer.stats()["partitions"]) == [0, 1, 2, 3]
+        await _publish(log, 4, [_event(f"ig-{i}", i) for i in range(8)])
+        await _wait_for(lambda: sum(map(len, processed.values())) == 8, timeout=2)
+    finally:
+        await consumer.stop(timeout=1)
+
+
+async def test_partitions_hand_over_without_duplicates_or_reordering(log, processed):
+    partitions = 8
+    recipients = [f"ig-{i}" for i in range(20)]
+    published = defaultdict(int)
+
+    async def publish_round():
+        events = []
+        for recipient in recipients:
+            events.append(_event(recipient, published[recipient]))
+            published[recipient] += 1
+        await _publish(log, partitions, events)
+
+    def consumer():
+        return _consumer(partitions=partitions, heartbeat_seconds=0.1, member_ttl_seconds=1, read_count=5)
+
+    first, second = consumer(), consumer()
+    # Worker ids are random; make sure the ring gives each consumer part of it
+    while len({HashRing([first.worker_id, second.worker_id]).owner(f"partition-{p}") for p in range(partitions)}) < 2:
+        second = consumer()
+    await first.start()
+    for _ in range(5):
+        await publish_round()
+
+    # Keep publishing while the second consumer joins and takes over part of the ring
+    await second.start()
+    for _ in range(10):
+        await publish_round()
+        await asyncio.sleep(0.03)
+    await _wait_for(lambda: second.stats()["partitions"] and not second.stats()["waiting_partitions"])
+    assert first.stats()["partitions"]
+    assert not set(first.stats()["partitions"]) & set(second.stats()["partitions"])
+
+    # On stop the first consumer releases its claims and the second takes them at once
+    await first.stop(timeout=1)
+    for _ in range(5):
+        await publish_round()
+    await _wait_for(lambda: sorted(second.stats()["partitions"]) == list(range(partitions)))
+    total = sum(published.values())
+    await _wait_for(lambda: sum(map(len, processed.values())) == total)
+    await second.stop(timeout=1)
+
+    for recipient in recipients:
+        assert processed[recipient] == list(range(published[recipient]))
+
+
+async def test_failed_entries_are_read_again_then_dead_lettered(log, monkeypatch):
+    processed = defaultdict(list)
+    failures = {"ig-flaky": 1, "ig-poison": 10}
+
+    async def flaky(events, db):
+        for event in events:
+            recipient = event["recipient"]["id"]
+            if failures.get(recipient, 0) > 0:
+                failures[recipient] -= 1
+                raise RuntimeError("database unavailable")
+            processed[recipient].append(event["n"])
+
+    monkeypatch.setattr(webhook_queue_module, "process_webhook_events", flaky)
+    await webhook_queue.start()
+    consumer = _consumer(partitions=1, heartbeat_seconds=5, member_ttl_seconds=15, read_count=100)
+    await consumer.start()
+    try:
+        await _publish(log, 1, [_event("ig-flaky", 0)])
+        await _wait_for(lambda: processed["ig-flaky"] == [0])
+        assert consumer.stats()["retried"] == 1
+
+        await _publish(log, 1, [_event("ig-poison", 0)])
+        await _publish(log, 1, [_event("ig-after", 0)])
+        await _wait_for(lambda: consumer.stats()["dead_lettered"] == 1)
+        assert processed["ig-poison"] == []
+        # Read again with the failed entry before it; the message dedup drops such copies
+        assert processed["ig-after"] and set(processed["ig-after"]) == {0}
+        assert processed["ig-flaky"] == [0]
+    finally:
+        await consumer.stop(timeout=1)
+        await webhook_queue.stop(timeout=1)
+
+    # Nothing past a failed entry was committed before it was dead-lettered
+    committed = await log.committed([0])
+    entries = dict(await log.read({0: START}, count=10, block_ms=0))[0]
+    assert committed[0] == entries[-1][0]
+    if isinstance(log, MemoryEventLog):
+        assert [letter["events"][0]["recipient"]["id"] for letter in log.dead_letters] == ["ig-poison"]
+    else:
+        letters = await log._redis.xrange("test-webhooks:dead-letter")
+        assert [fields["entry_id"] for _, fields in letters] == [entries[1][0]]
+
+
+def test_event_log_backends_must_implement_every_operation():
+    class PartialLog(EventLog):
+        async def publish(self, batches):
+            pass
+
+    with pytest.raises(TypeError):
+        PartialLog()
+    MemoryEventLog(maxlen=10)
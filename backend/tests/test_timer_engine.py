@@ -0,0 +1,151 @@
+import httpx
+import pytest
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models.automation_rule import AutomationRule, RuleStatus, TriggerType
+from app.models.scheduled_reply import ScheduledReply, TimerKind, TimerStatus
+from app.services.auth_cache import UserPrincipal
+from app.services.auth_service import get_current_principal
+from app.services.instagram_service import InstagramService
+from app.services.timer_engine import reschedule_rule, timer_engine
+from app.services.trigger_store import trigger_store
+from app.services.webhook_processor import process_webhook_events
+from main import app
+
+from tests.factories import create_account, messaging_event
+
+
+async def _add_rule(account, **values) -> AutomationRule:
+    async with AsyncSessionLocal() as db:
+        rule = AutomationRule(instagram_account_id=account.id, name="Rule", status=RuleStatus.ACTIVE, **values)
+        db.add(rule)
+        await db.flush()
+        await reschedule_rule(db, rule)
+        await db.commit()
+        return rule
+
+
+async def _timers(rule_id: int, kind: TimerKind):
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(ScheduledReply).where(
+                ScheduledReply.automation_rule_id == rule_id,
+                ScheduledReply.kind == kind.value
+            ).order_by(ScheduledReply.id)
+        )
+        return result.scalars().all()
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("schedule", [
+    {"daily_at": "25:00"},
+    {"daily_at": "nine"},
+    {"daily_at": "09:30", "weekdays": [7]},
+    {"interval_minutes": 0},
+    {"interval_minutes": "often"},
+    {"run_at": "tomorrow"},
+    {"interval_minutes": 60, "run_at": "2030-01-01T00:00:00"},
+    {"every": "day"},
+])
+async def test_malformed_schedules_are_rejected_before_anything_is_stored(client, schedule):
+    account = await create_account()
+    rule = await _add_rule(
+        account,
+        trigger_type=TriggerType.SCHEDULED,
+        trigger_schedule={"interval_minutes": 60},
+        reply_message="Weekly news"
+    )
+    app.dependency_overrides[get_current_principal] = lambda: UserPrincipal(id=account.user_id, is_active=True)
+    body = {
+        "name": "News",
+        "description": None,
+        "trigger_type": "scheduled",
+        "trigger_keywords": None,
+        "trigger_schedule": schedule,
+        "reply_message": "Weekly news",
+        "max_triggers_per_user": None,
+        "cooldown_minutes": None,
+    }
+
+    created = await client.post("/api/automation/rules", params={"account_id": account.id}, json=body)
+    assert created.status_code == 422
+    updated = await client.put(f"/api/automation/rules/{rule.id}", json={
+        **body, "reply_delay_seconds": 0, "status": "active", "priority": 0
+    })
+    assert updated.status_code == 422
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(AutomationRule).where(AutomationRule.instagram_account_id == account.id))
+        assert [(r.id, r.trigger_schedule) for r in result.scalars()] == [(rule.id, {"interval_minutes": 60})]
+
+
+async def test_rule_update_only_rearms_the_schedule_when_it_changed(client):
+    account = await create_account()
+    rule = await _add_rule(
+        account,
+        trigger_type=TriggerType.SCHEDULED,
+        trigger_schedule={"interval_minutes": 60},
+        reply_message="Weekly news"
+    )
+    app.dependency_overrides[get_current_principal] = lambda: UserPrincipal(id=account.user_id, is_active=True)
+    body = {
+        "name": "Renamed",
+        "description": None,
+        "trigger_type": "scheduled",
+        "trigger_keywords": None,
+        "trigger_schedule": {"interval_minutes": 60},
+        "reply_message": "Weekly news",
+        "reply_delay_seconds": 0,
+        "status": "active",
+        "priority": 0,
+        "max_triggers_per_user": None,
+        "cooldown_minutes": None,
+    }
+
+    [armed] = await _timers(rule.id, TimerKind.RULE_SCHEDULE)
+    assert (await client.put(f"/api/automation/rules/{rule.id}", json=body)).status_code == 200
+    timers = await _timers(rule.id, TimerKind.RULE_SCHEDULE)
+    assert [(timer.id, timer.status) for timer in timers] == [(armed.id, TimerStatus.PENDING.value)]
+
+    body["trigger_schedule"] = {"interval_minutes": 30}
+    assert (await client.put(f"/api/automation/rules/{rule.id}", json=body)).status_code == 200
+    timers = await _timers(rule.id, TimerKind.RULE_SCHEDULE)
+    assert [timer.status for timer in timers] == [TimerStatus.CANCELLED.value, TimerStatus.PENDING.value]
+
+
+async def test_failed_delayed_reply_gives_back_its_trigger(graph, monkeypatch):
+    account = await create_account()
+    rule = await _add_rule(
+        account,
+        trigger_type=TriggerType.KEYWORD,
+        trigger_keywords=["price"],
+        reply_message="Prices are on our site",
+        reply_delay_seconds=60,
+        max_triggers_per_user=1
+    )
+    sender = f"customer-{rule.id}"
+
+    async with AsyncSessionLocal() as db:
+        await process_webhook_events([messaging_event(account, sender, "price?")], db)
+    [timer] = await _timers(rule.id, TimerKind.REPLY)
+    assert timer.trigger_acquired_at is not None
+
+    async def fail(account, recipient_id, message_text):
+        raise RuntimeError("Graph API unavailable")
+
+    monkeypatch.setattr(InstagramService, "send_message", fail)
+    await timer_engine._fire([timer.id])
+    [timer] = await _timers(rule.id, TimerKind.REPLY)
+    assert timer.status == TimerStatus.FAILED.value
+
+    # The cap of one trigger is not used up by the reply that was never sent
+    async with AsyncSessionLocal() as db:
+        await trigger_store.load(db, [(rule.id, sender)])
+    assert trigger_store.acquire(rule, sender, timer.trigger_acquired_at) is not None
@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+from app.models.instagram_account import InstagramAccount
+from app.services.auth_cache import UserPrincipal
+from app.services.auth_service import get_current_principal
+from app.services.instagram_service import InstagramService
+from app.services.service_lease import acquire_lease, release_lease
+from app.services.token_refresher import TokenRefresher
+from main import app
+
+from tests.factories import create_account
+
+
+@pytest.fixture
+def exchanges(monkeypatch):
+    """Tokens sent to the stubbed token exchange"""
+    exchanged = []
+
+    async def exchange_token(access_token):
+        exchanged.append(access_token)
+        return f"refreshed-{access_token}", datetime.utcnow() + timedelta(days=60)
+
+    monkeypatch.setattr(InstagramService, "exchange_token", exchange_token)
+    monkeypatch.setattr(settings, "FACEBOOK_APP_ID", "app-id")
+    monkeypatch.setattr(settings, "FACEBOOK_APP_SECRET", "app-secret")
+    return exchanged
+
+
+async def _connect(account, token: str, **extra) -> InstagramAccount:
+    app.dependency_overrides[get_current_principal] = lambda: UserPrincipal(id=account.user_id, is_active=True)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/api/instagram/connect", json={
+                "instagram_business_account_id": account.instagram_business_account_id,
+                "username": account.username,
+                "profile_picture_url": None,
+                "page_id": account.page_id,
+                "page_access_token": token,
+                **extra,
+            })
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 200
+    async with AsyncSessionLocal() as db:
+        return await db.get(InstagramAccount, account.id)
+
+
+async def test_connected_token_without_expiry_is_refreshed_right_away(exchanges):
+    account = await create_account()
+    unknown = await _connect(account, "token-unknown")
+    assert unknown.token_expires_at is None
+
+    await TokenRefresher().refresh_expiring()
+
+    assert "token-unknown" in exchanges
+    async with AsyncSessionLocal() as db:
+        refreshed = await db.get(InstagramAccount, account.id)
+    assert refreshed.page_access_token == "refreshed-token-unknown"
+    assert refreshed.token_expires_at is not None
+
+
+async def test_connected_token_with_expires_in_keeps_its_expiry(exchanges):
+    account = await create_account()
+    connected = await _connect(account, "token-known", expires_in=60 * 24 * 3600)
+    assert connected.token_expires_at > datetime.utcnow() + timedelta(days=59)
+
+    await TokenRefresher().refresh_expiring()
+
+    assert "token-known" not in exchanges
+
+
+async def test_only_one_process_holds_the_lease():
+    async with AsyncSessionLocal() as db:
+        assert await acquire_lease(db, "test-lease", "first", ttl_seconds=60)
+        assert not await acquire_lease(db, "test-lease", "second", ttl_seconds=60)
+        # Renewal by the holder
+        assert await acquire_lease(db, "test-lease", "first", ttl_seconds=60)
+        await release_lease(db, "test-lease", "first")
+        assert await acquire_lease(db, "test-lease", "second", ttl_seconds=0)
+        # An expired lease is taken over
+        await asyncio.sleep(0.01)
+        assert await acquire_lease(db, "test-lease", "first", ttl_seconds=60)
+
+
+async def test_only_the_lease_holder_refreshes(exchanges, monkeypatch):
+    monkeypatch.setattr(settings, "TOKEN_REFRESH_INTERVAL_SECONDS", 0.05)
+    refreshers = [TokenRefresher(), TokenRefresher()]
+    for refresher in refreshers:
+        await refresher.start()
+    await asyncio.sleep(0.3)
+    leaders = [refresher.is_leader for refresher in refreshers]
+    runs = [refresher.last_run_at is not None for refresher in refreshers]
+    for refresher in refreshers:
+        await refresher.stop()
+
+    assert sorted(leaders) == [False, True]
+    assert runs == leaders
@@ -0,0 +1,225 @@
+import asyncio
+import random
+import uuid
+
+import pytest
+from sqlalchemy import event
+
+from app.core.config import settings
+from app.database import AsyncSessionLocal, async_engine
+from app.services import webhook_queue as webhook_queue_module
+from app.services.webhook_processor import process_webhook_events
+from app.services.webhook_queue import WebhookQueue
+
+from tests.factories import create_account, messaging_event
+
+
+def _event(sender: str, n: int, recipient: str = "ig-1") -> dict:
+    return {"sender": {"id": sender}, "recipient": {"id": recipient}, "n": n}
+
+
+@pytest.fixture
+def commits():
+    counter = {"count": 0}
+
+    def on_commit(connection):
+        counter["count"] += 1
+
+    event.listen(async_engine.sync_engine, "commit", on_commit)
+    yield counter
+    event.remove(async_engine.sync_engine, "commit", on_commit)
+
+
+async def test_one_payload_across_conversations_is_committed_like_a_direct_call(graph, commits):
+    account = await create_account(keywords=["price"])
+
+    def payload():
+        return [messaging_event(account, f"customer-{i}", "price?" if i % 2 else "hello") for i in range(10)]
+
+    commits["count"] = 0
+    async with AsyncSessionLocal() as db:
+        await process_webhook_events(payload(), db)
+    direct = commits["count"]
+
+    queue = WebhookQueue(maxsize=100, workers=4, lane_maxsize=10, batch_max_events=500)
+    await queue.start()
+    commits["count"] = 0
+    assert await queue.submit(payload(), wait=True)
+    queued = commits["count"]
+    stats = queue.stats()
+    await queue.stop(timeout=1)
+
+    assert queued == direct
+    assert stats["batches"] == 1
+    assert stats["processed"] == 10
+    assert len(graph.sent) == 10
+
+
+async def test_events_of_one_conversation_stay_in_order(monkeypatch):
+    seen = {}
+    active = {"now": 0, "max": 0}
+
+    async def fake_process(events, db):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(random.random() * 0.005)
+        for queued in events:
+            seen.setdefault(queued["sender"]["id"], []).append(queued["n"])
+        active["now"] -= 1
+
+    monkeypatch.setattr(webhook_queue_module, "process_webhook_events", fake_process)
+    queue = WebhookQueue(maxsize=50, workers=4, lane_maxsize=5, batch_max_events=8)
+    await queue.start()
+
+    async def sender(name):
+        for n in range(20):
+            assert await queue.submit([_event(name, n)], wait=n % 2 == 0)
+
+    await asyncio.gather(*(sender(f"sender-{i}") for i in range(30)))
+    await queue.stop(timeout=1)
+
+    assert all(ns == list(range(20)) for ns in seen.values())
+    assert len(seen) == 30
+    assert 1 < active["max"] <= 4
+    # Lanes are dropped when empty; nothing lingers per conversation
+    assert queue.stats()["lanes"] == 0
+
+
+async def test_full_queue_rejects_after_the_enqueue_timeout(monkeypatch):
+    release = asyncio.Event()
+
+    async def stalled(events, db):
+        await release.wait()
+
+    monkeypatch.setattr(webhook_queue_module, "process_webhook_events", stalled)
+    monkeypatch.setattr(settings, "WEBHOOK_ENQUEUE_TIMEOUT_SECONDS", 0.05)
+    queue = WebhookQueue(maxsize=5, workers=1, lane_maxsize=100, batch_max_events=500)
+    await queue.start()
+
+    assert await queue.submit([_event("a", n) for n in range(5)])
+    await asyncio.sleep(0)
+    assert await queue.submit([_event("b", n) for n in range(5)]) is False
+    assert queue.stats()["rejected"] == 1
+
+    release.set()
+    await queue.stop(timeout=1)
+    assert queue.stats()["depth"] == 0
+
+
+async def test_failed_batch_is_reported_to_waiting_submitters(monkeypatch):
+    async def broken(events, db):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(webhook_queue_module, "process_webhook_events", broken)
+    queue = WebhookQueue(maxsize=10, workers=1, lane_maxsize=10, batch_max_events=500)
+    await queue.start()
+
+    with pytest.raises(RuntimeError):
+        await queue.submit([_event("a", 0)], wait=True)
+    await queue.stop(timeout=1)
+    assert queue.stats()["failed"] == 1
+
+
+async def test_replies_of_different_conversations_are_sent_concurrently_outside_the_transaction(monkeypatch):
+    from app.services.instagram_service import InstagramService
+    from app.services.send_scheduler import send_scheduler
+
+    sends = {"now": 0, "max": 0, "connections": []}
+    connections = {"open": 0}
+
+    def checkout(*args):
+        connections["open"] += 1
+
+    def checkin(*args):
+        connections["open"] -= 1
+
+    async def slow_send(account, recipient_id, message_text):
+        sends["now"] += 1
+        sends["max"] = max(sends["max"], sends["now"])
+        sends["connections"].append(connections["open"])
+        await asyncio.sleep(0.05)
+        sends["now"] -= 1
+        return {"recipient_id": recipient_id, "message_id": f"reply-{uuid.uuid4().hex}"}
+
+    monkeypatch.setattr(InstagramService, "send_message", slow_send)
+    account = await create_account(keywords=["price"])
+    queue = WebhookQueue(maxsize=100, workers=1, lane_maxsize=10, batch_max_events=500)
+    await queue.start()
+    event.listen(async_engine.sync_engine, "checkout", checkout)
+    event.listen(async_engine.sync_engine, "checkin", checkin)
+    try:
+        assert await queue.submit(
+            [messaging_event(account, f"customer-{uuid.uuid4().hex[:8]}", "price?") for _ in range(5)],
+            wait=True
+        )
+    finally:
+        event.remove(async_engine.sync_engine, "checkout", checkout)
+        event.remove(async_engine.sync_engine, "checkin", checkin)
+        await queue.stop(timeout=1)
+        await send_scheduler.stop(timeout=1)
+
+    assert sends["max"] == 5
+    assert sends["connections"] == [0] * 5
+
+
+async def test_a_poison_event_fails_only_its_own_lane(monkeypatch):
+    batches = []
+
+    async def fussy(events, db):
+        batches.append([event["sender"]["id"] for event in events])
+        if any(event.get("poison") for event in events):
+            raise ValueError("cannot store this event")
+        return {}
+
+    monkeypatch.setattr(webhook_queue_module, "process_webhook_events", fussy)
+    queue = WebhookQueue(maxsize=10, workers=1, lane_maxsize=10, batch_max_events=500)
+    await queue.start()
+    # Queued without yielding, so both payloads land in one batch
+    good = await queue.enqueue([_event("a", 0), _event("b", 0)], track=True)
+    poison = await queue.enqueue([{**_event("c", 0), "poison": True}], track=True)
+    results = await asyncio.gather(*good, *poison, return_exceptions=True)
+    await queue.stop(timeout=1)
+
+    assert results[:2] == [None, None]
+    assert isinstance(results[2], ValueError)
+    assert batches[0] == ["a", "b", "c"]
+    assert sorted(batches[1:]) == [["a"], ["b"], ["c"]]
+    assert queue.stats()["processed"] == 2
+    assert queue.stats()["failed"] == 1
+
+
+async def test_an_unparsable_event_does_not_fail_the_rest_of_the_payload(graph):
+    account = await create_account(keywords=["price"])
+    good = messaging_event(account, f"customer-{uuid.uuid4().hex[:8]}", "price?")
+    broken = {**messaging_event(account, f"customer-{uuid.uuid4().hex[:8]}", "price?"), "message": "not an object"}
+
+    async with AsyncSessionLocal() as db:
+        failures = await process_webhook_events([broken, good], db)
+
+    assert list(failures) == [(account.instagram_business_account_id, broken["sender"]["id"])]
+    assert graph.sent == [(good["sender"]["id"], "Thanks!")]
+
+
+async def test_events_without_a_timestamp_are_stored_with_the_receive_time(graph):
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import select
+
+    from app.models.message import Message
+
+    account = await create_account(keywords=["price"])
+    undated = messaging_event(account, f"customer-{uuid.uuid4().hex[:8]}", "price?")
+    del undated["timestamp"]
+    dated = messaging_event(account, f"customer-{uuid.uuid4().hex[:8]}", "price?")
+
+    async with AsyncSessionLocal() as db:
+        assert await process_webhook_events([undated, dated], db) == {}
+        result = await db.execute(
+            select(Message.message_id, Message.sent_at).where(
+                Message.message_id.in_([undated["message"]["mid"], dated["message"]["mid"]])
+            )
+        )
+        sent_at = dict(result.all())
+
+    assert abs(sent_at[undated["message"]["mid"]] - datetime.now()) < timedelta(minutes=1)
+    assert len(graph.sent) == 2
@@ -0,0 +1,57 @@
+"""
+Standalone webhook consumer for WEBHOOK_PROCESSING_MODE=sharded.
+
+Run one or more per host, next to API processes that only take in
+webhooks (WEBHOOK_SHARD_CONSUME=false) or alongside regular ones:
+
+    python webhook_worker.py
+
+Consumers share the partitions of the event log on REDIS_URL and
+rebalance them as processes start and stop. Timers, campaigns and token
+refresh keep running in the API processes.
+"""
+import asyncio
+import signal
+
+from app.core.config import settings
+from app.database import async_engine
+from app.services.event_log import close_event_log
+from app.services.graph_batch import graph_batcher
+from app.services.http_client import init_graph_client, close_graph_client
+from app.services.send_scheduler import send_scheduler
+from app.services.sharded_consumer import sharded_consumer
+from app.services.trigger_store import trigger_store
+from app.services.webhook_queue import webhook_queue
+
+
+async def main():
+    if settings.WEBHOOK_PROCESSING_MODE != "sharded":
+        print("WEBHOOK_PROCESSING_MODE is not sharded; nothing to consume")
+        return
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    await init_graph_client()
+    await trigger_store.start()
+    await webhook_queue.start()
+    await sharded_consumer.start()
+    print(f"Webhook consumer {sharded_consumer.worker_id} started")
+
+    await stopping.wait()
+
+    print("Shutting down...")
+    await sharded_consumer.stop(timeout=settings.WEBHOOK_SHUTDOWN_TIMEOUT_SECONDS)
+    await webhook_queue.stop(timeout=settings.WEBHOOK_SHUTDOWN_TIMEOUT_SECONDS)
+    await send_scheduler.stop(timeout=settings.WEBHOOK_SHUTDOWN_TIMEOUT_SECONDS)
+    await trigger_store.stop()
+    await graph_batcher.close()
+    await close_graph_client()
+    await close_event_log()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -30,10 +30,10 @@ interface Conversation {
 }
 
 interface Message {
-  id: string;
+  id: number;
   sender_id: string;
   message_text?: string;
-  created_time: string;
+  sent_at?: string;
   is_from_me?: boolean;
   attachments?: any[];
 }
@@ -42,12 +42,15 @@ export default function InboxPage() {
   const [accounts, setAccounts] = useState<InstagramAccount[]>([]);
   const [selectedAccount, setSelectedAccount] = useState<InstagramAccount | null>(null);
   const [conversations, setConversations] = useState<Conversation[]>([]);
+  const [conversationsCursor, setConversationsCursor] = useState<string | null>(null);
   const [selectedConversation, setSelectedConversation] = useState<Conversation | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  const [messagesCursor, setMessagesCursor] = useState<string | null>(null);
   const [messageText, setMessageText] = useState('');
   const [loading, setLoading] = useState(true);
   const [loadingConversations, setLoadingConversations] = useState(false);
   const [loadingMessages, setLoadingMessages] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [sending, setSending] = useState(false);
 
   useEffect(() => {
@@ -81,14 +84,16 @@ export default function InboxPage() {
     }
   };
 
-  const fetchConversations = async () => {
+  // refresh pulls the inbox from Instagram first; otherwise pages come from the local store
+  const fetchConversations = async (refresh = false) => {
     if (!selectedAccount) return;
     setLoadingConversations(true);
     try {
-      const data = await apiClient.getConversations(selectedAccount.id);
-      setConversations(data);
-      if (data.length > 0 && !selectedConversation) {
-        setSelectedConversation(data[0]);
+      const page = await apiClient.getConversations<Conversation>(selectedAccount.id, null, refresh);
+      setConversations(page.items);
+      setConversationsCursor(page.nextCursor);
+      if (page.items.length > 0 && !selectedConversation) {
+        setSelectedConversation(page.items[0]);
       }
     } catch (error: any) {
       toast.error('Failed to load conversations');
@@ -98,12 +103,13 @@ export default function InboxPage() {
     }
   };
 
-  const fetchMessages = async () => {
+  const fetchMessages = async (refresh = false) => {
     if (!selectedConversation) return;
     setLoadingMessages(true);
     try {
-      const data = await apiClient.getMessages(selectedConversation.id);
-      setMessages(data);
+      const page = await apiClient.getMessages<Message>(selectedConversation.id, null, refresh);
+      setMessages(page.items);
+      setMessagesCursor(page.nextCursor);
     } catch (error: any) {
       toast.error('Failed to load messages');
       console.error(error);
@@ -112,6 +118,43 @@ export default function InboxPage() {
     }
   };
 
+  const syncFromInstagram = async () => {
+    await fetchConversations(true);
+    if (selectedConversation) {
+      await fetchMessages(true);
+    }
+  };
+
+  const loadMoreConversations = async () => {
+    if (!selectedAccount || !conversationsCursor) return;
+    setLoadingMore(true);
+    try {
+      const page = await apiClient.getConversations<Conversation>(selectedAccount.id, conversationsCursor);
+      setConversations((current) => [...current, ...page.items]);
+      setConversationsCursor(page.nextCursor);
+    } catch (error: any) {
+      toast.error('Failed to load conversations');
+      console.error(error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const loadOlderMessages = async () => {
+    if (!selectedConversation || !messagesCursor) return;
+    setLoadingMore(true);
+    try {
+      const page = await apiClient.getMessages<Message>(selectedConversation.id, messagesCursor);
+      setMessages((current) => [...current, ...page.items]);
+      setMessagesCursor(page.nextCursor);
+    } catch (error: any) {
+      toast.error('Failed to load messages');
+      console.error(error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSendMessage = async (e: React.FormEvent) => {
     e.preventDefault();
     if (!messageText.trim() || !selectedAccount || !selectedConversation) return;
@@ -188,7 +231,7 @@ export default function InboxPage() {
               <span className="text-sm text-muted-foreground">
                 @{selectedAccount?.username}
               </span>
-              <Button variant="outline" size="sm" onClick={fetchConversations}>
+              <Button variant="outline" size="sm" onClick={syncFromInstagram}>
                 <RefreshCw className="h-4 w-4 mr-2" />
                 Refresh
               </Button>
@@ -243,6 +286,17 @@ export default function InboxPage() {
                           )}
                         </button>
                       ))}
+                      {conversationsCursor && (
+                        <Button
+                          variant="ghost"
+                          size="sm"
+                          className="w-full"
+                          onClick={loadMoreConversations}
+                          disabled={loadingMore}
+                        >
+                          Load more
+                        </Button>
+                      )}
                     </div>
                   )}
                 </ScrollArea>
@@ -300,14 +354,25 @@ export default function InboxPage() {
                                       isFromMe ? 'text-primary-foreground/70' : 'text-muted-foreground'
                                     }`}
                                   >
-                                    {msg.created_time
-                                      ? format(new Date(msg.created_time), 'h:mm a')
+                                    {msg.sent_at
+                                      ? format(new Date(msg.sent_at), 'h:mm a')
                                       : ''}
                                   </p>
                                 </div>
                               </div>
                             );
                           })}
+                          {messagesCursor && (
+                            <Button
+                              variant="ghost"
+                              size="sm"
+                              className="w-full"
+                              onClick={loadOlderMessages}
+                              disabled={loadingMore}
+                            >
+                              Load older messages
+                            </Button>
+                          )}
                         </div>
                       )}
                     </ScrollArea>
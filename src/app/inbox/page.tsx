@@ -7,7 +7,7 @@ import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { Textarea } from "@/components/ui/textarea";
 import { ScrollArea } from "@/components/ui/scroll-area";
-import { MessageSquare, Send, Loader2, User, ArrowLeft } from "lucide-react";
+import { MessageSquare, Send, Loader2, User, ArrowLeft, RefreshCw } from "lucide-react";
 import { apiClient } from "@/lib/api-client";
 import { InstagramAccount, Conversation, Message } from "@/types";
 
@@ -17,11 +17,15 @@ export default function Inbox() {
   const [accounts, setAccounts] = useState<InstagramAccount[]>([]);
   const [selectedAccount, setSelectedAccount] = useState<InstagramAccount | null>(null);
   const [conversations, setConversations] = useState<Conversation[]>([]);
+  const [conversationsCursor, setConversationsCursor] = useState<string | null>(null);
   const [selectedConversation, setSelectedConversation] = useState<Conversation | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  const [messagesCursor, setMessagesCursor] = useState<string | null>(null);
   const [messageText, setMessageText] = useState("");
   const [sending, setSending] = useState(false);
   const [loadingMessages, setLoadingMessages] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [refreshing, setRefreshing] = useState(false);
 
   useEffect(() => {
     const loadAccounts = async () => {
@@ -49,21 +53,24 @@ export default function Inbox() {
     loadAccounts();
   }, [router]);
 
-  const loadConversations = async (accountId: number) => {
+  // refresh pulls the inbox from Instagram first; otherwise pages come from the local store
+  const loadConversations = async (accountId: number, refresh = false) => {
     try {
-      const conversationsData = await apiClient.getConversations(accountId);
-      setConversations(conversationsData);
+      const page = await apiClient.getConversations(accountId, null, refresh);
+      setConversations(page.items);
+      setConversationsCursor(page.nextCursor);
     } catch (error) {
       console.error("Failed to load conversations:", error);
     }
   };
 
-  const loadMessages = async (conversation: Conversation) => {
+  const loadMessages = async (conversation: Conversation, refresh = false) => {
     setLoadingMessages(true);
     setSelectedConversation(conversation);
     try {
-      const messagesData = await apiClient.getMessages(conversation.id);
-      setMessages(messagesData);
+      const page = await apiClient.getMessages(conversation.id, null, refresh);
+      setMessages(page.items);
+      setMessagesCursor(page.nextCursor);
     } catch (error) {
       console.error("Failed to load messages:", error);
     } finally {
@@ -71,6 +78,47 @@ export default function Inbox() {
     }
   };
 
+  const syncFromInstagram = async () => {
+    if (!selectedAccount) return;
+    setRefreshing(true);
+    try {
+      await loadConversations(selectedAccount.id, true);
+      if (selectedConversation) {
+        await loadMessages(selectedConversation, true);
+      }
+    } finally {
+      setRefreshing(false);
+    }
+  };
+
+  const loadMoreConversations = async () => {
+    if (!selectedAccount || !conversationsCursor) return;
+    setLoadingMore(true);
+    try {
+      const page = await apiClient.getConversations(selectedAccount.id, conversationsCursor);
+      setConversations((current) => [...current, ...page.items]);
+      setConversationsCursor(page.nextCursor);
+    } catch (error) {
+      console.error("Failed to load conversations:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const loadOlderMessages = async () => {
+    if (!selectedConversation || !messagesCursor) return;
+    setLoadingMore(true);
+    try {
+      const page = await apiClient.getMessages(selectedConversation.id, messagesCursor);
+      setMessages((current) => [...current, ...page.items]);
+      setMessagesCursor(page.nextCursor);
+    } catch (error) {
+      console.error("Failed to load messages:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSendMessage = async () => {
     if (!messageText.trim() || !selectedAccount || !selectedConversation) return;
 
@@ -140,8 +188,11 @@ export default function Inbox() {
       <div className="grid lg:grid-cols-12 gap-4 h-[calc(100vh-200px)]">
         {/* Conversations List */}
         <Card className="lg:col-span-4">
-          <CardHeader>
+          <CardHeader className="flex flex-row items-center justify-between">
             <CardTitle>Conversations</CardTitle>
+            <Button variant="ghost" size="sm" onClick={syncFromInstagram} disabled={refreshing}>
+              <RefreshCw className={`h-4 w-4 ${refreshing ? "animate-spin" : ""}`} />
+            </Button>
           </CardHeader>
           <CardContent className="p-0">
             <ScrollArea className="h-[calc(100vh-300px)]">
@@ -183,6 +234,19 @@ export default function Inbox() {
                       </div>
                     </div>
                   ))}
+                  {conversationsCursor && (
+                    <div className="p-2">
+                      <Button
+                        variant="ghost"
+                        size="sm"
+                        className="w-full"
+                        onClick={loadMoreConversations}
+                        disabled={loadingMore}
+                      >
+                        Load more
+                      </Button>
+                    </div>
+                  )}
                 </div>
               )}
             </ScrollArea>
@@ -251,6 +315,17 @@ export default function Inbox() {
                           </div>
                         </div>
                       ))}
+                      {messagesCursor && (
+                        <Button
+                          variant="ghost"
+                          size="sm"
+                          className="w-full"
+                          onClick={loadOlderMessages}
+                          disabled={loadingMore}
+                        >
+                          Load older messages
+                        </Button>
+                      )}
                     </div>
                   )}
                 </ScrollArea>
@@ -1,5 +1,11 @@
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
 
+export interface Page<T> {
+  items: T[];
+  // Pass back to get the next page; null on the last one
+  nextCursor: string | null;
+}
+
 class ApiClient {
   private baseUrl: string;
 
@@ -22,10 +28,7 @@ class ApiClient {
     return headers;
   }
 
-  private async request<T>(
-    endpoint: string,
-    options: RequestInit = {}
-  ): Promise<T> {
+  private async send(endpoint: string, options: RequestInit = {}): Promise<Response> {
     const url = `${this.baseUrl}${endpoint}`;
     const config: RequestInit = {
       ...options,
@@ -44,9 +47,30 @@ class ApiClient {
       throw new Error(error.detail || `HTTP error! status: ${response.status}`);
     }
 
+    return response;
+  }
+
+  private async request<T>(
+    endpoint: string,
+    options: RequestInit = {}
+  ): Promise<T> {
+    const response = await this.send(endpoint, options);
     return response.json();
   }
 
+  // refresh=true makes the backend sync from the Graph API before reading its local store
+  private async requestPage<T>(endpoint: string, cursor?: string | null, refresh = false): Promise<Page<T>> {
+    const params = new URLSearchParams();
+    if (cursor) params.set("cursor", cursor);
+    if (refresh) params.set("refresh", "true");
+    const query = params.toString() ? `?${params}` : "";
+    const response = await this.send(`${endpoint}${query}`);
+    return {
+      items: await response.json(),
+      nextCursor: response.headers.get("X-Next-Cursor"),
+    };
+  }
+
   // Auth endpoints
   async getFacebookLoginUrl() {
     return this.request<{ auth_url: string }>("/api/auth/login");
@@ -69,15 +93,19 @@ class ApiClient {
     return this.request<any>("/api/instagram/connect", { method: "POST" });
   }
 
-  async getConversations(accountId: number) {
-    return this.request<any[]>(
-      `/api/instagram/accounts/${accountId}/conversations`
+  async getConversations(accountId: number, cursor?: string | null, refresh = false) {
+    return this.requestPage<any>(
+      `/api/instagram/accounts/${accountId}/conversations`,
+      cursor,
+      refresh
     );
   }
 
-  async getMessages(conversationId: number) {
-    return this.request<any[]>(
-      `/api/instagram/conversations/${conversationId}/messages`
+  async getMessages(conversationId: number, cursor?: string | null, refresh = false) {
+    return this.requestPage<any>(
+      `/api/instagram/conversations/${conversationId}/messages`,
+      cursor,
+      refresh
     );
   }
 
@@ -4,6 +4,12 @@
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
+export interface Page<T> {
+  items: T[];
+  // Pass back to get the next page; null on the last one
+  nextCursor: string | null;
+}
+
 class ApiClient {
   private baseUrl: string;
   private token: string | null = null;
@@ -30,10 +36,7 @@ class ApiClient {
     return this.token;
   }
 
-  private async request<T>(
-    endpoint: string,
-    options: RequestInit = {}
-  ): Promise<T> {
+  private async send(endpoint: string, options: RequestInit = {}): Promise<Response> {
     const headers: HeadersInit = {
       'Content-Type': 'application/json',
       ...options.headers,
@@ -53,9 +56,30 @@ class ApiClient {
       throw new Error(error.detail || `HTTP ${response.status}`);
     }
 
+    return response;
+  }
+
+  private async request<T>(
+    endpoint: string,
+    options: RequestInit = {}
+  ): Promise<T> {
+    const response = await this.send(endpoint, options);
     return response.json();
   }
 
+  // refresh=true makes the backend sync from the Graph API before reading its local store
+  private async requestPage<T>(endpoint: string, cursor?: string | null, refresh = false): Promise<Page<T>> {
+    const params = new URLSearchParams();
+    if (cursor) params.set('cursor', cursor);
+    if (refresh) params.set('refresh', 'true');
+    const query = params.toString() ? `?${params}` : '';
+    const response = await this.send(`${endpoint}${query}`);
+    return {
+      items: await response.json(),
+      nextCursor: response.headers.get('X-Next-Cursor'),
+    };
+  }
+
   // Auth endpoints
   async getAuthUrl(): Promise<{ auth_url: string }> {
     return this.request('/api/auth/login');
@@ -85,12 +109,12 @@ class ApiClient {
     return this.request('/api/instagram/connected-accounts');
   }
 
-  async getConversations(accountId: number) {
-    return this.request(`/api/instagram/accounts/${accountId}/conversations`);
+  async getConversations<T = any>(accountId: number, cursor?: string | null, refresh = false) {
+    return this.requestPage<T>(`/api/instagram/accounts/${accountId}/conversations`, cursor, refresh);
   }
 
-  async getMessages(conversationId: number) {
-    return this.request(`/api/instagram/conversations/${conversationId}/messages`);
+  async getMessages<T = any>(conversationId: number, cursor?: string | null, refresh = false) {
+    return this.requestPage<T>(`/api/instagram/conversations/${conversationId}/messages`, cursor, refresh);
   }
 
   async sendMessage(accountId: number, data: { recipient_id: string; message_text: string; conversation_id?: number }) {